@@ -1,11 +1,13 @@
 # ActivitySim
 # See full license in LICENSE.txt.
 import logging
+from collections import OrderedDict
 
 import pandas as pd
 import numpy as np
 
 from activitysim.core import assign
+from activitysim.core import expression_compiler
 from activitysim.core import tracing
 from activitysim.core import config
 from activitysim.core import inject
@@ -14,6 +16,13 @@ from activitysim.core import pipeline
 
 logger = logging.getLogger(__name__)
 
+# default max number of O-D pairs evaluated at once (origin zones are processed in blocks of this size)
+DEFAULT_BLOCK_OD_PAIRS = 2 ** 22
+
+# errors raised by expressions that use pandas methods (or their keyword args) on ndarray columns
+# (e.g. df.RETEMPN.str or df.RETEMPN.clip(upper=50)), which can only be evaluated on the od dataframe
+PANDAS_ONLY_ERRORS = (AttributeError, TypeError, ValueError)
+
 
 class AccessibilitySkims(object):
     """
@@ -30,6 +39,9 @@ class AccessibilitySkims(object):
         array is correct shape to match (flattened) O-D tiled columns in the od dataframe
     transpose: bool
         whether to transpose the matrix before flattening. (i.e. act as a D-O instead of O-D skim)
+
+    Skim values are returned for the orig zones in the current origin block (see set_block), either as
+    (orig, dest) matrices or flattened to match the tiled O-D rows of the block's od dataframe.
     """
 
     def __init__(self, skim_dict, orig_zones, dest_zones, transpose=False):
@@ -70,10 +82,25 @@ class AccessibilitySkims(object):
             self.orig_map = orig_map
             self.dest_map = dest_map
 
+        self.orig_block = slice(None)
+        self.matrix = False
+
+    def set_block(self, orig_block, matrix):
+        """
+        Parameters
+        ----------
+        orig_block : slice
+            positions in orig_zones of the origins for which to return skim values
+        matrix : bool
+            return (orig, dest) matrices rather than flattened arrays
+        """
+        self.orig_block = orig_block
+        self.matrix = matrix
+
     def __getitem__(self, key):
         """
-        accessor to return flattened skim array with specified key
-        flattened array will have length length*length and will match tiled OD df used by assign
+        accessor to return skim array with specified key for origins in current block
+        flattened array will have length len(block)*len(dest) and will match tiled OD df used by assign
 
         this allows the skim array to be accessed from expressions as
         skim['DISTANCE'] or skim[('SOVTOLL_TIME', 'MD')]
@@ -92,9 +119,197 @@ class AccessibilitySkims(object):
             # data = data[orig_map, :][:, dest_map]    # <- RIGHT
             # data = data[np.ix_(orig_map, dest_map)]  # <- ALSO RIGHT
 
-            data = data[self.orig_map, :][:, self.dest_map]
+            data = data[self.orig_map[self.orig_block], :][:, self.dest_map]
+
+        else:
+            data = data[self.orig_block]
+
+        if self.matrix:
+            return data
+
+        # ravel only copies if data is not already contiguous (e.g. od_major skim_layout or transposed)
+        return data.ravel()
+
+
+class AccessibilityODFrame(object):
+    """
+    Stand-in for the od dataframe when evaluating accessibility expressions over (orig, dest) matrices
+
+    Columns are accessed like dataframe columns (df.TOTEMP or df['TOTEMP']) but orig is an (orig, 1)
+    column vector and dest and the land_use columns are (1, dest) row vectors, so that they broadcast
+    to (orig, dest) matrices in expressions with skims.
+    """
+
+    def __init__(self, orig_zones, land_use_df):
+
+        self.columns = OrderedDict()
+        self.columns['orig'] = np.asanyarray(orig_zones).reshape(-1, 1)
+        self.columns['dest'] = np.asanyarray(land_use_df.index).reshape(1, -1)
+        for c in land_use_df.columns:
+            self.columns[c] = land_use_df[c].values.reshape(1, -1)
+
+    def __getattr__(self, name):
+        columns = self.__dict__.get('columns', {})
+        if name in columns:
+            return columns[name]
+        raise AttributeError("AccessibilityODFrame has no column '%s'" % name)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+
+def assign_od_matrix_variables(assignment_spec, od_frame, locals_dict, shape):
+    """
+    Evaluate assignment spec over (orig, dest) matrices and sum non-temp targets over destinations
+
+    Follows the conventions of assign.assign_variables (temp and temp scalar targets, recycled targets,
+    and previously assigned targets as locals) but never builds the long O-D table.
+
+    Parameters
+    ----------
+    assignment_spec : pandas.DataFrame
+        assignment spec with target and expression columns
+    od_frame : AccessibilityODFrame
+    locals_dict : dict
+    shape : tuple
+        (orig, dest) shape of the block
+
+    Returns
+    -------
+    sums : OrderedDict
+        target name => 1-D array of per-origin sums over destinations
+    """
+
+    np_logger = assign.NumpyLogger(logger)
+
+    _locals_dict = assign.local_utilities()
+    _locals_dict.update(locals_dict)
+    _locals_dict['df'] = od_frame
+
+    # since we allow targets to be recycled, we want to only keep the last usage
+    variables = OrderedDict()
+
+    for target, expression in zip(assignment_spec.target, assignment_spec.expression):
+
+        code = expression_compiler.compile_python_expression(expression)
+
+        try:
+            if target.startswith('_') and target.isupper() or target == '_':
+                x = eval(code, globals(), _locals_dict)
+                if target != '_':
+                    _locals_dict[target] = x
+                continue
+
+            np_logger.target = str(target)
+            np_logger.expression = str(expression)
+            with np.errstate(all='log', call=np_logger):
+                values = eval(code, {}, _locals_dict)
+
+        except PANDAS_ONLY_ERRORS as err:
+            # not logged as an error, as accessibility_sums falls back to evaluating the spec on the od
+            # dataframe (which raises and logs any genuine error)
+            raise err
+        except Exception as err:
+            logger.error("assign_od_matrix_variables error: %s: %s", type(err).__name__, str(err))
+            logger.error("assign_od_matrix_variables expression: %s = %s", str(target), str(expression))
+            raise err
+
+        if not target.startswith('_'):
+            variables[target] = values
+
+        # update locals to allows us to ref previously assigned targets
+        _locals_dict[target] = values
 
-        return data.flatten()
+    return OrderedDict(
+        (target, np.broadcast_to(values, shape).sum(axis=1)) for target, values in variables.items())
+
+
+def od_block_df(orig_zones, land_use_df):
+    """
+    od dataframe with one row per (orig, dest) pair of orig_zones and land_use_df zones (in orig-major order)
+    with land_use_df columns for dest zone
+    """
+
+    dest_zone_count = len(land_use_df.index)
+
+    od_df = pd.DataFrame(
+        data={
+            'orig': np.repeat(np.asanyarray(orig_zones), dest_zone_count),
+            'dest': np.tile(np.asanyarray(land_use_df.index), len(orig_zones))
+        }
+    )
+
+    for c in land_use_df.columns:
+        od_df[c] = np.tile(land_use_df[c].values, len(orig_zones))
+
+    return od_df
+
+
+def accessibility_sums(assignment_spec, orig_zones, land_use_df, skims, locals_d, block_size, trace_label,
+                       matrix=True):
+    """
+    Evaluate assignment spec for blocks of origins and sum results over destinations
+
+    Expressions are evaluated over (orig, dest) matrices unless they can only be evaluated on the
+    (long) od dataframe (e.g. if they use pandas methods, see PANDAS_ONLY_ERRORS), in which case we
+    fall back to evaluating them with assign.assign_variables on the od dataframe for each block of
+    origins. Other errors are raised.
+
+    Parameters
+    ----------
+    assignment_spec : pandas.DataFrame
+    orig_zones : numpy.ndarray
+    land_use_df : pandas.DataFrame
+        land_use columns for dest zones
+    skims : list of AccessibilitySkims
+        skims referenced by locals_d whose origin blocks should track the block being evaluated
+    locals_d : dict
+    block_size : int
+        max number of origins in a block
+    trace_label : str
+    matrix : bool
+        evaluate expressions over (orig, dest) matrices rather than the od dataframe
+
+    Returns
+    -------
+    results : OrderedDict
+        target name => 1-D array of per-origin sums over destinations (in orig_zones order)
+    """
+
+    dest_zone_count = len(land_use_df.index)
+    blocks = [slice(start, start + block_size) for start in range(0, len(orig_zones), block_size)]
+    logger.info("%s evaluating %s blocks of %s orig zones" % (trace_label, len(blocks), block_size))
+
+    results = OrderedDict()
+    for block in blocks:
+
+        block_orig_zones = orig_zones[block]
+        block_shape = (len(block_orig_zones), dest_zone_count)
+
+        for skim in skims:
+            skim.set_block(block, matrix)
+
+        if matrix:
+            try:
+                block_frame = AccessibilityODFrame(block_orig_zones, land_use_df)
+                sums = assign_od_matrix_variables(assignment_spec, block_frame, locals_d, block_shape)
+            except PANDAS_ONLY_ERRORS as err:
+                logger.warning("%s can't evaluate spec over O-D matrices (%s: %s), using od dataframe" %
+                               (trace_label, type(err).__name__, err))
+                assert not results
+                return accessibility_sums(assignment_spec, orig_zones, land_use_df, skims, locals_d, block_size,
+                                          trace_label, matrix=False)
+        else:
+            od_df = od_block_df(block_orig_zones, land_use_df)
+            block_results, _, _ = assign.assign_variables(assignment_spec, od_df, locals_d)
+            sums = OrderedDict(
+                (column, np.asanyarray(block_results[column]).reshape(block_shape).sum(axis=1))
+                for column in block_results.columns)
+
+        for column, column_sums in sums.items():
+            results.setdefault(column, []).append(column_sums)
+
+    return OrderedDict((column, np.concatenate(column_sums)) for column, column_sums in results.items())
 
 
 @inject.step()
@@ -140,49 +355,48 @@ def compute_accessibility(accessibility, skim_dict, land_use, trace_od):
     logger.info("Running %s with %d dest zones %d orig zones" %
                 (trace_label, dest_zone_count, orig_zone_count))
 
-    # create OD dataframe
-    od_df = pd.DataFrame(
-        data={
-            'orig': np.repeat(np.asanyarray(accessibility_df.index), dest_zone_count),
-            'dest': np.tile(np.asanyarray(land_use_df.index), orig_zone_count)
-        }
-    )
-
-    if trace_od:
-        trace_orig, trace_dest = trace_od
-        trace_od_rows = (od_df.orig == trace_orig) & (od_df.dest == trace_dest)
-    else:
-        trace_od_rows = None
-
-    # merge land_use_columns into od_df
-    od_df = pd.merge(od_df, land_use_df, left_on='dest', right_index=True).sort_index()
+    skims = [AccessibilitySkims(skim_dict, orig_zones, dest_zones),
+             AccessibilitySkims(skim_dict, orig_zones, dest_zones, transpose=True)]
 
     locals_d = {
         'log': np.log,
         'exp': np.exp,
-        'skim_od': AccessibilitySkims(skim_dict, orig_zones, dest_zones),
-        'skim_do': AccessibilitySkims(skim_dict, orig_zones, dest_zones, transpose=True)
+        'skim_od': skims[0],
+        'skim_do': skims[1],
     }
     if constants is not None:
         locals_d.update(constants)
 
-    results, trace_results, trace_assigned_locals \
-        = assign.assign_variables(assignment_spec, od_df, locals_d, trace_rows=trace_od_rows)
+    # - evaluate spec over blocks of origins so we never build the full zones x zones O-D table
+    block_size = model_settings.get('orig_zones_per_block', max(DEFAULT_BLOCK_OD_PAIRS // dest_zone_count, 1))
+    results = accessibility_sums(assignment_spec, orig_zones, land_use_df, skims, locals_d, block_size, trace_label)
 
-    for column in results.columns:
-        data = np.asanyarray(results[column])
-        data.shape = (orig_zone_count, dest_zone_count)  # (o,d)
-        accessibility_df[column] = np.log(np.sum(data, axis=1) + 1)
+    for column, column_sums in results.items():
+        accessibility_df[column] = np.log(column_sums + 1)
 
     # - write table to pipeline
     pipeline.replace_table("accessibility", accessibility_df)
 
     if trace_od:
 
-        if not trace_od_rows.any():
+        trace_orig, trace_dest = trace_od
+
+        if not (np.isin(trace_orig, orig_zones) and np.isin(trace_dest, dest_zones)):
             logger.warning("trace_od not found origin = %s, dest = %s" % (trace_orig, trace_dest))
         else:
 
+            # evaluate the trace origin row of the od dataframe to trace results (and _temp variables)
+            orig_position = np.flatnonzero(orig_zones == trace_orig)[0]
+            for skim in skims:
+                skim.set_block(slice(orig_position, orig_position + 1), matrix=False)
+
+            od_df = od_block_df(orig_zones[orig_position:orig_position + 1], land_use_df)
+            od_df.index = od_df.index + orig_position * dest_zone_count
+            trace_od_rows = (od_df.orig == trace_orig) & (od_df.dest == trace_dest)
+
+            _, trace_results, trace_assigned_locals \
+                = assign.assign_variables(assignment_spec, od_df, locals_d, trace_rows=trace_od_rows)
+
             # add OD columns to trace results
             df = pd.concat([od_df[trace_od_rows], trace_results], axis=1)
 
@@ -2,6 +2,7 @@
 # See full license in LICENSE.txt.
 import logging
 
+import numpy as np
 import pandas as pd
 
 from activitysim.core import simulate
@@ -99,10 +100,17 @@ def participants_chooser(probs, choosers, spec, trace_label):
     custom alternative to logit.make_choices for simulate.simple_simulate
 
     Choosing participants for mixed tours is trickier than adult or child tours becuase we
-    need at least one adult and one child participant in a mixed tour. We call logit.make_choices
+    need at least one adult and one child participant in a mixed tour. We make choices
     and then check to see if the tour statisfies this requirement, and rechoose for any that
     fail until all are satisfied.
 
+    Rather than drawing one rand per candidate per iteration, we draw a batch of
+    participation_choice_batch_size rands for each unsatisfied candidate at once and check tour
+    satisfaction for successive iterations with array operations over tour codes, so most tours
+    are resolved with a single draw and only the unsatisfied tail is redrawn. Candidates of tours
+    satisfied before the end of a batch give back their unused rands (by rewinding their random
+    channel offsets), so choices and rands are identical to choosing one iteration at a time.
+
     In principal, this shold always occur eventually, but we fail after MAX_ITERATIONS,
     just in case there is some failure in program logic (haven't seen this occur.)
 
@@ -137,61 +145,93 @@ def participants_chooser(probs, choosers, spec, trace_label):
         "couldn't find participation choice column '%s' in spec"
     PARTICIPATE_CHOICE = spec.columns.get_loc(choice_col)
     MAX_ITERATIONS = model_settings.get('max_participation_choice_iterations', 5000)
+    BATCH_SIZE = model_settings.get('participation_choice_batch_size', 10)
 
     trace_label = tracing.extend_trace_label(trace_label, 'participants_chooser')
 
-    candidates = choosers.copy()
-    choices_list = []
-    rands_list = []
+    logit.check_probs(probs, trace_label, trace_choosers=choosers)
+
+    tour_codes, tour_ids = pd.factorize(choosers.tour_id)
+    num_tours = len(tour_ids)
+    mixed = np.zeros(num_tours, dtype=bool)
+    mixed[tour_codes] = (choosers.composition == 'mixed').values
+    adult = choosers.adult.values.astype(bool)
+    probs_arr = probs.values
+
+    choices = np.zeros(len(probs), dtype=np.int64)
+    rands = np.zeros(len(probs), dtype=np.float64)
 
-    num_tours_remaining = len(candidates.tour_id.unique())
+    rng = pipeline.get_rn_generator()
+    channel = rng.get_channel_for_df(probs) if rng.channels else None
+
+    num_tours_remaining = num_tours
     logger.info('%s %s joint tours to satisfy.', trace_label, num_tours_remaining,)
 
+    # positions of candidates of unsatisfied tours
+    remaining = np.arange(len(probs))
+
     iter = 0
-    while candidates.shape[0] > 0:
+    while remaining.size > 0:
 
-        iter += 1
+        batch_size = min(BATCH_SIZE, MAX_ITERATIONS - iter)
 
-        if iter > MAX_ITERATIONS:
+        if batch_size <= 0:
             logger.warning('%s max iterations exceeded (%s).', trace_label, MAX_ITERATIONS)
             diagnostic_cols = ['tour_id', 'household_id', 'composition', 'adult']
-            unsatisfied_candidates = candidates[diagnostic_cols].join(probs)
+            unsatisfied_candidates = choosers.iloc[remaining][diagnostic_cols].join(probs)
             tracing.write_csv(unsatisfied_candidates,
                               file_name='%s.UNSATISFIED' % trace_label, transpose=False)
             print(unsatisfied_candidates.head(20))
             assert False
 
-        choices, rands = logit.make_choices(probs, trace_label=trace_label, trace_choosers=choosers)
-        participate = (choices == PARTICIPATE_CHOICE)
+        batch_rands = rng.random_for_df(probs.iloc[remaining], n=batch_size).reshape(len(remaining), batch_size)
+
+        # number of rands each remaining candidate has consumed (all of them unless satisfied early)
+        rands_used = np.full(len(remaining), batch_size)
+        active = np.arange(len(remaining))
+
+        for k in range(batch_size):
+
+            iter += 1
+
+            candidates = remaining[active]
+            iter_choices = logit.choose_from_probs(probs_arr[candidates], batch_rands[active, k])
+            participate = (iter_choices == PARTICIPATE_CHOICE)
+
+            # tour satisfaction indexed by tour code
+            codes = tour_codes[candidates]
+            participants = np.bincount(codes, weights=participate, minlength=num_tours)
+            adults = np.bincount(codes, weights=participate & adult[candidates], minlength=num_tours)
+            tour_satisfaction = np.where(mixed, (adults > 0) & (participants > adults), participants > 1)
+            num_tours_satisfied_this_iter = tour_satisfaction.sum()
+
+            if num_tours_satisfied_this_iter > 0:
 
-        # satisfaction indexed by tour_id
-        tour_satisfaction = get_tour_satisfaction(candidates, participate)
-        num_tours_satisfied_this_iter = tour_satisfaction.sum()
+                num_tours_remaining -= num_tours_satisfied_this_iter
 
-        if num_tours_satisfied_this_iter > 0:
+                satisfied = tour_satisfaction[codes]
 
-            num_tours_remaining -= num_tours_satisfied_this_iter
+                choices[candidates[satisfied]] = iter_choices[satisfied]
+                rands[candidates[satisfied]] = batch_rands[active[satisfied], k]
 
-            satisfied = reindex(tour_satisfaction, candidates.tour_id)
+                # remove candidates of satisfied tours
+                rands_used[active[satisfied]] = k + 1
+                active = active[~satisfied]
 
-            choices_list.append(choices[satisfied])
-            rands_list.append(rands[satisfied])
+            logger.info('%s iteration %s : %s joint tours satisfied %s remaining' %
+                        (trace_label, iter, num_tours_satisfied_this_iter, num_tours_remaining,))
 
-            # remove candidates of satisfied tours
-            probs = probs[~satisfied]
-            candidates = candidates[~satisfied]
+            if active.size == 0:
+                break
 
-        logger.info('%s iteration %s : %s joint tours satisfied %s remaining' %
-                    (trace_label, iter, num_tours_satisfied_this_iter, num_tours_remaining,))
+        # rewind random channel offsets of candidates that didn't use all their rands
+        if channel is not None and (rands_used < batch_size).any():
+            channel.row_states.loc[probs.index[remaining], 'offset'] -= (batch_size - rands_used)
 
-    choices = pd.concat(choices_list)
-    rands = pd.concat(rands_list).reindex(choosers.index)
+        remaining = remaining[active]
 
-    # reindex choices and rands to match probs and v index
-    choices = choices.reindex(choosers.index)
-    rands = rands.reindex(choosers.index)
-    assert choices.index.equals(choosers.index)
-    assert rands.index.equals(choosers.index)
+    choices = pd.Series(choices, index=choosers.index)
+    rands = pd.Series(rands, index=choosers.index)
 
     logger.info('%s %s iterations to satisfy all joint tours.', trace_label, iter,)
 
@@ -69,6 +69,12 @@ With shadow pricing, and iterative treatment of each segment, the structure of t
             run_location_logsums
             run_location_simulate
     until convergence
+
+If shadow_pricing.yaml REUSE_SAMPLE_LOGSUMS is True, the location sample (with logsums) for each
+segment is only built in the first iteration and then reused, so that subsequent iterations only
+rerun run_location_simulate with the updated shadow-price-adjusted size terms. The sample is
+still corrected for the (first iteration) sampling probabilities in the simulate spec, but will
+no longer reflect the shifted attractiveness of zones in later iterations.
 """
 
 logger = logging.getLogger(__name__)
@@ -317,13 +323,18 @@ def run_location_choice(
         want_sample_table,
         estimator,
         model_settings,
-        chunk_size, trace_hh_id, trace_label
+        chunk_size, trace_hh_id, trace_label,
+        sample_cache=None
         ):
     """
     Run the three-part location choice algorithm to generate a location choice for each chooser
 
     Handle the various segments separately and in turn for simplicity of expression files
 
+    If a sample_cache dict is passed, the logsum-annotated location sample for each segment is
+    stored in it, and segments already in the cache skip run_location_sample and run_location_logsums
+    so that only run_location_simulate is rerun with the current (shadow price adjusted) size terms.
+
     Parameters
     ----------
     persons_merged_df : pandas.DataFrame
@@ -339,6 +350,8 @@ def run_location_choice(
     chunk_size : int
     trace_hh_id : int
     trace_label : str
+    sample_cache : dict or None
+        segment_name => location_sample_df with logsums from a previous call
 
     Returns
     -------
@@ -367,29 +380,37 @@ def run_location_choice(
             logger.info("%s skipping segment %s: no choosers", trace_label, segment_name)
             continue
 
-        # - location_sample
-        location_sample_df = \
-            run_location_sample(
-                segment_name,
-                choosers,
-                skim_dict,
-                dest_size_terms,
-                estimator,
-                model_settings,
-                chunk_size,
-                tracing.extend_trace_label(trace_label, 'sample.%s' % segment_name))
-
-        # - location_logsums
-        location_sample_df = \
-            run_location_logsums(
-                segment_name,
-                choosers,
-                skim_dict, skim_stack,
-                location_sample_df,
-                model_settings,
-                chunk_size,
-                trace_hh_id,
-                tracing.extend_trace_label(trace_label, 'logsums.%s' % segment_name))
+        if sample_cache is not None and segment_name in sample_cache:
+            # reuse sample and logsums from previous iteration (only size terms have changed)
+            logger.info("%s reusing cached location sample for segment %s", trace_label, segment_name)
+            location_sample_df = sample_cache[segment_name].copy()
+        else:
+            # - location_sample
+            location_sample_df = \
+                run_location_sample(
+                    segment_name,
+                    choosers,
+                    skim_dict,
+                    dest_size_terms,
+                    estimator,
+                    model_settings,
+                    chunk_size,
+                    tracing.extend_trace_label(trace_label, 'sample.%s' % segment_name))
+
+            # - location_logsums
+            location_sample_df = \
+                run_location_logsums(
+                    segment_name,
+                    choosers,
+                    skim_dict, skim_stack,
+                    location_sample_df,
+                    model_settings,
+                    chunk_size,
+                    trace_hh_id,
+                    tracing.extend_trace_label(trace_label, 'logsums.%s' % segment_name))
+
+            if sample_cache is not None:
+                sample_cache[segment_name] = location_sample_df.copy()
 
         # - location_simulate
         choices_df = \
@@ -496,6 +517,9 @@ def iterate_location_choice(
 
     logger.debug("%s max_iterations: %s" % (trace_label, max_iterations))
 
+    # location samples (with logsums) from first iteration, reused by subsequent iterations
+    sample_cache = {} if (spc.reuse_sample_logsums and max_iterations > 1) else None
+
     for iteration in range(1, max_iterations + 1):
 
         if spc.use_shadow_pricing and iteration > 1:
@@ -511,7 +535,8 @@ def iterate_location_choice(
             model_settings=model_settings,
             chunk_size=chunk_size,
             trace_hh_id=trace_hh_id,
-            trace_label=tracing.extend_trace_label(trace_label, 'i%s' % iteration))
+            trace_label=tracing.extend_trace_label(trace_label, 'i%s' % iteration),
+            sample_cache=sample_cache)
 
         # choices_df is a pandas DataFrame with columns 'choice' and (optionally) 'logsum'
         if choices_df is None:
@@ -528,6 +553,8 @@ def iterate_location_choice(
             logging.info("%s converged after iteration %s" % (trace_label, iteration,))
             break
 
+    del sample_cache
+
     # - shadow price table
     if locutor:
         if spc.use_shadow_pricing and 'SHADOW_PRICE_TABLE' in model_settings:
@@ -3,6 +3,7 @@
 from builtins import range
 
 import logging
+import multiprocessing
 
 import numpy as np
 import pandas as pd
@@ -12,6 +13,7 @@ from activitysim.core import config
 from activitysim.core import pipeline
 from activitysim.core import simulate
 from activitysim.core import inject
+from activitysim.core import chunk
 
 from activitysim.core.tracing import print_elapsed_time
 
@@ -412,6 +414,101 @@ def wrap_skims(model_settings):
     return skims
 
 
+# state inherited by forked purpose segment worker processes (see choose_trip_destinations_by_purpose)
+_PURPOSE_SEGMENT_STATE = {}
+
+
+def choose_trip_destination_for_purpose(primary_purpose):
+    """
+    choose_trip_destination for one primary_purpose segment in a forked worker process
+
+    Returns
+    -------
+    choices, destination_sample, and the random channel offsets for the segment's trips
+    (so that the parent process can advance their random number streams), plus the skim keys
+    touched and chunk high water marks (which would otherwise be lost when the worker exits)
+    """
+
+    state = _PURPOSE_SEGMENT_STATE
+
+    trips_segment = state['nth_trips'].groupby('primary_purpose').get_group(primary_purpose)
+
+    choices, destination_sample = choose_trip_destination(
+        primary_purpose,
+        trips_segment,
+        trace_label=tracing.extend_trace_label(state['trace_label'], primary_purpose),
+        **state['kwargs'])
+
+    channel = pipeline.get_rn_generator().get_channel_for_df(trips_segment)
+    offsets = channel.row_states.loc[trips_segment.index, 'offset']
+
+    # skims (already loaded by wrap_skims in parent) touched in this worker
+    skim_usage = {name: inject.get_injectable(name).usage for name in ['skim_dict', 'skim_stack']}
+
+    return choices, destination_sample, offsets, skim_usage, chunk.get_hwm_state()
+
+
+def choose_trip_destinations_by_purpose(nth_trips, num_processes, trace_label, **kwargs):
+    """
+    run choose_trip_destination for each primary_purpose segment of nth_trips
+
+    Segments are independent, so if num_processes > 1 they are run concurrently in a pool of
+    forked worker processes, which share the parent's skims and other (read-only) data.
+    Each trip's random number stream only depends on its own draws, so results are the
+    same as running them sequentially, regardless of the number of processes.
+
+    Parameters
+    ----------
+    nth_trips : pandas.DataFrame
+    num_processes : int
+    trace_label : str
+    kwargs : dict
+        remaining choose_trip_destination args
+
+    Returns
+    -------
+    list of (choices, destination_sample) tuples in primary_purpose order
+    """
+
+    segments = nth_trips.groupby('primary_purpose')
+    num_processes = min(num_processes, segments.ngroups)
+
+    if num_processes > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+        logger.warning("%s can't run purpose segments in parallel without fork start method" % trace_label)
+        num_processes = 1
+
+    if num_processes <= 1:
+        return [
+            choose_trip_destination(
+                primary_purpose,
+                trips_segment,
+                trace_label=tracing.extend_trace_label(trace_label, primary_purpose),
+                **kwargs)
+            for primary_purpose, trips_segment in segments]
+
+    logger.info("%s running %s purpose segments in %s processes" % (trace_label, segments.ngroups, num_processes))
+
+    _PURPOSE_SEGMENT_STATE.update(nth_trips=nth_trips, trace_label=trace_label, kwargs=kwargs)
+    try:
+        with multiprocessing.get_context('fork').Pool(num_processes) as pool:
+            results = pool.map(choose_trip_destination_for_purpose, list(segments.groups.keys()), chunksize=1)
+    finally:
+        _PURPOSE_SEGMENT_STATE.clear()
+
+    # advance random number streams of trips by the number of draws made in worker processes
+    channel = pipeline.get_rn_generator().get_channel_for_df(nth_trips)
+    for _, _, offsets, skim_usage, hwm_state in results:
+        channel.row_states.loc[offsets.index, 'offset'] = offsets.values
+
+        # skims touched in worker processes (for skim usage tracking and pruning)
+        for name, usage in skim_usage.items():
+            inject.get_injectable(name).usage.update(usage)
+
+        chunk.merge_hwm_state(hwm_state)
+
+    return [(choices, destination_sample) for choices, destination_sample, _, _, _ in results]
+
+
 def run_trip_destination(
         trips,
         tours_merged,
@@ -451,6 +548,9 @@ def run_trip_destination(
     sample_table_name = model_settings.get('DEST_CHOICE_SAMPLE_TABLE_NAME')
     want_sample_table = config.setting('want_dest_choice_sample_tables') and sample_table_name is not None
 
+    # number of processes in which to run primary_purpose segments of each trip_num concurrently
+    num_purpose_processes = model_settings.get('PURPOSE_SEGMENT_PROCESSES', 1)
+
     land_use = inject.get_table('land_use')
     size_terms = inject.get_injectable('size_terms')
 
@@ -515,20 +615,20 @@ def run_trip_destination(
             logger.info("Running %s with %d trips", nth_trace_label, nth_trips.shape[0])
 
             # - choose destination for nth_trips, segmented by primary_purpose
-            choices_list = []
-            for primary_purpose, trips_segment in nth_trips.groupby('primary_purpose'):
-                choices, destination_sample = choose_trip_destination(
-                    primary_purpose,
-                    trips_segment,
-                    alternatives,
-                    tours_merged,
-                    model_settings,
-                    want_logsums,
-                    want_sample_table,
-                    size_term_matrix, skims,
-                    chunk_size, trace_hh_id,
-                    trace_label=tracing.extend_trace_label(nth_trace_label, primary_purpose))
+            segment_results = choose_trip_destinations_by_purpose(
+                nth_trips,
+                num_processes=num_purpose_processes,
+                trace_label=nth_trace_label,
+                alternatives=alternatives,
+                tours_merged=tours_merged,
+                model_settings=model_settings,
+                want_logsums=want_logsums,
+                want_sample_table=want_sample_table,
+                size_term_matrix=size_term_matrix, skims=skims,
+                chunk_size=chunk_size, trace_hh_id=trace_hh_id)
 
+            choices_list = []
+            for choices, destination_sample in segment_results:
                 choices_list.append(choices)
                 if want_sample_table:
                     assert destination_sample is not None
@@ -551,7 +651,7 @@ def run_trip_destination(
 
             if len(destinations_df) == 0:
                 assert failed_trip_ids.all()
-                logger.warning(f"all {len(nth_trips)} {primary_purpose} trip_num {trip_num} trips failed")
+                logger.warning(f"all {len(nth_trips)} trip_num {trip_num} trips failed")
 
             if len(destinations_df) > 0:
                 # - assign choices to this trip's destinations
@@ -229,26 +229,26 @@ def tdd_interaction_dataset(tours, alts, timetable, choice_column, window_id_col
 
     """
 
-    alts_ids = np.tile(alts.index, len(tours.index))
-    tour_ids = np.repeat(tours.index, len(alts.index))
-    window_row_ids = np.repeat(tours[window_id_col], len(alts.index))
+    # enumerate only the available (tour, tdd) pairs, in batches of tours,
+    # rather than building the full tours x alts cross product and then slicing out unavailable pairs
+    tour_positions = []
+    alt_positions = []
+    for tour_batch_positions, alt_batch_positions in \
+            timetable.tour_available_pairs(tours[window_id_col], alts.index):
+        tour_positions.append(tour_batch_positions)
+        alt_positions.append(alt_batch_positions)
 
-    alt_tdd = alts.take(alts_ids)
+    tour_positions = np.concatenate(tour_positions) if tour_positions else np.empty(0, dtype=int)
+    alt_positions = np.concatenate(alt_positions) if alt_positions else np.empty(0, dtype=int)
+    assert len(tour_positions) > 0
 
-    alt_tdd.index = tour_ids
-    alt_tdd[window_id_col] = window_row_ids
+    alt_tdd = alts.take(alt_positions)
+
+    alt_tdd.index = tours.index.take(tour_positions)
 
     # add tdd alternative id
     # by convention, the choice column is the first column in the interaction dataset
-    alt_tdd.insert(loc=0, column=choice_column, value=alts_ids)
-
-    # slice out all non-available tours
-    available = timetable.tour_available(alt_tdd[window_id_col], alt_tdd[choice_column])
-    assert available.any()
-    alt_tdd = alt_tdd[available]
-
-    # FIXME - don't need this any more after slicing
-    del alt_tdd[window_id_col]
+    alt_tdd.insert(loc=0, column=choice_column, value=alts.index.values.take(alt_positions))
 
     return alt_tdd
 
@@ -463,7 +463,7 @@ def schedule_tours(
 
     result_list = []
     for i, num_chunks, chooser_chunk \
-            in chunk.chunked_choosers(tours, rows_per_chunk):
+            in chunk.chunked_choosers(tours, rows_per_chunk, tour_trace_label):
 
         logger.info("Running chunk %s of %s size %d" % (i, num_chunks, len(chooser_chunk)))
 
@@ -19,65 +19,79 @@ logger = logging.getLogger(__name__)
 @inject.table()
 def households(households_sample_size, override_hh_ids, trace_hh_id):
 
-    df_full = read_input_table("households")
-    tot_households = df_full.shape[0]
+    households_sliced = False
 
-    logger.info("full household list contains %s households" % tot_households)
+    if override_hh_ids is None and not households_sample_size:
 
-    households_sliced = False
+        # loading all households
+        df = read_input_table("households")
+        tot_households = df.shape[0]
 
-    # only using households listed in override_hh_ids
-    if override_hh_ids is not None:
+        logger.info("full household list contains %s households" % tot_households)
 
-        # trace_hh_id will not used if it is not in list of override_hh_ids
-        logger.info("override household list containing %s households" % len(override_hh_ids))
+    else:
 
-        df = df_full[df_full.index.isin(override_hh_ids)]
-        households_sliced = True
+        # read household ids so that we only need to read the rows of households we are loading
+        hh_ids = read_input_table("households", columns=[]).index
+        tot_households = len(hh_ids)
 
-        if df.shape[0] < len(override_hh_ids):
-            logger.info("found %s of %s households in override household list" %
-                        (df.shape[0], len(override_hh_ids)))
+        logger.info("full household list contains %s households" % tot_households)
 
-        if df.shape[0] == 0:
-            raise RuntimeError('No override households found in store')
+        # only using households listed in override_hh_ids
+        if override_hh_ids is not None:
 
-    # if we are tracing hh exclusively
-    elif trace_hh_id and households_sample_size == 1:
+            # trace_hh_id will not used if it is not in list of override_hh_ids
+            logger.info("override household list containing %s households" % len(override_hh_ids))
 
-        # df contains only trace_hh (or empty if not in full store)
-        df = tracing.slice_ids(df_full, trace_hh_id)
-        households_sliced = True
+            df = read_input_table("households", filter_values=override_hh_ids)
+            households_sliced = True
 
-    # if we need a subset of full store
-    elif tot_households > households_sample_size > 0:
+            if df.shape[0] < len(override_hh_ids):
+                logger.info("found %s of %s households in override household list" %
+                            (df.shape[0], len(override_hh_ids)))
 
-        logger.info("sampling %s of %s households" % (households_sample_size, tot_households))
+            if df.shape[0] == 0:
+                raise RuntimeError('No override households found in store')
 
-        """
-        Because random seed is set differently for each step, sampling of households using
-        Random.global_rng would sample differently depending upon which step it was called from.
-        We use a one-off rng seeded with the pseudo step name 'sample_households' to provide
-        repeatable sampling no matter when the table is loaded.
+        # if we are tracing hh exclusively
+        elif trace_hh_id and households_sample_size == 1:
 
-        Note that the external_rng is also seeded with base_seed so the sample will (rightly) change
-        if the pipeline rng's base_seed is changed
-        """
+            # df contains only trace_hh (or empty if not in full store)
+            df = read_input_table("households", filter_values=[trace_hh_id])
+            households_sliced = True
 
-        prng = pipeline.get_rn_generator().get_external_rng('sample_households')
-        df = df_full.take(prng.choice(len(df_full), size=households_sample_size, replace=False))
-        households_sliced = True
+        # if we need a subset of full store
+        elif tot_households > households_sample_size > 0:
 
-        # if tracing and we missed trace_hh in sample, but it is in full store
-        if trace_hh_id and trace_hh_id not in df.index and trace_hh_id in df_full.index:
-            # replace first hh in sample with trace_hh
-            logger.debug("replacing household %s with %s in household sample" %
-                         (df.index[0], trace_hh_id))
-            df_hh = df_full.loc[[trace_hh_id]]
-            df = pd.concat([df_hh, df[1:]])
+            logger.info("sampling %s of %s households" % (households_sample_size, tot_households))
 
-    else:
-        df = df_full
+            """
+            Because random seed is set differently for each step, sampling of households using
+            Random.global_rng would sample differently depending upon which step it was called from.
+            We use a one-off rng seeded with the pseudo step name 'sample_households' to provide
+            repeatable sampling no matter when the table is loaded.
+
+            Note that the external_rng is also seeded with base_seed so the sample will (rightly) change
+            if the pipeline rng's base_seed is changed
+            """
+
+            prng = pipeline.get_rn_generator().get_external_rng('sample_households')
+            sample_hh_ids = hh_ids.take(prng.choice(tot_households, size=households_sample_size, replace=False))
+
+            # if tracing and we missed trace_hh in sample, but it is in full store
+            if trace_hh_id and trace_hh_id not in sample_hh_ids and trace_hh_id in hh_ids:
+                # replace first hh in sample with trace_hh
+                logger.debug("replacing household %s with %s in household sample" %
+                             (sample_hh_ids[0], trace_hh_id))
+                sample_hh_ids = sample_hh_ids[1:].insert(0, trace_hh_id)
+
+            # read sampled households (in file order) and restore sample order
+            df = read_input_table("households", filter_values=sample_hh_ids)
+            df = df.loc[sample_hh_ids]
+            households_sliced = True
+
+        else:
+            df = read_input_table("households")
 
     # persons table
     inject.add_injectable('households_sliced', households_sliced)
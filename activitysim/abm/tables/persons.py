@@ -13,11 +13,11 @@ logger = logging.getLogger(__name__)
 
 def read_raw_persons(households):
 
-    df = read_input_table("persons")
-
     if inject.get_injectable('households_sliced', False):
-        # keep all persons in the sampled households
-        df = df[df.household_id.isin(households.index)]
+        # only read persons in the sampled households
+        df = read_input_table("persons", filter_col='household_id', filter_values=households.index)
+    else:
+        df = read_input_table("persons")
 
     return df
 
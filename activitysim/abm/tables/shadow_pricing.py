@@ -1,8 +1,8 @@
 # ActivitySim
 # See full license in LICENSE.txt.
 import logging
-import time
 import multiprocessing
+import threading
 import ctypes
 
 from collections import OrderedDict
@@ -47,17 +47,16 @@ size_table: pandas.DataFrame
 
 
 """
-Artisanal reverse semaphores to synchronize concurrent access to shared data buffer
+Sub-processes synchronize access to the shared data buffer with a multiprocessing.Barrier
+(created by mp_tasks for each multiprocess step with one party per sub-process) and a lock.
 
-we use the first two rows of the final column in numpy-wrapped shared data as 'reverse semaphores'
-(they synchronize concurrent access to shared data resource rather than throttling access)
+ShadowPriceCalculator.synchronize_choices coordinates the computation of the global aggregate
+zone counts (local_modeled_size summed across all sub-processes) using the barrier to wait
+for all processes to check in, copy the global counts, and clear the buffer.
 
-ShadowPriceCalculator.synchronize_choices coordinates access to the global aggregate zone counts
-(local_modeled_size summed across all sub-processes) using these two semaphores
-(which are really only tuples of indexes of locations in the shared data array.
+If a sub-process dies, mp_tasks aborts the barrier, so the surviving processes raise
+BrokenBarrierError rather than waiting forever.
 """
-TALLY_CHECKIN = (0, -1)
-TALLY_CHECKOUT = (1, -1)
 
 
 def size_table_name(model_selector):
@@ -78,13 +77,15 @@ def size_table_name(model_selector):
 
 class ShadowPriceCalculator(object):
 
-    def __init__(self, model_settings, num_processes, shared_data=None, shared_data_lock=None):
+    def __init__(self, model_settings, num_processes,
+                 shared_data=None, shared_data_lock=None, shared_data_barrier=None):
         """
 
         Presence of shared_data is used as a flag for multiprocessing
         If we are multiprocessing, shared_data should be a multiprocessing.RawArray buffer
-        to aggregate modeled_size across all sub-processes, and shared_data_lock should be
-        a multiprocessing.Lock object to coordinate access to that buffer.
+        to aggregate modeled_size across all sub-processes, shared_data_lock should be
+        a multiprocessing.Lock object to coordinate access to that buffer, and shared_data_barrier
+        a multiprocessing.Barrier with one party per sub-process to synchronize them.
 
         Optionally load saved shadow_prices from data_dir if config setting use_shadow_pricing
         and shadow_setting LOAD_SAVED_SHADOW_PRICES are both True
@@ -94,6 +95,7 @@ class ShadowPriceCalculator(object):
         model_settings : dict
         shared_data : multiprocessing.Array or None (if single process)
         shared_data_lock : numpy array wrapping multiprocessing.RawArray or None (if single process)
+        shared_data_barrier : multiprocessing.Barrier or None (if single process)
         """
 
         self.num_processes = num_processes
@@ -127,11 +129,16 @@ class ShadowPriceCalculator(object):
 
         # - shared_data
         if shared_data is not None:
-            assert shared_data.shape[0] == self.desired_size.shape[0]
-            assert shared_data.shape[1] == self.desired_size.shape[1] + 1  # tally column
+            assert shared_data.shape == self.desired_size.shape
             assert shared_data_lock is not None
+            assert shared_data_barrier is not None
         self.shared_data = shared_data
         self.shared_data_lock = shared_data_lock
+        self.shared_data_barrier = shared_data_barrier
+
+        # optional timeout (seconds) waiting for other sub-processes to synchronize_choices
+        self.synchronize_timeout = \
+            self.shadow_settings.get('SYNCHRONIZE_TIMEOUT', None) if self.use_shadow_pricing else None
 
         # - load saved shadow_prices (if available) and set max_iterations accordingly
         if self.use_shadow_pricing:
@@ -159,6 +166,10 @@ class ShadowPriceCalculator(object):
         else:
             self.max_iterations = 1
 
+        # reuse location samples and logsums from first iteration in subsequent iterations
+        self.reuse_sample_logsums = \
+            self.use_shadow_pricing and self.shadow_settings.get('REUSE_SAMPLE_LOGSUMS', False)
+
         self.num_fail = pd.DataFrame(index=self.desired_size.columns)
         self.max_abs_diff = pd.DataFrame(index=self.desired_size.columns)
         self.max_rel_diff = pd.DataFrame(index=self.desired_size.columns)
@@ -205,17 +216,17 @@ class ShadowPriceCalculator(object):
         ShadowPriceCalculator.synchronize_choices coordinates access to the global aggregate
         zone counts (local_modeled_size summed across all sub-processes).
 
-        * All processes wait (in case we are iterating) until any stragglers from the previous
-          iteration have exited the building. (TALLY_CHECKOUT goes to zero)
+        * Processes add their local counts into the shared_data (check in)
 
-        * Processes then add their local counts into the shared_data and increment TALLY_CHECKIN
+        * All processes wait at the barrier until everybody has checked in
 
-        * All processes wait until everybody has checked in (TALLY_CHECKIN == num_processes)
+        * Processes make local copy of shared_data and wait at the barrier until everybody has copied
 
-        * Processes make local copy of shared_data and check out (increment TALLY_CHECKOUT)
+        * One process zeros shared_data, and all wait at the barrier until it is clear
+          (so nobody checks in with data for the next iteration before the buffer is cleared)
 
-        * first_in process waits until all processes have checked out, then zeros shared_data
-          and clears semaphores
+        If a sub-process fails, the barrier is aborted (by mp_tasks) or times out (if the
+        shadow_pricing SYNCHRONIZE_TIMEOUT setting is specified) and BrokenBarrierError is raised.
 
         Parameters
         ----------
@@ -233,42 +244,34 @@ class ShadowPriceCalculator(object):
         assert self.shared_data is not None
         assert self.num_processes > 1
 
-        def get_tally(t):
-            with self.shared_data_lock:
-                return self.shared_data[t]
-
-        def wait(tally, target):
-            while get_tally(tally) != target:
-                time.sleep(1)
-
-        # - nobody checks in until checkout clears
-        wait(TALLY_CHECKOUT, 0)
+        def wait(tag):
+            try:
+                return self.shared_data_barrier.wait(self.synchronize_timeout)
+            except threading.BrokenBarrierError:
+                logger.error("synchronize_choices %s barrier broken (sub-process failed or timed out)" % tag)
+                raise
 
-        # - add local_modeled_size data, increment TALLY_CHECKIN
+        # - add local_modeled_size data to shared data buffer
         with self.shared_data_lock:
-            first_in = self.shared_data[TALLY_CHECKIN] == 0
-            # add local data from df to shared data buffer
-            # final column is used for tallys, hence the negative index
-            self.shared_data[..., 0:-1] += local_modeled_size.values
-            self.shared_data[TALLY_CHECKIN] += 1
+            self.shared_data[...] += local_modeled_size.values
 
         # - wait until everybody else has checked in
-        wait(TALLY_CHECKIN, self.num_processes)
+        wait('checkin')
 
-        # - copy shared data, increment TALLY_CHECKIN
+        # - copy shared data
         with self.shared_data_lock:
             logger.info("copy shared_data")
             # numpy array with sum of local_modeled_size.values from all processes
-            global_modeled_size_array = self.shared_data[..., 0:-1].copy()
-            self.shared_data[TALLY_CHECKOUT] += 1
+            global_modeled_size_array = self.shared_data.copy()
 
-        # - first in waits until all other processes have checked out, and cleans tub
-        if first_in:
-            wait(TALLY_CHECKOUT, self.num_processes)
+        # - wait until everybody has copied, then one process clears shared_data
+        if wait('checkout') == 0:
             with self.shared_data_lock:
-                # zero shared_data, clear TALLY_CHECKIN, and TALLY_CHECKOUT semaphores
-                self.shared_data[:] = 0
-            logger.info("first_in clearing shared_data")
+                self.shared_data[...] = 0
+            logger.info("clearing shared_data")
+
+        # - wait until shared data is clear before anyone can check in for next iteration
+        wait('clear')
 
         # convert summed numpy array data to conform to original dataframe
         global_modeled_size_df = \
@@ -569,7 +572,7 @@ def get_shadow_pricing_info():
     """
     return dict with info about dtype and shapes of desired and modeled size tables
 
-    block shape is (num_zones, num_segments + 1)
+    block shape is (num_zones, num_segments)
 
 
     Returns
@@ -593,8 +596,7 @@ def get_shadow_pricing_info():
         sp_rows = len(land_use)
         sp_cols = len(size_terms[size_terms.model_selector == model_selector])
 
-        # extra tally column for TALLY_CHECKIN and TALLY_CHECKOUT semaphores
-        blocks[block_name(model_selector)] = (sp_rows, sp_cols + 1)
+        blocks[block_name(model_selector)] = (sp_rows, sp_cols)
 
     sp_dtype = np.int64
 
@@ -667,14 +669,13 @@ def shadow_price_data_from_buffers(data_buffers, shadow_pricing_info, model_sele
     data_buffers : dict of {<model_selector> : <multiprocessing.Array>}
         multiprocessing.Array is simply a convenient way to bundle Array and Lock
         we extract the lock and wrap the RawArray in a numpy array for convenience in indexing
-        The shared data buffer has shape (<num_zones, <num_segments> + 1)
-        extra column is for reverse semaphores with TALLY_CHECKIN and TALLY_CHECKOUT
+        The shared data buffer has shape (<num_zones, <num_segments>)
     shadow_pricing_info : dict
         dict of useful info
            dtype: sp_dtype,
            block_shapes : OrderedDict({<model_selector>: <shape tuple>})
-           dict mapping model_selector to block shape (including extra column for semaphores)
-           e.g. {'school': (num_zones, num_segments + 1)
+           dict mapping model_selector to block shape
+           e.g. {'school': (num_zones, num_segments)
     model_selector : str
         location type model_selector (e.g. school or workplace)
 
@@ -724,9 +725,40 @@ def load_shadow_price_calculator(model_settings):
 
     # - get shared_data from data_buffers (if multiprocessing)
     data_buffers = inject.get_injectable('data_buffers', None)
+
+    # - barrier to synchronize sub-processes (injected by mp_tasks)
+    barrier = inject.get_injectable('shadow_pricing_barrier', None)
+
+    # modeled_size must be summed across all of the households of a multiprocess step to shadow price
+    # or to write MODELED_SIZE_TABLE, which is impossible if they aren't all run at once: work units
+    # (injected by mp_tasks) run in turn (even if the step has num_processes 1), and when resuming a step
+    # in which some sub-processes completed in the previous run, only the others are rerun
+    work_units = inject.get_injectable('work_units', None)
+    partial_resume = barrier is not None and barrier.parties != num_processes
+    if data_buffers is not None and (work_units or partial_resume):
+
+        if config.setting('use_shadow_pricing') or 'MODELED_SIZE_TABLE' in model_settings:
+            if work_units:
+                raise RuntimeError("%s location choice with use_shadow_pricing or MODELED_SIZE_TABLE needs all "
+                                   "households of multiprocess step to be run at once to sum modeled_size. "
+                                   "Run %s model in a step without work_units." % (model_selector, model_selector))
+            raise RuntimeError("%s location choice with use_shadow_pricing or MODELED_SIZE_TABLE needs all "
+                               "households of multiprocess step to be run at once to sum modeled_size, but only "
+                               "%s of the %s sub-processes are being rerun (the others completed in the previous "
+                               "run). Resume after a specific model (which reruns all of the step's sub-processes) "
+                               "instead." % (model_selector, barrier.parties, num_processes))
+
+        # nothing uses the summed modeled_size, so each sub-process only needs its own
+        logger.info("%s modeled_size not synchronized across sub-processes (%s)" %
+                    (model_selector, 'work_units' if work_units else 'partial resume'))
+        data_buffers = None
+        num_processes = 1
+
     if data_buffers is not None:
         logger.info('Using existing data_buffers for shadow_price')
 
+        assert barrier is not None or num_processes == 1
+
         # - shadow_pricing_info
         shadow_pricing_info = inject.get_injectable('shadow_pricing_info', None)
         if shadow_pricing_info is None:
@@ -740,11 +772,12 @@ def load_shadow_price_calculator(model_settings):
         assert num_processes == 1
         data = None  # ShadowPriceCalculator will allocate its own data
         lock = None
+        barrier = None
 
     # - ShadowPriceCalculator
     spc = ShadowPriceCalculator(
         model_settings,
-        num_processes, data, lock)
+        num_processes, data, lock, barrier)
 
     return spc
 
@@ -5,6 +5,9 @@ from builtins import int
 
 import sys
 import os
+import re
+import ast
+import hashlib
 import logging
 import multiprocessing
 
@@ -27,6 +30,129 @@ logger = logging.getLogger(__name__)
 Read in the omx files and create the skim objects
 """
 
+# skim_usage.txt (written by track_skim_usage step) sections listing skim keys that were looked up
+SKIM_USAGE_SECTIONS = ['### skim_dict usage', '### skim_stack usage']
+
+WORD_REGEX = re.compile(r'\w+')
+
+
+def get_skim_layout():
+    """
+    skim block layout specified by skim_layout setting (skim.OD_MAJOR by default)
+    """
+
+    skim_layout = config.setting('skim_layout', skim.OD_MAJOR)
+
+    if skim_layout not in skim.SKIM_LAYOUTS:
+        raise RuntimeError("Unrecognized skim_layout setting '%s' (expected one of %s)" %
+                           (skim_layout, skim.SKIM_LAYOUTS))
+
+    return skim_layout
+
+
+def skim_key1(skim_key):
+    return skim_key[0] if isinstance(skim_key, tuple) else skim_key
+
+
+def skim_names_in_configs(skim_names):
+    """
+    skim names referenced in config csv (spec, preprocessor, and annotation) and yaml files
+
+    Expressions reference skims in many ways (e.g. skims['DIST'], odt_skims['SOV_TIME'],
+    skim_dict.get(('SOV_TIME', 'MD')), or od_skims.max('DISTWALK')) so rather than parse expressions,
+    we look for skim names appearing as words in config files. This may keep a few skims that aren't
+    actually used, but can't find skim names that are constructed at runtime (see strict_skim_usage setting)
+
+    Parameters
+    ----------
+    skim_names : list of str
+        key1 names of skims in omx file
+
+    Returns
+    -------
+    set of str
+        skim names referenced in config files
+    """
+
+    configs_dir = inject.get_injectable('configs_dir')
+    if isinstance(configs_dir, str):
+        configs_dir = [configs_dir]
+
+    # as with config_file_path, files in earlier configs dirs hide files with the same name in later dirs
+    file_paths = OrderedDict()
+    for dir in configs_dir:
+        for file_name in sorted(os.listdir(dir)):
+            if file_name.endswith(('.csv', '.yaml')) and file_name not in file_paths:
+                file_paths[file_name] = os.path.join(dir, file_name)
+
+    skim_names = set(skim_names)
+    referenced = set()
+    for file_path in file_paths.values():
+        with open(file_path, encoding='utf-8', errors='replace') as config_file:
+            referenced.update(skim_names.intersection(WORD_REGEX.findall(config_file.read())))
+
+    logger.debug("skim_names_in_configs found %s skim names in %s config files" %
+                 (len(referenced), len(file_paths)))
+
+    return referenced
+
+
+def skim_names_in_usage_file(file_path):
+    """
+    names of skims looked up in a prior run, as listed in skim_usage.txt written by track_skim_usage step
+
+    Parameters
+    ----------
+    file_path : str
+
+    Returns
+    -------
+    set of str
+        key1 names of skims in skim_dict and skim_stack usage sections of file
+    """
+
+    skim_names = set()
+    section = None
+    with open(file_path) as usage_file:
+        for line in usage_file:
+            line = line.strip()
+            if line.startswith('###'):
+                section = line
+            elif line and section in SKIM_USAGE_SECTIONS:
+                # tuple keys are written as e.g. ('SOV_TIME', 'MD')
+                skim_key = ast.literal_eval(line) if line.startswith('(') else line
+                skim_names.add(skim_key1(skim_key))
+
+    return skim_names
+
+
+def skim_names_to_load(skim_names):
+    """
+    names of skims to load, as specified by skim_usage_file or prune_skims settings
+
+    Parameters
+    ----------
+    skim_names : list of str
+        key1 names of skims in omx file
+
+    Returns
+    -------
+    set of str or None
+        names of skims to load, or None if all skims should be loaded
+    """
+
+    usage_file = config.setting('skim_usage_file')
+    if usage_file:
+        file_path = usage_file if os.path.isfile(usage_file) else config.data_file_path(usage_file)
+        logger.info("loading skims looked up in prior run according to skim_usage_file %s" % file_path)
+        return skim_names_in_usage_file(file_path)
+
+    if config.setting('prune_skims', False):
+        logger.info("loading skims referenced in config files (prune_skims)")
+        return skim_names_in_configs(skim_names)
+
+    return None
+
 
 def get_skim_info(omx_file_path, tags_to_load=None):
 
@@ -76,6 +202,17 @@ def get_skim_info(omx_file_path, tags_to_load=None):
         skim_key = (key1, key2) if sep else key1
         omx_keys[skim_key] = skim_name
 
+    # - prune skims not referenced in configs or not used in prior run (all subkeys of key1 are kept or pruned)
+    skim_names = list(OrderedDict.fromkeys(skim_key1(skim_key) for skim_key in omx_keys))
+    names_to_load = skim_names_to_load(skim_names)
+    pruned_skims = []
+    if names_to_load is not None:
+        pruned_skims = [skim_name for skim_name in skim_names if skim_name not in names_to_load]
+        omx_keys = OrderedDict((k, v) for k, v in omx_keys.items() if skim_key1(k) in names_to_load)
+        logger.info("get_skim_info loading %s skims (%s of %s skim names) pruned %s skim names" %
+                    (len(omx_keys), len(skim_names) - len(pruned_skims), len(skim_names), len(pruned_skims)))
+        logger.debug("get_skim_info pruned skims: %s" % pruned_skims)
+
     num_skims = len(omx_keys)
 
     # - key1_subkeys dict maps key1 to dict of subkeys with that key1
@@ -137,9 +274,11 @@ def get_skim_info(omx_file_path, tags_to_load=None):
 
         block_offsets[skim_key] = (block, key1_offset + key2_relative_offset)
 
+    skim_layout = get_skim_layout()
+
     logger.debug("get_skim_info from %s" % (omx_file_path, ))
-    logger.debug("get_skim_info skim_dtype %s omx_shape %s num_skims %s num_blocks %s" %
-                 (skim_dtype, omx_shape, num_skims, len(blocks)))
+    logger.debug("get_skim_info skim_dtype %s omx_shape %s num_skims %s num_blocks %s skim_layout %s" %
+                 (skim_dtype, omx_shape, num_skims, len(blocks), skim_layout))
 
     skim_info = {
         'omx_name': omx_name,
@@ -152,27 +291,54 @@ def get_skim_info(omx_file_path, tags_to_load=None):
         'key1_block_offsets': key1_block_offsets,
         'block_offsets': block_offsets,
         'blocks': blocks,
+        'skim_layout': skim_layout,
+        'pruned_skims': pruned_skims,
+        'strict_skim_usage': config.setting('strict_skim_usage', True),
     }
 
     return skim_info
 
 
+def block_shape(skim_info, block_size):
+    """
+    shape of skim data block with block_size skims for the skim_layout specified in skim_info
+    """
+
+    omx_shape = skim_info['omx_shape']
+
+    if skim_info.get('skim_layout', skim.OD_MAJOR) == skim.SKIM_MAJOR:
+        return (block_size,) + omx_shape
+
+    return omx_shape + (block_size,)
+
+
+def skim_from_block(skim_info, block_data, offset):
+    """
+    2-D view of skim at offset in block_data for the skim_layout specified in skim_info
+    """
+
+    if skim_info.get('skim_layout', skim.OD_MAJOR) == skim.SKIM_MAJOR:
+        return block_data[offset]
+
+    return block_data[:, :, offset]
+
+
 def buffers_for_skims(skim_info, shared=False):
 
     skim_dtype = skim_info['dtype']
-    omx_shape = skim_info['omx_shape']
     blocks = skim_info['blocks']
 
     skim_buffers = {}
     for block_name, block_size in blocks.items():
 
         # buffer_size must be int, not np.int64
-        buffer_size = int(multiply_large_numbers(omx_shape) * block_size)
+        skims_shape = block_shape(skim_info, block_size)
+        buffer_size = int(multiply_large_numbers(skims_shape))
 
         itemsize = np.dtype(skim_dtype).itemsize
         csz = buffer_size * itemsize
-        logger.info("allocating shared buffer %s for %s skims (skim size: %s * %s bytes = %s) total size: %s (%s)" %
-                    (block_name, block_size, omx_shape, itemsize, buffer_size, csz, util.GB(csz)))
+        logger.info("allocating shared buffer %s for %s skims (block shape: %s * %s bytes = %s) total size: %s (%s)" %
+                    (block_name, block_size, skims_shape, itemsize, buffer_size, csz, util.GB(csz)))
 
         if shared:
             if np.issubdtype(skim_dtype, np.float64):
@@ -195,13 +361,12 @@ def skim_data_from_buffers(skim_buffers, skim_info):
 
     assert type(skim_buffers) == dict
 
-    omx_shape = skim_info['omx_shape']
     skim_dtype = skim_info['dtype']
     blocks = skim_info['blocks']
 
     skim_data = []
     for block_name, block_size in blocks.items():
-        skims_shape = omx_shape + (block_size,)
+        skims_shape = block_shape(skim_info, block_size)
         block_buffer = skim_buffers[block_name]
         assert len(block_buffer) == int(multiply_large_numbers(skims_shape))
         block_data = np.frombuffer(block_buffer, dtype=skim_dtype).reshape(skims_shape)
@@ -214,8 +379,25 @@ def default_skim_cache_dir():
     return inject.get_injectable('output_dir')
 
 
-def build_skim_cache_file_name(omx_name, block):
-    return f"cached_{omx_name}_{block}.mmap"
+def skim_cache_name(skim_info):
+    """
+    omx_name qualified (if skims were pruned) by the set of skims loaded, so that cache files are only
+    read for the same set of skims they were written with
+    """
+
+    omx_name = skim_info['omx_name']
+    if skim_info.get('pruned_skims'):
+        omx_keys_digest = hashlib.md5('\n'.join(skim_info['omx_keys'].values()).encode('utf8')).hexdigest()
+        omx_name = f"{omx_name}_{omx_keys_digest[:8]}"
+
+    return omx_name
+
+
+def build_skim_cache_file_name(omx_name, block, skim_layout=skim.OD_MAJOR):
+    # cached block data is only usable with the same skim_layout it was written with
+    if skim_layout == skim.OD_MAJOR:
+        return f"cached_{omx_name}_{block}.mmap"
+    return f"cached_{omx_name}_{skim_layout}_{block}.mmap"
 
 
 def read_skim_cache(skim_info, skim_data):
@@ -226,13 +408,14 @@ def read_skim_cache(skim_info, skim_data):
     skim_cache_dir = config.setting('skim_cache_dir', default_skim_cache_dir())
     logger.info(f"load_skims reading skims data from cache directory {skim_cache_dir}")
 
-    omx_name = skim_info['omx_name']
+    omx_name = skim_cache_name(skim_info)
     dtype = np.dtype(skim_info['dtype'])
+    skim_layout = skim_info.get('skim_layout', skim.OD_MAJOR)
 
     blocks = skim_info['blocks']
     block = 0
     for block_name, block_size in blocks.items():
-        skim_cache_file_name = build_skim_cache_file_name(omx_name, block)
+        skim_cache_file_name = build_skim_cache_file_name(omx_name, block, skim_layout)
         skim_cache_path = os.path.join(skim_cache_dir, skim_cache_file_name)
 
         assert os.path.isfile(skim_cache_path), \
@@ -250,6 +433,64 @@ def read_skim_cache(skim_info, skim_data):
         block += 1
 
 
+def mmap_skim_cache(skim_info):
+    """
+        open cached skim data file(s) in output directory as read-only memmaps to use directly as skim_data
+
+        Rather than copying the cached data into (shared) RAM buffers, skim data pages are loaded lazily
+        by the OS on first access, and the OS page cache is shared by all processes mapping the same files.
+
+    Returns
+    -------
+    skim_data : list of read-only numpy.memmap with one memmap for each block in skim_info['blocks']
+    """
+
+    skim_cache_dir = config.setting('skim_cache_dir', default_skim_cache_dir())
+    logger.info(f"load_skims memory mapping skims data from cache directory {skim_cache_dir}")
+
+    omx_name = skim_cache_name(skim_info)
+    dtype = np.dtype(skim_info['dtype'])
+    skim_layout = skim_info.get('skim_layout', skim.OD_MAJOR)
+
+    skim_data = []
+    blocks = skim_info['blocks']
+    block = 0
+    for block_name, block_size in blocks.items():
+        skim_cache_file_name = build_skim_cache_file_name(omx_name, block, skim_layout)
+        skim_cache_path = os.path.join(skim_cache_dir, skim_cache_file_name)
+
+        if not os.path.isfile(skim_cache_path):
+            raise RuntimeError("mmap_skim_cache could not find skim_cache_path: %s "
+                               "(run once with write_skim_cache to create it)" % (skim_cache_path, ))
+
+        skims_shape = block_shape(skim_info, block_size)
+
+        logger.info(f"load_skims mapping block_name {block_name} {skims_shape} from {skim_cache_file_name}")
+
+        data = np.memmap(skim_cache_path, shape=skims_shape, dtype=dtype, mode='r')
+        skim_data.append(data)
+
+        block += 1
+
+    return skim_data
+
+
+def use_mmap_skim_cache():
+    """
+    True if skim_dict should be backed directly by read-only memmaps of the skim cache (mmap_skim_cache setting)
+    in which case there is no need to allocate or load (shared) skim buffers
+    """
+
+    mmap_cache = config.setting('mmap_skim_cache', False)
+
+    if mmap_cache:
+        assert not config.setting('write_skim_cache'), \
+            "mmap_skim_cache and write_skim_cache are both True in settings file. " \
+            "write the skim cache in a prior run."
+
+    return mmap_cache
+
+
 def write_skim_cache(skim_info, skim_data):
     """
         write skim data from skim_data to canonically named cache file(s) in output directory
@@ -258,13 +499,14 @@ def write_skim_cache(skim_info, skim_data):
     skim_cache_dir = config.setting('skim_cache_dir', default_skim_cache_dir())
     logger.info(f"load_skims writing skims data to cache directory {skim_cache_dir}")
 
-    omx_name = skim_info['omx_name']
+    omx_name = skim_cache_name(skim_info)
     dtype = np.dtype(skim_info['dtype'])
+    skim_layout = skim_info.get('skim_layout', skim.OD_MAJOR)
 
     blocks = skim_info['blocks']
     block = 0
     for block_name, block_size in blocks.items():
-        skim_cache_file_name = build_skim_cache_file_name(omx_name, block)
+        skim_cache_file_name = build_skim_cache_file_name(omx_name, block, skim_layout)
         skim_cache_path = os.path.join(skim_cache_dir, skim_cache_file_name)
 
         block_data = skim_data[block]
@@ -299,7 +541,7 @@ def read_skims_from_omx(skim_info, skim_data, omx_file_path):
                          (omx_key, skim_key, block, offset))
 
             # this will trigger omx readslice to read and copy data to skim_data's buffer
-            a = block_data[:, :, offset]
+            a = skim_from_block(skim_info, block_data, offset)
             a[:] = omx_data[:]
 
     logger.info("load_skims loaded skims from %s" % (omx_file_path, ))
@@ -341,14 +583,18 @@ def skim_dict(settings):
 
     logger.debug("omx_shape %s skim_dtype %s" % (skim_info['omx_shape'], skim_info['dtype']))
 
-    skim_buffers = inject.get_injectable('data_buffers', None)
-    if skim_buffers:
-        logger.info('Using existing skim_buffers for skims')
+    if use_mmap_skim_cache():
+        logger.info('Using read-only memmapped skim cache for skims')
+        skim_data = mmap_skim_cache(skim_info)
     else:
-        skim_buffers = buffers_for_skims(skim_info, shared=False)
-        load_skims(omx_file_path, skim_info, skim_buffers)
+        skim_buffers = inject.get_injectable('data_buffers', None)
+        if skim_buffers:
+            logger.info('Using existing skim_buffers for skims')
+        else:
+            skim_buffers = buffers_for_skims(skim_info, shared=False)
+            load_skims(omx_file_path, skim_info, skim_buffers)
 
-    skim_data = skim_data_from_buffers(skim_buffers, skim_info)
+        skim_data = skim_data_from_buffers(skim_buffers, skim_info)
 
     block_names = list(skim_info['blocks'].keys())
     for i in range(len(skim_data)):
@@ -0,0 +1,127 @@
+# ActivitySim
+# See full license in LICENSE.txt.
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from activitysim.core import assign
+from activitysim.core import skim
+from activitysim.abm.models import accessibility
+
+
+@pytest.fixture(scope='module')
+def zones():
+    return np.arange(50) + 10
+
+
+@pytest.fixture(scope='module')
+def skim_dict(zones):
+
+    prng = np.random.RandomState(0)
+    skim_data = np.zeros((len(zones), len(zones), 2), dtype=np.float32)
+    skim_data[:, :, 0] = prng.uniform(1, 60, (len(zones), len(zones)))
+    skim_data[:, :, 1] = prng.uniform(0, 5, (len(zones), len(zones)))
+
+    skim_info = {
+        'omx_shape': (len(zones), len(zones)),
+        'block_offsets': {'TIME': (0, 0), 'DIST': (0, 1)}
+    }
+
+    skim_dict = skim.SkimDict([skim_data], skim_info)
+    skim_dict.offset_mapper.set_offset_list(list(zones))
+    return skim_dict
+
+
+@pytest.fixture(scope='module')
+def land_use_df(zones):
+
+    prng = np.random.RandomState(1)
+    return pd.DataFrame({
+        'RETEMPN': prng.randint(0, 100, len(zones)),
+        'TOTEMP': prng.randint(0, 1000, len(zones)),
+    }, index=pd.Index(zones, name='TAZ'))
+
+
+def assignment_spec(expressions):
+    return pd.DataFrame(expressions, columns=['target', 'expression'])
+
+
+def expected_sums(spec, orig_zones, land_use_df, skim_dict, locals_d):
+    # evaluate spec on the full (long) O-D table
+    skims = [accessibility.AccessibilitySkims(skim_dict, orig_zones, land_use_df.index.values),
+             accessibility.AccessibilitySkims(skim_dict, orig_zones, land_use_df.index.values, transpose=True)]
+    locals_d = dict(locals_d, skim_od=skims[0], skim_do=skims[1])
+
+    od_df = accessibility.od_block_df(orig_zones, land_use_df)
+    results, _, _ = assign.assign_variables(spec, od_df, locals_d)
+
+    shape = (len(orig_zones), len(land_use_df))
+    return {c: results[c].values.reshape(shape).sum(axis=1) for c in results.columns}
+
+
+def accessibility_sums(spec, orig_zones, land_use_df, skim_dict, locals_d, block_size, matrix=True):
+    skims = [accessibility.AccessibilitySkims(skim_dict, orig_zones, land_use_df.index.values),
+             accessibility.AccessibilitySkims(skim_dict, orig_zones, land_use_df.index.values, transpose=True)]
+    locals_d = dict(locals_d, skim_od=skims[0], skim_do=skims[1])
+
+    return accessibility.accessibility_sums(spec, orig_zones, land_use_df, skims, locals_d, block_size,
+                                            trace_label='test', matrix=matrix)
+
+
+@pytest.mark.parametrize('block_size', [1, 7, 50])
+@pytest.mark.parametrize('matrix', [True, False])
+def test_accessibility_sums(skim_dict, land_use_df, block_size, matrix):
+
+    spec = assignment_spec([
+        ['_DECAY', 'decay'],
+        ['_round_trip_time', 'skim_od["TIME"] + skim_do["TIME"]'],
+        ['_walk_available', 'skim_od["DIST"] < max_walk'],
+        ['auto_retail', 'df.RETEMPN * exp(_DECAY * _round_trip_time)'],
+        ['walk_total', '_walk_available * df.TOTEMP * exp(_DECAY * skim_od["DIST"])'],
+        ['walk_total', 'walk_total + (df.dest == df.orig)'],
+    ])
+    locals_d = {'log': np.log, 'exp': np.exp, 'decay': -0.05, 'max_walk': 3.0}
+
+    # origins are a (sliced) subset of dest zones
+    orig_zones = land_use_df.index.values[5:35]
+
+    expected = expected_sums(spec, orig_zones, land_use_df, skim_dict, locals_d)
+    results = accessibility_sums(spec, orig_zones, land_use_df, skim_dict, locals_d, block_size, matrix)
+
+    assert list(results.keys()) == ['auto_retail', 'walk_total']
+    for column in results:
+        np.testing.assert_allclose(results[column], expected[column], rtol=1e-12)
+
+
+def test_accessibility_sums_fallback(skim_dict, land_use_df, caplog):
+
+    # pandas methods can't be evaluated over matrices
+    spec = assignment_spec([
+        ['retail', 'df.RETEMPN.clip(upper=50) * (skim_od["TIME"] < 30)'],
+    ])
+    locals_d = {}
+
+    orig_zones = land_use_df.index.values
+
+    expected = expected_sums(spec, orig_zones, land_use_df, skim_dict, locals_d)
+    results = accessibility_sums(spec, orig_zones, land_use_df, skim_dict, locals_d, block_size=20)
+
+    np.testing.assert_allclose(results['retail'], expected['retail'])
+
+    # fallback is a warning, not an error
+    assert any('using od dataframe' in r.message for r in caplog.records if r.levelname == 'WARNING')
+    assert not [r for r in caplog.records if r.levelname == 'ERROR']
+
+
+def test_accessibility_sums_error(skim_dict, land_use_df, caplog):
+
+    # other errors are raised rather than falling back to the od dataframe
+    spec = assignment_spec([
+        ['retail', 'df.RETEMPN * undefined_name'],
+    ])
+
+    with pytest.raises(NameError):
+        accessibility_sums(spec, land_use_df.index.values, land_use_df, skim_dict, {}, block_size=20)
+
+    assert not [r for r in caplog.records if 'using od dataframe' in r.message]
@@ -0,0 +1,105 @@
+# ActivitySim
+# See full license in LICENSE.txt.
+
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+from activitysim.core import logit
+from activitysim.core import random
+from activitysim.core.util import reindex
+from activitysim.abm.models import joint_tour_participation
+
+
+@pytest.fixture(scope='module')
+def candidates():
+
+    prng = np.random.RandomState(0)
+
+    num_tours = 200
+    persons_per_tour = prng.randint(2, 6, num_tours)
+    tour_id = np.repeat(np.arange(num_tours) + 1, persons_per_tour)
+
+    composition = np.array(['adults', 'children', 'mixed'])[prng.randint(0, 3, num_tours)]
+    composition = np.repeat(composition, persons_per_tour)
+
+    # eligible candidates: adults for adult tours, children for child tours, anyone for mixed tours
+    adult = np.where(composition == 'adults', True,
+                     np.where(composition == 'children', False, prng.rand(len(tour_id)) < 0.5))
+    # mixed tours need at least one adult and one child
+    first = np.r_[True, tour_id[1:] != tour_id[:-1]]
+    second = np.r_[False, first[:-1]]
+    adult[first & (composition == 'mixed')] = True
+    adult[second & (composition == 'mixed')] = False
+
+    pnum = np.arange(len(tour_id)) - np.repeat(np.cumsum(persons_per_tour) - persons_per_tour, persons_per_tour) + 1
+
+    return pd.DataFrame({
+        'tour_id': tour_id,
+        'household_id': tour_id + 1000,
+        'composition': composition,
+        'adult': adult,
+    }, index=pd.Index(tour_id * 100 + pnum, name='participant_id'))
+
+
+def reference_participants_chooser(probs, choosers, participate_choice):
+    # choose all remaining candidates one iteration at a time
+
+    candidates = choosers.copy()
+    choices_list = []
+    rands_list = []
+    while candidates.shape[0] > 0:
+
+        choices, rands = logit.make_choices(probs)
+        participate = (choices == participate_choice)
+
+        tour_satisfaction = joint_tour_participation.get_tour_satisfaction(candidates, participate)
+        if tour_satisfaction.sum() > 0:
+            satisfied = reindex(tour_satisfaction, candidates.tour_id)
+            choices_list.append(choices[satisfied])
+            rands_list.append(rands[satisfied])
+            probs = probs[~satisfied]
+            candidates = candidates[~satisfied]
+
+    choices = pd.concat(choices_list).reindex(choosers.index)
+    rands = pd.concat(rands_list).reindex(choosers.index)
+    return choices, rands
+
+
+@pytest.mark.parametrize('batch_size', [1, 3, 10])
+def test_participants_chooser(candidates, monkeypatch, batch_size):
+
+    prng = np.random.RandomState(1)
+    participate_probs = prng.uniform(0.1, 0.9, len(candidates))
+    probs = pd.DataFrame({'participate': participate_probs, 'not_participate': 1 - participate_probs},
+                         index=candidates.index)
+    spec = pd.DataFrame(columns=['participate', 'not_participate'])
+
+    model_settings = {'participation_choice_batch_size': batch_size}
+    monkeypatch.setattr(joint_tour_participation.config, 'read_model_settings', lambda file_name: model_settings)
+
+    def run(chooser):
+        rng = random.Random()
+        rng.add_channel('joint_tour_participants', candidates)
+        rng.begin_step('joint_tour_participation')
+        monkeypatch.setattr(joint_tour_participation.pipeline, 'get_rn_generator', lambda: rng)
+        monkeypatch.setattr(logit.pipeline, 'get_rn_generator', lambda: rng)
+
+        choices, rands = chooser()
+
+        # next draws depend on the (advanced) offsets of candidates random number streams
+        return choices, rands, rng.random_for_df(candidates)
+
+    choices, rands, next_rands = run(
+        lambda: joint_tour_participation.participants_chooser(probs, candidates, spec, trace_label='test'))
+
+    expected_choices, expected_rands, expected_next_rands = run(
+        lambda: reference_participants_chooser(probs, candidates, participate_choice=0))
+
+    pdt.assert_series_equal(choices, expected_choices)
+    pdt.assert_series_equal(rands, expected_rands)
+    np.testing.assert_array_equal(next_rands, expected_next_rands)
+
+    satisfaction = joint_tour_participation.get_tour_satisfaction(candidates, choices == 0)
+    assert satisfaction.all()
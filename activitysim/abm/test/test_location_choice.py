@@ -0,0 +1,71 @@
+# ActivitySim
+# See full license in LICENSE.txt.
+
+import pandas as pd
+
+from activitysim.abm.models import location_choice
+
+
+class ShadowPriceCalculatorStub(object):
+
+    def __init__(self):
+        self.size_factor = 1
+
+    def dest_size_terms(self, segment):
+        return pd.DataFrame({'size_term': [self.size_factor] * 3}, index=pd.Index([1, 2, 3], name='dest_TAZ'))
+
+
+def test_reuse_location_sample(monkeypatch):
+
+    calls = []
+
+    def run_location_sample(segment_name, choosers, *args):
+        calls.append(('sample', segment_name))
+        return pd.DataFrame({'dest_TAZ': 1, 'pick_count': 1}, index=choosers.index)
+
+    def run_location_logsums(segment_name, choosers, skim_dict, skim_stack, location_sample_df, *args):
+        calls.append(('logsums', segment_name))
+        location_sample_df['mode_choice_logsum'] = 0.5
+        return location_sample_df
+
+    def run_location_simulate(segment_name, choosers, location_sample_df, skim_dict, dest_size_terms, *args):
+        calls.append(('simulate', segment_name))
+        assert 'mode_choice_logsum' in location_sample_df
+        return pd.DataFrame({'choice': dest_size_terms.size_term.iloc[0]}, index=choosers.index)
+
+    monkeypatch.setattr(location_choice, 'run_location_sample', run_location_sample)
+    monkeypatch.setattr(location_choice, 'run_location_logsums', run_location_logsums)
+    monkeypatch.setattr(location_choice, 'run_location_simulate', run_location_simulate)
+
+    persons = pd.DataFrame({'segment': [1, 1, 2, 1]}, index=pd.Index([10, 11, 12, 13], name='person_id'))
+    model_settings = {
+        'CHOOSER_SEGMENT_COLUMN_NAME': 'segment',
+        'SEGMENT_IDS': {'low': 1, 'high': 2, 'empty': 3},
+        'ALT_DEST_COL_NAME': 'dest_TAZ',
+    }
+    spc = ShadowPriceCalculatorStub()
+    sample_cache = {}
+
+    def run(want_sample_table=False):
+        return location_choice.run_location_choice(
+            persons, None, None, spc,
+            want_logsums=False, want_sample_table=want_sample_table, estimator=None,
+            model_settings=model_settings, chunk_size=0, trace_hh_id=None, trace_label='test',
+            sample_cache=sample_cache)
+
+    choices_df, _ = run(want_sample_table=True)
+    assert set(sample_cache.keys()) == {'low', 'high'}
+    assert calls == [('sample', 'low'), ('logsums', 'low'), ('simulate', 'low'),
+                     ('sample', 'high'), ('logsums', 'high'), ('simulate', 'high')]
+    assert (choices_df.choice == 1).all()
+
+    # second iteration only reruns simulate with updated size terms
+    del calls[:]
+    spc.size_factor = 2
+    choices_df, save_sample_df = run(want_sample_table=True)
+    assert calls == [('simulate', 'low'), ('simulate', 'high')]
+    assert (choices_df.choice == 2).all()
+    assert save_sample_df.index.nlevels == 2
+
+    # cached samples are unaffected by want_sample_table set_index
+    assert list(sample_cache['low'].columns) == ['dest_TAZ', 'pick_count', 'mode_choice_logsum']
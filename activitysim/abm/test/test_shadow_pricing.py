@@ -0,0 +1,123 @@
+# ActivitySim
+# See full license in LICENSE.txt.
+
+import multiprocessing
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from activitysim.core import inject
+from activitysim.abm.tables import shadow_pricing
+
+
+def teardown_function(func):
+    for name in ['data_buffers', 'num_processes', 'shadow_pricing_barrier', 'work_units', 'settings']:
+        inject.remove_injectable(name)
+    inject.clear_cache()
+    inject.reinject_decorated_tables()
+
+
+def shadow_price_calculator(shared_data, lock, barrier, num_processes, timeout=None):
+
+    # bypass __init__, which needs model settings and size tables
+    spc = shadow_pricing.ShadowPriceCalculator.__new__(shadow_pricing.ShadowPriceCalculator)
+    spc.num_processes = num_processes
+    spc.shared_data = shared_data
+    spc.shared_data_lock = lock
+    spc.shared_data_barrier = barrier
+    spc.synchronize_timeout = timeout
+    return spc
+
+
+def test_synchronize_choices():
+
+    num_processes = 3
+    num_iterations = 4
+
+    shared_data = np.zeros((5, 2), dtype=np.int64)
+    lock = multiprocessing.Lock()
+    barrier = multiprocessing.Barrier(num_processes)
+
+    results = {}
+
+    def run(i):
+        spc = shadow_price_calculator(shared_data, lock, barrier, num_processes)
+        for iteration in range(num_iterations):
+            local_modeled_size = pd.DataFrame(np.full((5, 2), i + iteration), columns=['a', 'b'])
+            global_modeled_size = spc.synchronize_choices(local_modeled_size)
+            results[(i, iteration)] = global_modeled_size.values
+
+    threads = [threading.Thread(target=run, args=(i, )) for i in range(num_processes)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    for i in range(num_processes):
+        for iteration in range(num_iterations):
+            expected = sum(j + iteration for j in range(num_processes))
+            assert (results[(i, iteration)] == expected).all()
+
+    assert (shared_data == 0).all()
+
+
+def test_synchronize_choices_broken_barrier():
+
+    num_processes = 2
+    barrier = multiprocessing.Barrier(num_processes)
+    spc = shadow_price_calculator(np.zeros((2, 1), dtype=np.int64), multiprocessing.Lock(), barrier,
+                                  num_processes, timeout=0.1)
+
+    # peer never checks in
+    with pytest.raises(threading.BrokenBarrierError):
+        spc.synchronize_choices(pd.DataFrame(np.ones((2, 1), dtype=np.int64)))
+
+
+@pytest.mark.parametrize('settings, model_settings', [
+    ({'use_shadow_pricing': True}, {}),
+    ({'use_shadow_pricing': False}, {'MODELED_SIZE_TABLE': 'workplace_modeled_size'}),
+])
+def test_partial_resume_refused(settings, model_settings):
+
+    # resuming 1 of 2 sub-processes (the other completed in previous run)
+    inject.add_injectable('settings', settings)
+    inject.add_injectable('data_buffers', {})
+    inject.add_injectable('num_processes', 2)
+    inject.add_injectable('shadow_pricing_barrier', multiprocessing.Barrier(1))
+
+    with pytest.raises(RuntimeError) as excinfo:
+        shadow_pricing.load_shadow_price_calculator(dict(model_settings, MODEL_SELECTOR='workplace'))
+    assert "only 1 of the 2 sub-processes are being rerun" in str(excinfo.value)
+
+
+@pytest.mark.parametrize('num_processes', [1, 2])
+def test_work_units_refused(num_processes):
+
+    # work units of a step are not all run at once (no barrier), whatever its num_processes
+    inject.add_injectable('settings', {'use_shadow_pricing': True})
+    inject.add_injectable('data_buffers', {})
+    inject.add_injectable('num_processes', num_processes)
+    inject.add_injectable('shadow_pricing_barrier', None)
+    inject.add_injectable('work_units', 4)
+
+    with pytest.raises(RuntimeError) as excinfo:
+        shadow_pricing.load_shadow_price_calculator({'MODEL_SELECTOR': 'workplace'})
+    assert "in a step without work_units" in str(excinfo.value)
+
+
+def test_work_units_without_shadow_pricing(monkeypatch):
+
+    # without shadow pricing or MODELED_SIZE_TABLE, work units only need their own modeled_size
+    inject.add_injectable('settings', {'use_shadow_pricing': False})
+    inject.add_injectable('data_buffers', {})
+    inject.add_injectable('num_processes', 2)
+    inject.add_injectable('shadow_pricing_barrier', None)
+    inject.add_injectable('work_units', 4)
+
+    monkeypatch.setattr(shadow_pricing, 'ShadowPriceCalculator', lambda *args: args)
+
+    model_settings = {'MODEL_SELECTOR': 'workplace'}
+    spc_args = shadow_pricing.load_shadow_price_calculator(model_settings)
+    assert spc_args == (model_settings, 1, None, None, None)
@@ -4,6 +4,8 @@ from collections import OrderedDict
 import numpy as np
 import pytest
 
+from activitysim.core import inject
+from activitysim.core import skim
 from activitysim.abm.tables import skims
 
 
@@ -65,3 +67,73 @@ def test_multiple_large_floats():
     calculated_value = skims.multiply_large_numbers([6205.1, 5423.2, 932.4, 15.4])
     actual_value = 483200518316.9472
     assert abs(calculated_value - actual_value) < 0.0001
+
+
+def test_mmap_skim_cache(tmpdir):
+
+    skim_info = {
+        'omx_name': 'test_skims',
+        'omx_shape': (4, 4),
+        'dtype': np.float32,
+        'blocks': OrderedDict([('skim_test_skims_0', 2)]),
+        'block_offsets': {'DIST': (0, 0), 'TIME': (0, 1)},
+        'skim_layout': skim.SKIM_MAJOR,
+    }
+    skim_data = [np.arange(32, dtype=np.float32).reshape((2, 4, 4))]
+
+    inject.add_injectable('output_dir', str(tmpdir))
+    inject.add_injectable('settings', {'skim_cache_dir': str(tmpdir), 'mmap_skim_cache': True})
+
+    try:
+        assert skims.use_mmap_skim_cache()
+
+        skims.write_skim_cache(skim_info, skim_data)
+
+        mapped_skim_data = skims.mmap_skim_cache(skim_info)
+        assert len(mapped_skim_data) == 1
+        assert isinstance(mapped_skim_data[0], np.memmap)
+        assert not mapped_skim_data[0].flags.writeable
+        np.testing.assert_array_equal(mapped_skim_data[0], skim_data[0])
+
+        skim_dict = skim.SkimDict(mapped_skim_data, skim_info)
+        np.testing.assert_array_equal(skim_dict.get('TIME').data, skim_data[0][1])
+    finally:
+        inject.clear_cache()
+        inject.reinject_decorated_tables()
+
+
+def test_skim_names_in_usage_file(tmpdir):
+
+    usage_file_path = str(tmpdir.join('skim_usage.txt'))
+    with open(usage_file_path, 'w') as usage_file:
+        print("\n### skim_dict usage", file=usage_file)
+        print("DIST", file=usage_file)
+        print("('SOV_TIME', 'MD')", file=usage_file)
+        print("\n### skim_stack usage", file=usage_file)
+        print("HOV2_TIME", file=usage_file)
+        print("\n### unused skim str keys", file=usage_file)
+        print("DISTBIKE", file=usage_file)
+
+    assert skims.skim_names_in_usage_file(usage_file_path) == {'DIST', 'SOV_TIME', 'HOV2_TIME'}
+
+
+def test_skim_names_in_configs(tmpdir):
+
+    configs_dir = tmpdir.mkdir('configs')
+    configs_dir.join('spec.csv').write(
+        "Label,Expression,coefficient\n"
+        "util_dist,@skims['DIST'],1\n"
+        "util_time,\"@odt_skims['SOV_TIME'] + skim_dict.get(('HOV2_TIME', 'MD')).data.max()\",1\n")
+    configs_dir.join('model.yaml').write("SPEC: spec.csv\n")
+
+    override_dir = tmpdir.mkdir('configs_override')
+    override_dir.join('model.yaml').write("SPEC: spec.csv\nwalk_skim: DISTWALK\n")
+
+    inject.add_injectable('configs_dir', [str(override_dir), str(configs_dir)])
+
+    try:
+        skim_names = ['DIST', 'DISTWALK', 'DISTBIKE', 'SOV_TIME', 'HOV2_TIME', 'HOV3_TIME']
+        assert skims.skim_names_in_configs(skim_names) == {'DIST', 'DISTWALK', 'SOV_TIME', 'HOV2_TIME'}
+    finally:
+        inject.clear_cache()
+        inject.reinject_decorated_tables()
@@ -0,0 +1,83 @@
+# ActivitySim
+# See full license in LICENSE.txt.
+
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+
+from activitysim.core import chunk
+from activitysim.core import inject
+from activitysim.core import random
+from activitysim.abm.models import trip_destination
+
+
+def test_choose_trip_destinations_by_purpose(monkeypatch):
+
+    num_trips = 60
+    trips = pd.DataFrame({
+        'primary_purpose': np.array(['work', 'school', 'shopping', 'eatout'])[np.arange(num_trips) % 4],
+    }, index=pd.Index(np.arange(num_trips) + 100, name='trip_id'))
+
+    def choose_trip_destination(primary_purpose, trips, alternatives, trace_label, **kwargs):
+        assert (trips.primary_purpose == primary_purpose).all()
+        # draw a different number of random numbers per purpose
+        rands = trip_destination.pipeline.get_rn_generator().random_for_df(trips, n=len(primary_purpose))
+        inject.get_injectable('skim_dict').touch(primary_purpose.upper())
+        chunk.check_hwm('bytes', len(primary_purpose) * 1000, primary_purpose, trace_label)
+        chunk.BYTES_PER_ROW[trace_label] = len(primary_purpose)
+        chunk.MEASURED.add(trace_label)
+        choices = pd.DataFrame({'choice': alternatives[(rands[:, -1] * len(alternatives)).astype(int)]},
+                               index=trips.index)
+        return choices, None
+
+    monkeypatch.setattr(trip_destination, 'choose_trip_destination', choose_trip_destination)
+
+    class Skims(object):
+        def __init__(self):
+            self.usage = set()
+
+        def touch(self, key):
+            self.usage.add(key)
+
+    def run(num_processes):
+        skim_dict = Skims()
+        inject.add_injectable('skim_dict', skim_dict)
+        inject.add_injectable('skim_stack', Skims())
+        chunk.HWM[:] = [{}]
+        chunk.BYTES_PER_ROW.clear()
+        chunk.MEASURED.clear()
+
+        rng = random.Random()
+        rng.add_channel('trips', trips)
+        rng.begin_step('trip_destination')
+        monkeypatch.setattr(trip_destination.pipeline, 'get_rn_generator', lambda: rng)
+
+        results = trip_destination.choose_trip_destinations_by_purpose(
+            trips, num_processes, trace_label='test', alternatives=np.arange(1, 26))
+
+        # next draws depend on the (advanced) offsets of trips random number streams
+        return pd.concat([choices for choices, _ in results]), rng.random_for_df(trips), skim_dict.usage
+
+    try:
+        choices, next_rands, usage = run(num_processes=1)
+        assert choices.index.equals(trips.sort_values('primary_purpose', kind='stable').index)
+        assert usage == {'WORK', 'SCHOOL', 'SHOPPING', 'EATOUT'}
+
+        for num_processes in [2, 4]:
+            parallel_choices, parallel_next_rands, parallel_usage = run(num_processes)
+            pdt.assert_frame_equal(parallel_choices, choices)
+            np.testing.assert_array_equal(parallel_next_rands, next_rands)
+
+            # skim usage and chunk measurements of worker processes are merged into parent
+            assert parallel_usage == usage
+            assert chunk.HWM[0]['bytes']['mark'] == len('shopping') * 1000
+            assert chunk.HWM[0]['bytes']['info'] == 'shopping'
+            assert chunk.BYTES_PER_ROW == {'test.%s' % p: len(p) for p in ['work', 'school', 'shopping', 'eatout']}
+            assert chunk.MEASURED == set(chunk.BYTES_PER_ROW.keys())
+    finally:
+        inject.remove_injectable('skim_dict')
+        inject.remove_injectable('skim_stack')
+        inject.reinject_decorated_tables()
+        chunk.HWM[:] = [{}]
+        chunk.BYTES_PER_ROW.clear()
+        chunk.MEASURED.clear()
@@ -12,6 +12,7 @@ import pandas as pd
 from activitysim.core import util
 from activitysim.core import config
 from activitysim.core import pipeline
+from activitysim.core import expression_compiler
 
 logger = logging.getLogger(__name__)
 
@@ -65,6 +66,11 @@ def evaluate_constants(expressions, constants):
     return d
 
 
+def _read_assignment_spec(file_path):
+
+    return pd.read_csv(file_path, comment='#')
+
+
 def read_assignment_spec(fname,
                          description_name="Description",
                          target_name="Target",
@@ -96,7 +102,7 @@ def read_assignment_spec(fname,
         dataframe with three columns: ['description' 'target' 'expression']
     """
 
-    cfg = pd.read_csv(fname, comment='#')
+    cfg = config.cached_file_read(fname, _read_assignment_spec)
 
     # drop null expressions
     # cfg = cfg.dropna(subset=[expression_name])
@@ -243,7 +249,7 @@ def assign_variables(assignment_expressions, df, locals_dict, df_alias=None, tra
 
         if is_temp_scalar(target) or is_throwaway(target):
             try:
-                x = eval(expression, globals(), _locals_dict)
+                x = eval(expression_compiler.compile_python_expression(expression), globals(), _locals_dict)
             except Exception as err:
                 logger.error("assign_variables error: %s: %s", type(err).__name__, str(err))
                 logger.error("assign_variables expression: %s = %s", str(target), str(expression))
@@ -265,7 +271,8 @@ def assign_variables(assignment_expressions, df, locals_dict, df_alias=None, tra
 
             # FIXME should whitelist globals for security?
             globals_dict = {}
-            expr_values = to_series(eval(expression, globals_dict, _locals_dict))
+            expr_values = \
+                to_series(eval(expression_compiler.compile_python_expression(expression), globals_dict, _locals_dict))
 
             np.seterr(**save_err)
             np.seterrcall(saved_handler)
@@ -3,13 +3,22 @@
 from builtins import input
 
 import logging
+import os
 from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # windows
+    fcntl = None
 
 import numpy as np
 import pandas as pd
 
 from . import util
 from . import mem
+from . import config
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +32,18 @@ EFFECTIVE_CHUNK_SIZE = []
 
 HWM = [{}]
 
+# memory measurements of the most recently closed base chunker
+LAST_CHUNK = {}
+
+# adaptive chunking: learned bytes per chooser row keyed by chunker trace_label
+BYTES_PER_ROW = {}
+# trace_labels whose bytes per row have been measured in this run (rather than read from cache file)
+MEASURED = set()
+CHUNK_CACHE_STATE = {'loaded': False}
+
+CHUNK_CACHE_FILE_NAME = 'chunk_cache.csv'
+DEFAULT_PROBE_ROWS = 1000
+
 
 def GB(bytes):
     # symbols = ('', 'K', 'M', 'G', 'T')
@@ -55,6 +76,11 @@ def log_open(trace_label, chunk_size, effective_chunk_size):
     logger.debug("log_open chunker %s chunk_size %s effective_chunk_size %s" %
                  (trace_label, commas(chunk_size), commas(effective_chunk_size)))
 
+    # memory baseline for base chunker
+    if len(CHUNK_LOG) == 0:
+        LAST_CHUNK.clear()
+        LAST_CHUNK['open_mem'] = mem.get_memory_info()
+
     CHUNK_LOG[trace_label] = OrderedDict()
     CHUNK_SIZE.append(chunk_size)
     EFFECTIVE_CHUNK_SIZE.append(effective_chunk_size)
@@ -72,6 +98,11 @@ def log_close(trace_label):
     if len(CHUNK_LOG) == 1:
         log_write_hwm()
 
+        # peak bytes of logged tables and peak memory growth for adaptive chunking
+        hwm = HWM[-1]
+        LAST_CHUNK['bytes'] = hwm.get('bytes', {}).get('mark', 0)
+        LAST_CHUNK['mem'] = max(hwm.get('mem', {}).get('mark', 0) - LAST_CHUNK.get('open_mem', 0), 0)
+
     label, _ = CHUNK_LOG.popitem(last=True)
     assert label == trace_label
     CHUNK_SIZE.pop()
@@ -162,6 +193,40 @@ def check_hwm(tag, value, info, trace_label):
             hwm['trace_label'] = trace_label
 
 
+def get_hwm_state():
+    """
+    high water marks and measured bytes per row of this (e.g. forked worker) process
+
+    Returns
+    -------
+    dict to pass to merge_hwm_state in the parent process
+    """
+
+    return {
+        'hwm': [{tag: dict(hwm) for tag, hwm in d.items()} for d in HWM],
+        'bytes_per_row': {trace_label: BYTES_PER_ROW[trace_label] for trace_label in MEASURED},
+    }
+
+
+def merge_hwm_state(state):
+    """
+    merge high water marks and measured bytes per row returned by get_hwm_state in a
+    forked worker process, which would otherwise be lost when the worker exits
+
+    worker HWM levels are those of the chunkers that were open when it was forked
+    (plus any it opened itself, which it has closed again), so they align with ours
+    """
+
+    for d, worker_d in zip(HWM, state['hwm']):
+        for tag, worker_hwm in worker_d.items():
+            hwm = d.setdefault(tag, {})
+            if worker_hwm.get('mark', 0) > hwm.get('mark', 0):
+                hwm.update(worker_hwm)
+
+    BYTES_PER_ROW.update(state['bytes_per_row'])
+    MEASURED.update(state['bytes_per_row'].keys())
+
+
 def log_write_hwm():
 
     d = HWM[0]
@@ -208,22 +273,198 @@ def rows_per_chunk(chunk_size, row_size, num_choosers, trace_label):
     return rpc, effective_chunk_size
 
 
-def chunked_choosers(choosers, rows_per_chunk):
+def chunk_memory_budget():
+    return config.setting('chunk_memory_budget', 0) or 0
+
+
+def chunk_cache_file_path():
+    return config.output_file_path(CHUNK_CACHE_FILE_NAME)
+
+
+def read_chunk_cache():
+    """
+    read bytes per row learned by a prior run (if any) into BYTES_PER_ROW
+    """
+
+    BYTES_PER_ROW.clear()
+    MEASURED.clear()
+
+    file_path = chunk_cache_file_path()
+    if os.path.isfile(file_path):
+        df = pd.read_csv(file_path, comment='#')
+        BYTES_PER_ROW.update(zip(df.trace_label, df.bytes_per_row))
+        logger.info("read_chunk_cache read %s chunk sizes from %s" % (len(df), file_path))
+
+    CHUNK_CACHE_STATE['loaded'] = True
+
+
+@contextmanager
+def chunk_cache_lock(file_path):
+    """
+    hold an exclusive lock on the chunk cache file (where supported) while it is read and rewritten
+    """
+
+    if fcntl is None:
+        yield
+        return
+
+    with open("%s.lock" % file_path, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def write_chunk_cache():
+    """
+    merge bytes per row measured by adaptive chunking into the chunk cache file
+    so the next run can start with well-sized chunks
+
+    Entries for trace_labels not measured by this process are kept, so that multiprocess
+    sub-processes (which each run different chunkers) don't overwrite one another's.
+    """
+
+    if not MEASURED:
+        return
+
+    file_path = chunk_cache_file_path()
+
+    with chunk_cache_lock(file_path):
+
+        bytes_per_row = OrderedDict()
+        if os.path.isfile(file_path):
+            df = pd.read_csv(file_path, comment='#')
+            bytes_per_row.update(zip(df.trace_label, df.bytes_per_row))
+
+        for trace_label in sorted(MEASURED):
+            bytes_per_row[trace_label] = BYTES_PER_ROW[trace_label]
+
+        df = pd.DataFrame(list(bytes_per_row.items()), columns=['trace_label', 'bytes_per_row'])
+
+        # write to temp file and rename so concurrent readers never see a partial file
+        temp_file_path = "%s.%s.tmp" % (file_path, os.getpid())
+        df.to_csv(temp_file_path, index=False)
+        os.replace(temp_file_path, file_path)
+
+    logger.info("write_chunk_cache wrote %s chunk sizes (%s measured) to %s" % (len(df), len(MEASURED), file_path))
+
+
+def adaptive_rows_per_chunk(trace_label, rows_per_chunk, num_choosers):
+    """
+    rows for the first chunk of an adaptive chunker
+
+    If bytes per row has been learned for trace_label (in this run or a prior run), size the
+    chunk to fit chunk_memory_budget. Otherwise run a probe chunk of no more than
+    chunk_probe_rows rows (or the static rows_per_chunk if that is smaller) and measure it.
+
+    Returns rows_per_chunk unchanged if adaptive chunking is not enabled.
+    """
+
+    # nested chunkers should be unchunked
+    budget = chunk_memory_budget()
+    if not budget or not trace_label or len(CHUNK_LOG) > 0:
+        return rows_per_chunk
+
+    if not CHUNK_CACHE_STATE['loaded']:
+        read_chunk_cache()
+
+    bytes_per_row = BYTES_PER_ROW.get(trace_label)
+    if bytes_per_row:
+        rpc = int(budget / bytes_per_row)
+    else:
+        probe_rows = config.setting('chunk_probe_rows', DEFAULT_PROBE_ROWS)
+        rpc = min(rows_per_chunk, probe_rows)
+
+    rpc = int(np.clip(rpc, 1, num_choosers))
+
+    logger.debug("#chunk_calc adaptive initial rows_per_chunk: %s bytes_per_row: %s : %s" %
+                 (rpc, bytes_per_row, trace_label))
+
+    return rpc
+
+
+def adaptive_resize(trace_label, chunk_rows, rows_per_chunk, num_choosers):
+    """
+    measure the memory used by the chunk just processed and resize the next chunk to fit chunk_memory_budget
+
+    Memory used is the larger of the peak bytes of tables logged with log_df and the peak growth in
+    process memory while the chunk was open, except for the probe chunk (the first chunk of a trace_label
+    with no prior estimate), whose process memory growth includes one-time costs that don't scale with
+    the number of rows (e.g. lazily loaded data and allocator arenas), so only its logged bytes are used.
+    Bytes per row is that of the most recently measured chunk, so the estimate can shrink as well as grow.
+
+    Parameters
+    ----------
+    trace_label : str
+        chunker trace_label
+    chunk_rows : int
+        number of chooser rows in the chunk just processed
+    rows_per_chunk : int
+        current rows_per_chunk (returned unchanged if there is nothing to measure)
+    num_choosers : int
+
+    Returns
+    -------
+    rows_per_chunk : int
+    """
+
+    budget = chunk_memory_budget()
+    if not budget or not trace_label or not chunk_rows or 'bytes' not in LAST_CHUNK:
+        return rows_per_chunk
+
+    if trace_label in BYTES_PER_ROW:
+        chunk_bytes = max(LAST_CHUNK['bytes'], LAST_CHUNK['mem'])
+    else:
+        # probe chunk (fall back to memory growth if it logged no tables)
+        chunk_bytes = LAST_CHUNK['bytes'] or LAST_CHUNK['mem']
+    LAST_CHUNK.clear()
+
+    if not chunk_bytes:
+        return rows_per_chunk
+
+    bytes_per_row = chunk_bytes / float(chunk_rows)
+    MEASURED.add(trace_label)
+    BYTES_PER_ROW[trace_label] = bytes_per_row
+
+    rpc = int(np.clip(int(budget / bytes_per_row), 1, num_choosers))
+
+    logger.debug("#chunk_calc adaptive chunk_rows: %s chunk_bytes: %s bytes_per_row: %s rows_per_chunk: %s : %s" %
+                 (chunk_rows, GB(chunk_bytes), commas(bytes_per_row), rpc, trace_label))
+
+    return rpc
+
+
+def estimated_num_chunks(i, offset, num_choosers, rows_per_chunk):
+    # chunks already yielded plus chunks needed for remaining choosers at current rows_per_chunk
+    remaining = num_choosers - offset
+    return i + (remaining // rows_per_chunk) + (remaining % rows_per_chunk > 0)
+
+
+def chunked_choosers(choosers, rows_per_chunk, trace_label=None):
+    """
+    generator to iterate over choosers in chunk_size chunks
+
+    If chunk_memory_budget is set, chunks are resized after each chunk based on measured memory
+    (see adaptive_resize), in which case num_chunks is an estimate that may change from chunk to chunk.
+    """
 
     assert choosers.shape[0] > 0
 
-    # generator to iterate over choosers in chunk_size chunks
     num_choosers = len(choosers.index)
-    num_chunks = (num_choosers // rows_per_chunk) + (num_choosers % rows_per_chunk > 0)
+    rows_per_chunk = adaptive_rows_per_chunk(trace_label, rows_per_chunk, num_choosers)
 
     i = offset = 0
     while offset < num_choosers:
-        yield i+1, num_chunks, choosers.iloc[offset: offset+rows_per_chunk]
+        num_chunks = estimated_num_chunks(i, offset, num_choosers, rows_per_chunk)
+        chooser_chunk = choosers.iloc[offset: offset+rows_per_chunk]
+        yield i+1, num_chunks, chooser_chunk
         offset += rows_per_chunk
         i += 1
+        rows_per_chunk = adaptive_resize(trace_label, len(chooser_chunk), rows_per_chunk, num_choosers)
 
 
-def chunked_choosers_and_alts(choosers, alternatives, rows_per_chunk):
+def chunked_choosers_and_alts(choosers, alternatives, rows_per_chunk, trace_label=None):
     """
     generator to iterate over choosers and alternatives in chunk_size chunks
 
@@ -244,6 +485,8 @@ def chunked_choosers_and_alts(choosers, alternatives, rows_per_chunk):
     alternatives : pandas DataFrame
         sample alternatives including pick_count column in same order as choosers
     rows_per_chunk : int
+    trace_label : str
+        chunker trace_label (used to learn chunk sizes if chunk_memory_budget is set)
 
     Yields
     -------
@@ -271,23 +514,24 @@ def chunked_choosers_and_alts(choosers, alternatives, rows_per_chunk):
     assert 'pick_count' in alternatives.columns or choosers.index.name == alternatives.index.name
 
     num_choosers = len(choosers.index)
-    num_chunks = (num_choosers // rows_per_chunk) + (num_choosers % rows_per_chunk > 0)
+    rows_per_chunk = adaptive_rows_per_chunk(trace_label, rows_per_chunk, num_choosers)
 
     assert choosers.index.name == alternatives.index.name
 
     # alt chunks boundaries are where index changes
     alt_ids = alternatives.index.values
-    alt_chunk_end = np.where(alt_ids[:-1] != alt_ids[1:])[0] + 1
-    alt_chunk_end = np.append([0], alt_chunk_end)  # including the first...
-    alt_chunk_end = alt_chunk_end[rows_per_chunk::rows_per_chunk]
+    alt_chooser_start = np.where(alt_ids[:-1] != alt_ids[1:])[0] + 1
+    alt_chooser_start = np.append([0], alt_chooser_start)  # including the first...
 
     # add index to end of array to capture any final partial chunk
-    alt_chunk_end = np.append(alt_chunk_end, [len(alternatives.index)])
+    alt_chooser_start = np.append(alt_chooser_start, [len(alternatives.index)])
 
     i = offset = alt_offset = 0
     while offset < num_choosers:
 
-        alt_end = alt_chunk_end[i]
+        num_chunks = estimated_num_chunks(i, offset, num_choosers, rows_per_chunk)
+
+        alt_end = alt_chooser_start[min(offset + rows_per_chunk, num_choosers)]
 
         chooser_chunk = choosers[offset: offset + rows_per_chunk]
         alternative_chunk = alternatives[alt_offset: alt_end]
@@ -299,9 +543,10 @@ def chunked_choosers_and_alts(choosers, alternatives, rows_per_chunk):
         i += 1
         offset += rows_per_chunk
         alt_offset = alt_end
+        rows_per_chunk = adaptive_resize(trace_label, len(chooser_chunk), rows_per_chunk, num_choosers)
 
 
-def chunked_choosers_by_chunk_id(choosers, rows_per_chunk):
+def chunked_choosers_by_chunk_id(choosers, rows_per_chunk, trace_label=None):
     # generator to iterate over choosers in chunk_size chunks
     # like chunked_choosers but based on chunk_id field rather than dataframe length
     # (the presumption is that choosers has multiple rows with the same chunk_id that
@@ -311,11 +556,14 @@ def chunked_choosers_by_chunk_id(choosers, rows_per_chunk):
     assert choosers.shape[0] > 0
 
     num_choosers = choosers['chunk_id'].max() + 1
-    num_chunks = (num_choosers // rows_per_chunk) + (num_choosers % rows_per_chunk > 0)
+    rows_per_chunk = adaptive_rows_per_chunk(trace_label, rows_per_chunk, num_choosers)
 
     i = offset = 0
     while offset < num_choosers:
+        num_chunks = estimated_num_chunks(i, offset, num_choosers, rows_per_chunk)
+        chunk_rows = min(rows_per_chunk, num_choosers - offset)
         chooser_chunk = choosers[choosers['chunk_id'].between(offset, offset + rows_per_chunk - 1)]
         yield i+1, num_chunks, chooser_chunk
         offset += rows_per_chunk
         i += 1
+        rows_per_chunk = adaptive_resize(trace_label, chunk_rows, rows_per_chunk, num_choosers)
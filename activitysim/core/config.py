@@ -1,6 +1,7 @@
 # ActivitySim
 # See full license in LICENSE.txt.
 import argparse
+import copy
 import os
 import yaml
 import sys
@@ -62,6 +63,12 @@ def rng_base_seed():
     return 0
 
 
+@inject.injectable(cache=True)
+def rng_channel_type(settings):
+    # 'simple' (default) or 'philox' - see random.CHANNEL_TYPES
+    return settings.get('rng_channel_type', None)
+
+
 @inject.injectable(cache=True)
 def settings():
     settings_dict = read_settings_file('settings.yaml', mandatory=True)
@@ -246,6 +253,86 @@ def pipeline_file_path(file_name):
     return build_output_file_path(file_name, use_prefix=prefix)
 
 
+# (reader module, reader name, real file path) => (file signature, parsed contents)
+_FILE_CACHE = {}
+
+# counts of file reads and of cache hits (i.e. disk reads saved) by cached_file_read
+_FILE_CACHE_STATS = {'reads': 0, 'hits': 0}
+
+
+def file_signature(file_path):
+    stat = os.stat(file_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def cached_file_read(file_path, reader):
+    """
+    Return a copy of reader(file_path), only reading and parsing the file if it was not already
+    read by the same reader, or if it has been modified since it was (by mtime and size)
+
+    Spec, coefficient, and settings files are read in per-segment, per-chunk, and per-iteration
+    loops, so we keep the parsed contents and give each caller its own copy, leaving the cached
+    version unchanged (callers routinely modify their spec or settings).
+
+    Parameters
+    ----------
+    file_path : str
+    reader : function
+        reader(file_path) returns parsed contents (e.g. DataFrame or dict)
+
+    Returns
+    -------
+    copy of parsed contents
+    """
+
+    real_path = os.path.realpath(file_path)
+    key = (reader.__module__, reader.__name__, real_path)
+    signature = file_signature(real_path)
+
+    cached = _FILE_CACHE.get(key)
+    if cached is not None and cached[0] == signature:
+        _FILE_CACHE_STATS['hits'] += 1
+        contents = cached[1]
+    else:
+        _FILE_CACHE_STATS['reads'] += 1
+        contents = reader(file_path)
+        _FILE_CACHE[key] = (signature, contents)
+
+    return copy.deepcopy(contents)
+
+
+def clear_file_cache(file_path=None):
+    """
+    Invalidate cached contents of file_path (read by any reader), or of all files if file_path is None
+    """
+
+    if file_path is None:
+        _FILE_CACHE.clear()
+    else:
+        real_path = os.path.realpath(file_path)
+        for key in [k for k in _FILE_CACHE if k[-1] == real_path]:
+            del _FILE_CACHE[key]
+
+
+def file_cache_stats():
+    """
+    Returns
+    -------
+    dict with number of files read ('reads') and number of reads saved by cached_file_read ('hits')
+    """
+
+    return dict(_FILE_CACHE_STATS)
+
+
+def read_yaml_file(file_path):
+
+    with open(file_path) as f:
+        s = yaml.load(f, Loader=yaml.SafeLoader)
+        if s is None:
+            s = {}
+    return s
+
+
 def read_settings_file(file_name, mandatory=True):
 
     def backfill_settings(settings, backfill):
@@ -267,10 +354,7 @@ def read_settings_file(file_name, mandatory=True):
             if settings:
                 logger.debug("read settings for %s from %s" % (file_name, file_path))
 
-            with open(file_path) as f:
-                s = yaml.load(f, Loader=yaml.SafeLoader)
-                if s is None:
-                    s = {}
+            s = cached_file_read(file_path, read_yaml_file)
 
             settings = backfill_settings(settings, s)
 
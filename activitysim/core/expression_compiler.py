@@ -0,0 +1,171 @@
+# ActivitySim
+# See full license in LICENSE.txt.
+import ast
+import io
+import logging
+import tokenize
+
+logger = logging.getLogger(__name__)
+
+"""
+Compile spec expressions once per process rather than every time they are evaluated.
+
+Spec expressions are evaluated for every chunk, every segment, and every shadow price iteration.
+Python ('@') expressions are compiled to code objects the first time they are seen.
+
+Simple expressions (evaluated with DataFrame.eval) are translated to python code objects that
+apply the same operators to the underlying numpy arrays of the referenced df columns, avoiding
+the cost of DataFrame.eval parsing the expression on every call. Like DataFrame.eval, '&' and '|'
+bind less tightly than comparisons, 'and', 'or', and 'not' are elementwise, and chained
+comparisons are supported. Expressions that use any other syntax (e.g. method calls, attribute
+access, or '@' local variables) or that refer to names that aren't df columns are evaluated
+with DataFrame.eval as before.
+"""
+
+# expression => code object
+_PYTHON_CODE = {}
+
+# expression => (code object, column names, has_arithmetic) or None if not compilable
+_SIMPLE_CODE = {}
+
+COMPARE_OPS = (ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+ARITHMETIC_OPS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.Mod, ast.FloorDiv)
+LOGICAL_OPS = (ast.BitAnd, ast.BitOr, ast.BitXor)
+ARITHMETIC_UNARY_OPS = (ast.USub, ast.UAdd)
+LOGICAL_UNARY_OPS = (ast.Invert, ast.Not)
+
+
+def compile_python_expression(expression):
+    """
+    Return (cached) code object for a python expression
+
+    Parameters
+    ----------
+    expression : str
+        python expression (without '@' prefix)
+
+    Returns
+    -------
+    code object suitable for eval
+    """
+
+    code = _PYTHON_CODE.get(expression)
+    if code is None:
+        code = compile(expression.strip(), '<expression>', 'eval')
+        _PYTHON_CODE[expression] = code
+    return code
+
+
+def replace_booleans(expression):
+    # as in DataFrame.eval, '&' and '|' have the (lower) precedence of 'and' and 'or'
+    tokens = []
+    for tok in tokenize.generate_tokens(io.StringIO(expression).readline):
+        if tok.type == tokenize.OP and tok.string in ['&', '|']:
+            tokens.append((tokenize.NAME, 'and' if tok.string == '&' else 'or'))
+        else:
+            tokens.append((tok.type, tok.string))
+    return tokenize.untokenize(tokens)
+
+
+class SimpleExpressionTransformer(ast.NodeTransformer):
+    """
+    rewrite (validated) simple expression ast to elementwise numpy operations
+    """
+
+    def visit_BoolOp(self, node):
+        op = ast.BitAnd() if isinstance(node.op, ast.And) else ast.BitOr()
+        values = [self.visit(v) for v in node.values]
+        result = values[0]
+        for v in values[1:]:
+            result = ast.BinOp(left=result, op=op, right=v)
+        return result
+
+    def visit_UnaryOp(self, node):
+        operand = self.visit(node.operand)
+        op = ast.Invert() if isinstance(node.op, ast.Not) else node.op
+        return ast.UnaryOp(op=op, operand=operand)
+
+    def visit_Compare(self, node):
+        left = self.visit(node.left)
+        comparators = [self.visit(c) for c in node.comparators]
+        result = None
+        for op, right in zip(node.ops, comparators):
+            compare = ast.Compare(left=left, ops=[op], comparators=[right])
+            result = compare if result is None else ast.BinOp(left=result, op=ast.BitAnd(), right=compare)
+            left = right
+        return result
+
+
+def simple_expression_names(tree):
+    """
+    Return (names, has_arithmetic) if tree only uses syntax we can evaluate elementwise, else None
+    """
+
+    ignored_nodes = (ast.Expression, ast.Load, ast.And, ast.Or) + COMPARE_OPS + LOGICAL_OPS + LOGICAL_UNARY_OPS
+
+    names = set()
+    has_arithmetic = False
+    for node in ast.walk(tree):
+        if isinstance(node, ignored_nodes):
+            continue
+        elif isinstance(node, ARITHMETIC_OPS + ARITHMETIC_UNARY_OPS):
+            has_arithmetic = True
+        elif isinstance(node, (ast.BoolOp, ast.BinOp, ast.UnaryOp, ast.Compare)):
+            continue
+        elif isinstance(node, ast.Name):
+            names.add(node.id)
+        elif isinstance(node, ast.Constant) and isinstance(node.value, (int, float, str)):
+            continue
+        else:
+            return None
+    return names, has_arithmetic
+
+
+def compile_simple_expression(expression):
+    """
+    Return (cached) (code, names, has_arithmetic) for a simple expression, or None if
+    expression can't be compiled and should be evaluated with DataFrame.eval
+    """
+
+    if expression in _SIMPLE_CODE:
+        return _SIMPLE_CODE[expression]
+
+    compiled = None
+    if '@' not in expression and '`' not in expression:
+        try:
+            tree = ast.parse(replace_booleans(expression).strip(), mode='eval')
+        except (SyntaxError, tokenize.TokenError):
+            tree = None
+
+        references = simple_expression_names(tree) if tree is not None else None
+
+        if references is not None:
+            names, has_arithmetic = references
+            tree = ast.fix_missing_locations(SimpleExpressionTransformer().visit(tree))
+            code = compile(tree, '<expression>', 'eval')
+            compiled = (code, names, has_arithmetic)
+
+    _SIMPLE_CODE[expression] = compiled
+    return compiled
+
+
+def eval_simple_expression(expression, df):
+    """
+    Evaluate simple expression in the context of df (like df.eval(expression))
+
+    Returns
+    -------
+    numpy array (or scalar) if expression was compiled, else result of DataFrame.eval
+    """
+
+    compiled = compile_simple_expression(expression)
+
+    if compiled is not None:
+        code, names, has_arithmetic = compiled
+        if all(name in df.columns for name in names):
+            columns = {name: df[name].values for name in names}
+            # numpy bool arithmetic differs from DataFrame.eval (e.g. True + True is True)
+            if not has_arithmetic or all(v.dtype.kind in 'iuf' for v in columns.values()):
+                return eval(code, {'__builtins__': {}}, columns)
+
+    return df.eval(expression)
@@ -156,6 +156,33 @@ def clear_cache():
     return orca.clear_cache()
 
 
+def get_injectables_snapshot():
+    """
+    snapshot of registered injectables (to restore with restore_injectables_snapshot)
+    """
+    return dict(orca._INJECTABLES)
+
+
+def restore_injectables_snapshot(snapshot, keep_cached=None):
+    """
+    restore registered injectables to snapshot and clear all cached tables and injectables,
+    except for the cached values of injectables named in keep_cached
+
+    used by long-lived (pool) sub processes to start each task with fresh tables and injectables
+    """
+
+    keep_cached = keep_cached or []
+    kept = {name: orca._INJECTABLE_CACHE[name] for name in keep_cached if name in orca._INJECTABLE_CACHE}
+
+    orca._INJECTABLES.clear()
+    orca._INJECTABLES.update(snapshot)
+
+    reinject_decorated_tables()
+    clear_cache()
+
+    orca._INJECTABLE_CACHE.update(kept)
+
+
 def set_step_args(args=None):
 
     assert isinstance(args, dict) or args is None
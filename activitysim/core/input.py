@@ -5,6 +5,7 @@ import logging
 import warnings
 import os
 
+import numpy as np
 import pandas as pd
 
 from activitysim.core import (
@@ -16,14 +17,23 @@ from activitysim.core import (
 logger = logging.getLogger(__name__)
 
 
-def read_input_table(tablename):
+def read_input_table(tablename, columns=None, filter_col=None, filter_values=None):
     """Reads input table name and returns cleaned DataFrame.
 
     Uses settings found in input_table_list in settings.yaml
 
+    Only the required columns and (if filter_values is specified) rows are read from HDF5 files
+    written in table format. Rows are filtered and columns dropped after reading other file types.
+
     Parameters
     ----------
     tablename : string
+    columns : list of str, optional
+        columns (after renaming) to return instead of table_info keep_columns (e.g. [] to read only the index)
+    filter_col : str, optional
+        name (after renaming) of column whose values select the rows to read (defaults to index_col)
+    filter_values : list-like, optional
+        read only rows whose filter_col value is in filter_values (rows are returned in file order)
 
     Returns
     -------
@@ -40,10 +50,10 @@ def read_input_table(tablename):
     assert table_info is not None, \
         'could not find info for for tablename %s in settings.yaml' % tablename
 
-    return read_from_table_info(table_info)
+    return read_from_table_info(table_info, columns, filter_col, filter_values)
 
 
-def read_from_table_info(table_info):
+def read_from_table_info(table_info, columns=None, filter_col=None, filter_values=None):
     """
     Read input text files and return cleaned up DataFrame.
 
@@ -67,6 +77,7 @@ def read_from_table_info(table_info):
     | h5_tablename | name of target table in HDF5 file                        |
     +--------------+----------------------------------------------------------+
 
+    columns, filter_col, and filter_values are as described in read_input_table
     """
     input_store = config.setting('input_store', None)
     create_input_store = config.setting('create_input_store', default=False)
@@ -85,7 +96,25 @@ def read_from_table_info(table_info):
 
     data_file_path = config.data_file_path(data_filename)
 
-    df = _read_input_file(data_file_path, h5_tablename=h5_tablename)
+    if filter_values is not None and filter_col is None:
+        filter_col = index_col
+        assert filter_col is not None, 'no filter_col or index_col to filter %s rows' % tablename
+
+    # - names of columns in input file (before renaming) to read (or None to read all columns)
+    input_names = {}
+    for renames in [column_map, rename_columns]:
+        input_names.update({new_name: old_name for old_name, new_name in (renames or {}).items()})
+
+    read_columns = columns if columns is not None else (keep_columns or None)
+    if read_columns is not None and not create_input_store:
+        read_columns = [input_names.get(c, c) for c in list(read_columns) + [index_col, filter_col] if c is not None]
+    else:
+        read_columns = None
+
+    # input store gets the whole table, so only filter rows after writing it
+    input_filter_col = input_names.get(filter_col, filter_col)
+    df = _read_input_file(data_file_path, h5_tablename=h5_tablename, columns=read_columns,
+                          filter_col=input_filter_col, filter_values=None if create_input_store else filter_values)
 
     logger.debug('raw %s table columns: %s' % (tablename, df.columns.values))
     logger.debug('raw %s table size: %s' % (tablename, util.df_size(df)))
@@ -93,13 +122,16 @@ def read_from_table_info(table_info):
     if create_input_store:
         h5_filepath = config.output_file_path('input_data.h5')
         logger.info('writing %s to %s' % (h5_tablename, h5_filepath))
-        df.to_hdf(h5_filepath, key=h5_tablename, mode='a')
+        # table format so subsequent runs can read only the rows and columns they need
+        df.to_hdf(h5_filepath, key=h5_tablename, mode='a', format='table')
 
         csv_dir = config.output_file_path('input_data')
         if not os.path.exists(csv_dir):
             os.makedirs(csv_dir)  # make directory if needed
         df.to_csv(os.path.join(csv_dir, '%s.csv' % tablename), index=False)
 
+        df = _filter_rows(df, input_filter_col, filter_values)
+
     if drop_columns:
         logger.debug("dropping columns: %s" % drop_columns)
         df.drop(columns=drop_columns, inplace=True, errors='ignore')
@@ -124,10 +156,13 @@ def read_from_table_info(table_info):
         else:
             df.index.names = [index_col]
 
-    logger.info("keeping columns: %s" % keep_columns)
-    if keep_columns:
+    if columns is not None:
+        df = df[columns]
+    else:
         logger.info("keeping columns: %s" % keep_columns)
-        df = df[keep_columns]
+        if keep_columns:
+            logger.info("keeping columns: %s" % keep_columns)
+            df = df[keep_columns]
 
     logger.debug('%s table columns: %s' % (tablename, df.columns.values))
     logger.debug('%s table size: %s' % (tablename, util.df_size(df)))
@@ -136,31 +171,94 @@ def read_from_table_info(table_info):
     return df
 
 
-def _read_input_file(filepath, h5_tablename=None):
+def _read_input_file(filepath, h5_tablename=None, columns=None, filter_col=None, filter_values=None):
+    """
+    read input file, optionally only reading (or keeping) columns and rows with filter_col value in filter_values
+
+    columns not in file are ignored (e.g. index_col if HDF5 table is already indexed)
+    """
     assert os.path.exists(filepath), 'input file not found: %s' % filepath
 
     if filepath.endswith('.csv'):
-        return _read_csv_with_fallback_encoding(filepath)
+        # usecols callable ignores columns not in file
+        usecols = None if columns is None else set(columns).__contains__
+        df = _read_csv_with_fallback_encoding(filepath, usecols=usecols)
+        return _filter_rows(df, filter_col, filter_values)
 
     if filepath.endswith('.h5'):
         assert h5_tablename is not None, 'must provide a tablename to read HDF5 table'
         logger.info('reading %s table from %s' % (h5_tablename, filepath))
-        return pd.read_hdf(filepath, h5_tablename)
+
+        with pd.HDFStore(filepath, mode='r') as store:
+            if store.get_storer(h5_tablename).is_table:
+                return _read_hdf_table(store, h5_tablename, columns, filter_col, filter_values)
+
+            logger.debug('reading all rows and columns of fixed format HDF5 table %s' % h5_tablename)
+            df = store.select(h5_tablename)
+
+        if columns is not None:
+            df = df[[c for c in df.columns if c in set(columns)]]
+        return _filter_rows(df, filter_col, filter_values)
 
     raise IOError(
         'Unsupported file type: %s. '
         'ActivitySim supports CSV and HDF5 files only' % filepath)
 
 
-def _read_csv_with_fallback_encoding(filepath):
+def _read_hdf_table(store, h5_tablename, columns=None, filter_col=None, filter_values=None):
+    """
+    read columns and rows with filter_col value in filter_values from HDF5 table format table in store
+    """
+
+    # empty selection to get column names and index name
+    empty_df = store.select(h5_tablename, start=0, stop=0)
+
+    if columns is not None:
+        columns = [c for c in empty_df.columns if c in set(columns)]
+
+    if filter_col is None:
+        return store.select(h5_tablename, columns=columns)
+
+    # read filter_col to find coordinates of rows to read
+    if filter_col == empty_df.index.name and filter_col not in empty_df.columns:
+        filter_col_values = store.select_column(h5_tablename, 'index')
+    else:
+        filter_col_values = store.select(h5_tablename, columns=[filter_col])[filter_col]
+
+    coordinates = np.flatnonzero(filter_col_values.isin(filter_values).values)
+
+    logger.info('reading %s of %s rows of %s' % (len(coordinates), len(filter_col_values), h5_tablename))
+
+    if len(coordinates) == 0:
+        # an empty where selects all rows
+        return store.select(h5_tablename, start=0, stop=0, columns=columns)
+
+    return store.select(h5_tablename, where=coordinates, columns=columns)
+
+
+def _filter_rows(df, filter_col, filter_values):
+    """
+    rows of df with filter_col (column or index name) value in filter_values
+    """
+
+    if filter_values is None:
+        return df
+
+    if filter_col == df.index.name and filter_col not in df.columns:
+        return df[df.index.isin(filter_values)]
+
+    return df[df[filter_col].isin(filter_values)]
+
+
+def _read_csv_with_fallback_encoding(filepath, usecols=None):
     """read a CSV to a pandas DataFrame using default utf-8 encoding,
     but try alternate Windows-compatible cp1252 if unicode fails
 
     """
     try:
         logger.info('Reading CSV file %s' % filepath)
-        return pd.read_csv(filepath, comment='#')
+        return pd.read_csv(filepath, comment='#', usecols=usecols)
     except UnicodeDecodeError:
         logger.warning(
             'Reading %s with default utf-8 encoding failed, trying cp1252 instead', filepath)
-        return pd.read_csv(filepath, comment='#', encoding='cp1252')
+        return pd.read_csv(filepath, comment='#', encoding='cp1252', usecols=usecols)
@@ -2,6 +2,7 @@
 # See full license in LICENSE.txt.
 from builtins import range
 
+import builtins
 import logging
 
 from math import ceil
@@ -13,7 +14,11 @@ from activitysim.core.mem import force_garbage_collect
 from . import logit
 from . import tracing
 from . import chunk
+from . import config
+from . import simulate
+from . import interaction_simulate
 from .simulate import set_skim_wrapper_targets
+from .skim import SkimDictWrapper, SkimStackWrapper
 
 
 from .interaction_simulate import eval_interaction_utilities
@@ -65,63 +70,306 @@ def make_sample_choices(
             probs = probs[~zero_probs]
             choosers = choosers[~zero_probs]
 
+    # get sample_size rands for each chooser
+    # rands has one row per chooser and one column per sample draw
+    rands = pipeline.get_rn_generator().random_for_df(probs, n=sample_size)
+
+    chooser_count = len(choosers)
+
+    # offset each chooser's cum_probs (and rands) by its row number, so that the flattened
+    # cum_probs_arr is monotonic and we can resolve all draws for all choosers with one searchsorted
+    # (rather than an argmax over a full choosers x alternatives boolean temporary per draw)
+    row_offsets = np.arange(chooser_count).reshape(-1, 1)
     cum_probs_arr = probs.values.cumsum(axis=1)
+    cum_probs_arr += row_offsets
 
-    # alt probs in convenient layout to return prob of chose alternative
-    # (same layout as cum_probs_arr)
-    alt_probs_array = probs.values.flatten()
+    # positions is index into flattened probs of first cum_prob greater than rand (same as argmax(cum_probs > r))
+    positions = np.searchsorted(cum_probs_arr.ravel(), (rands + row_offsets).ravel(), side='right')
+    del cum_probs_arr
 
-    # get sample_size rands for each chooser
-    # transform as we iterate over alternatives
-    # reshape so rands[i] is in broadcastable (2-D) shape for cum_probs_arr
-    # i.e rands[i] is a 2-D array of one alt choice rand for each chooser
-    rands = pipeline.get_rn_generator().random_for_df(probs, n=sample_size)
-    rands = rands.T.reshape(sample_size, -1, 1)
+    # if rand exceeds (rounded) row total, position will have spilled into the start of the next chooser's row,
+    # in which case argmax would have chosen the first alternative (position 0 in chooser's row)
+    chooser_row_starts = np.repeat(np.arange(chooser_count) * alternative_count, sample_size)
+    positions = np.where(positions >= chooser_row_starts + alternative_count, chooser_row_starts, positions)
+
+    # explode to one row per chooser.index, alt_TAZ
+    choices_df = pd.DataFrame(
+        {alt_col_name: np.take(alternatives.index.values, positions - chooser_row_starts),
+         'rand': rands.ravel(),
+         'prob': np.take(probs.values.ravel(), positions),
+         choosers.index.name: np.repeat(np.asanyarray(choosers.index), sample_size)
+         })
+
+    return choices_df
+
+
+# spec term classes for decompose_interaction_spec
+CHOOSER_TERMS = 'chooser'
+ALTERNATIVE_TERMS = 'alternative'
+INTERACTION_TERMS = 'interaction'
+
+
+def decompose_interaction_spec(spec, choosers, alternatives, locals_d):
+    """
+    Split an interaction_sample spec into terms that can be evaluated in their natural shape
+
+    chooser terms only reference chooser columns (evaluated once per chooser)
+    alternative terms only reference alternative columns (evaluated once per alternative)
+    interaction terms reference skims or both chooser and alternative columns.
+
+    Interaction terms are evaluated on the cross join of alternatives with the distinct
+    combinations of just the chooser (profile) columns the interaction terms reference
+    (e.g. origin zone and income segment) rather than the cross join of all choosers.
+
+    Column names are as they would appear in the full interaction_dataset (chooser columns that
+    collide with alternative columns get a '_chooser' suffix) so the spec expressions are unchanged.
 
-    # the alternative value chosen
-    choices_array = np.empty([sample_size, len(choosers)]).astype(int)
+    Parameters
+    ----------
+    spec : pandas.DataFrame
+        one row per spec expression and one col with utility coefficient
+    choosers : pandas.DataFrame
+    alternatives : pandas.DataFrame
+    locals_d : dict
 
-    # the probability of the chosen alternative
-    choice_probs_array = np.empty([sample_size, len(choosers)])
+    Returns
+    -------
+    term_specs : dict or None
+        dict mapping CHOOSER_TERMS, ALTERNATIVE_TERMS, INTERACTION_TERMS to (possibly empty) spec subset
+        with the terms of that class (and any temps they require), and 'profile_columns' to list of
+        chooser column names needed by interaction terms.
+        None if spec can't be decomposed (caller should use full cross join)
+    """
 
-    alts = np.tile(alternatives.index.values, len(choosers))
+    locals_d = locals_d or {}
 
-    # FIXME - do this all at once rather than iterate?
-    for i in range(sample_size):
+    alt_columns = set(alternatives.columns)
 
-        # FIXME - do this in numpy, not pandas?
+    # map interaction_dataset column name to chooser column name
+    chooser_columns = {(c + '_chooser' if c in alt_columns else c): c for c in choosers.columns}
 
-        # rands for this alt in broadcastable shape
-        r = rands[i]
+    def column_deps(column_name, deps):
+        if column_name in alt_columns:
+            deps['alt'] = True
+        elif column_name in chooser_columns:
+            deps['chooser_columns'].add(chooser_columns[column_name])
+        else:
+            return False
+        return True
 
-        # position of first occurrence of positive value
-        positions = np.argmax(cum_probs_arr > r, axis=1)
+    # names resolvable by eval_interaction_utilities (apart from skim wrappers and temps)
+    known_names = set(dir(interaction_simulate)) | set(dir(builtins)) | set(locals_d.keys())
 
-        # FIXME - leave positions as numpy array, not pandas series?
-        # positions is series with the chosen alternative represented as a column index in probs
-        # which is an integer between zero and num alternatives in the alternative sample
-        positions = pd.Series(positions, index=probs.index)
+    if isinstance(spec.index, pd.MultiIndex):
+        exprs = spec.index.get_level_values(simulate.SPEC_EXPRESSION_NAME)
+    else:
+        exprs = spec.index
+
+    temps = {}
+    row_deps = []
+    for expr in exprs:
+
+        refs = simulate.expression_references(expr)
+        if refs is None:
+            logger.debug("decompose_interaction_spec can't decompose expression: %s" % expr)
+            return None
+        columns, names = refs
+
+        deps = {'chooser_columns': set(), 'alt': False, 'skims': False, 'temps': set()}
+
+        for c in columns:
+            if not column_deps(c, deps):
+                logger.debug("decompose_interaction_spec unknown column %s in expression: %s" % (c, expr))
+                return None
+
+        for name in names:
+            if name in temps:
+                temp_deps = temps[name]
+                deps['chooser_columns'] |= temp_deps['chooser_columns']
+                deps['alt'] |= temp_deps['alt']
+                deps['skims'] |= temp_deps['skims']
+                deps['temps'] |= temp_deps['temps'] | {name}
+            elif isinstance(locals_d.get(name), (SkimDictWrapper, SkimStackWrapper)):
+                wrapper = locals_d[name]
+                deps['skims'] = True
+                for key in [wrapper.left_key, wrapper.right_key, getattr(wrapper, 'skim_key', None)]:
+                    if key is not None and not column_deps(key, deps):
+                        logger.debug("decompose_interaction_spec unknown skim key %s for %s" % (key, name))
+                        return None
+            elif isinstance(locals_d.get(name), (dict, list)):
+                # might be a container of skim wrappers
+                return None
+            elif name not in known_names:
+                logger.debug("decompose_interaction_spec unknown name %s in expression: %s" % (name, expr))
+                return None
+
+        if expr.startswith('_') and '@' in expr:
+            temps[expr[:expr.index('@')]] = deps
+
+        row_deps.append(deps)
+
+    # - assign each (non-temp) term to a term class
+    term_rows = {CHOOSER_TERMS: set(), ALTERNATIVE_TERMS: set(), INTERACTION_TERMS: set()}
+    profile_columns = set()
+    temp_rows = {expr[:expr.index('@')]: i for i, expr in enumerate(exprs) if expr.startswith('_') and '@' in expr}
+    for i, (expr, deps) in enumerate(zip(exprs, row_deps)):
+
+        if expr.startswith('_') and '@' in expr:
+            continue
+
+        if deps['skims'] or (deps['alt'] and deps['chooser_columns']):
+            term_class = INTERACTION_TERMS
+            profile_columns |= deps['chooser_columns']
+        elif deps['alt']:
+            term_class = ALTERNATIVE_TERMS
+        else:
+            term_class = CHOOSER_TERMS
+
+        term_rows[term_class].add(i)
+        term_rows[term_class] |= {temp_rows[t] for t in deps['temps']}
+
+    term_specs = {term_class: spec.iloc[sorted(rows)] for term_class, rows in term_rows.items()}
+    term_specs['profile_columns'] = [c for c in choosers.columns if c in profile_columns]
+
+    return term_specs
+
+
+def eval_decomposed_utilities(term_specs, choosers, alternatives, skims, locals_d, trace_label):
+    """
+    Compute the (choosers x alternatives) utility matrix from decomposed spec terms
+    (see decompose_interaction_spec) without building the full choosers x alternatives cross join.
 
-        # need to get from an integer offset into the alternative sample to the alternative index
-        # that is, we want the index value of the row that is offset by <position> rows into the
-        # tranche of this choosers alternatives created by cross join of alternatives and choosers
+    Returns
+    -------
+    utilities : pandas.DataFrame
+        one row per chooser and one column per alternative (same as reshaped interaction utilities)
+    """
 
-        # offsets is the offset into model_design df of first row of chooser alternatives
-        offsets = np.arange(len(positions)) * alternative_count
+    alt_columns = set(alternatives.columns)
 
-        # choices and choice_probs have one element per chooser and is in same order as choosers
-        choices_array[i] = np.take(alts, positions + offsets)
-        choice_probs_array[i] = np.take(alt_probs_array, positions + offsets)
+    utilities = np.zeros((len(choosers), len(alternatives)))
+    chunk.log_df(trace_label, 'utilities', utilities)
 
-    # explode to one row per chooser.index, alt_TAZ
-    choices_df = pd.DataFrame(
-        {alt_col_name: choices_array.flatten(order='F'),
-         'rand': rands.flatten(order='F'),
-         'prob': choice_probs_array.flatten(order='F'),
-         choosers.index.name: np.repeat(np.asanyarray(choosers.index), sample_size)
-         })
+    chooser_spec = term_specs[CHOOSER_TERMS]
+    if not chooser_spec.empty:
+        # use interaction_dataset names for chooser columns that collide with alternative columns
+        chooser_df = choosers.rename(columns={c: c + '_chooser' for c in choosers.columns if c in alt_columns})
+        chooser_utilities, _ = \
+            eval_interaction_utilities(chooser_spec, chooser_df, locals_d, trace_label, None)
+        utilities += chooser_utilities.utility.values.reshape(-1, 1)
+        del chooser_df, chooser_utilities
 
-    return choices_df
+    alt_spec = term_specs[ALTERNATIVE_TERMS]
+    if not alt_spec.empty:
+        alt_utilities, _ = \
+            eval_interaction_utilities(alt_spec, alternatives, locals_d, trace_label, None)
+        utilities += alt_utilities.utility.values.reshape(1, -1)
+        del alt_utilities
+
+    interaction_spec = term_specs[INTERACTION_TERMS]
+    if not interaction_spec.empty:
+
+        profile_columns = term_specs['profile_columns']
+
+        # distinct combinations of chooser columns used by interaction terms (in order of first appearance)
+        if profile_columns:
+            chooser_profiles = choosers[profile_columns]
+            profile_index = chooser_profiles.groupby(profile_columns, sort=False, dropna=False).ngroup().values
+            profiles = chooser_profiles[~chooser_profiles.duplicated()].reset_index(drop=True)
+        else:
+            profile_index = np.zeros(len(choosers), dtype=int)
+            profiles = pd.DataFrame(index=range(1))
+
+        logger.debug("%s evaluating interaction terms for %s profiles of %s choosers" %
+                     (trace_label, len(profiles), len(choosers)))
+
+        interaction_df = \
+            logit.interaction_dataset(profiles, alternatives, sample_size=len(alternatives))
+        chunk.log_df(trace_label, 'interaction_df', interaction_df)
+
+        if skims is not None:
+            set_skim_wrapper_targets(interaction_df, skims)
+
+        interaction_utilities, _ = \
+            eval_interaction_utilities(interaction_spec, interaction_df, locals_d, trace_label, None)
+
+        del interaction_df
+        chunk.log_df(trace_label, 'interaction_df', None)
+
+        utilities += interaction_utilities.utility.values.reshape(len(profiles), len(alternatives))[profile_index]
+        del interaction_utilities
+
+    return pd.DataFrame(utilities, index=choosers.index)
+
+
+def _interaction_sample_utilities(
+        choosers, alternatives, spec, skims, locals_d, have_trace_targets, trace_label):
+    """
+    Compute the (choosers x alternatives) utility matrix by evaluating spec
+    on the full cross join (cartesian product) of choosers and alternatives
+
+    Returns
+    -------
+    utilities : pandas.DataFrame
+        one row per chooser and one column per alternative
+    """
+
+    # - cross join choosers and alternatives (cartesian product)
+    # for every chooser, there will be a row for each alternative
+    # index values (non-unique) are from alternatives df
+    alternative_count = alternatives.shape[0]
+    interaction_df = \
+        logit.interaction_dataset(choosers, alternatives, sample_size=alternative_count)
+    chunk.log_df(trace_label, 'interaction_df', interaction_df)
+
+    assert alternative_count == len(interaction_df.index) / len(choosers.index)
+
+    if skims is not None:
+        set_skim_wrapper_targets(interaction_df, skims)
+
+    # evaluate expressions from the spec multiply by coefficients and sum
+    # spec is df with one row per spec expression and one col with utility coefficient
+    # column names of interaction_df match spec index values
+    # utilities has utility value for element in the cross product of choosers and alternatives
+    # interaction_utilities is a df with one utility column and one row per row in interaction_df
+    if have_trace_targets:
+        trace_rows, trace_ids \
+            = tracing.interaction_trace_rows(interaction_df, choosers, alternative_count)
+
+        tracing.trace_df(interaction_df[trace_rows],
+                         tracing.extend_trace_label(trace_label, 'interaction_df'),
+                         slicer='NONE', transpose=False)
+    else:
+        trace_rows = trace_ids = None
+
+    # interaction_utilities is a df with one utility column and one row per interaction_df row
+    interaction_utilities, trace_eval_results \
+        = eval_interaction_utilities(spec, interaction_df, locals_d, trace_label, trace_rows)
+    chunk.log_df(trace_label, 'interaction_utilities', interaction_utilities)
+
+    del interaction_df
+    chunk.log_df(trace_label, 'interaction_df', None)
+
+    if have_trace_targets:
+        tracing.trace_interaction_eval_results(trace_eval_results, trace_ids,
+                                               tracing.extend_trace_label(trace_label, 'eval'))
+
+        tracing.trace_df(interaction_utilities[trace_rows],
+                         tracing.extend_trace_label(trace_label, 'interaction_utilities'),
+                         slicer='NONE', transpose=False)
+
+    tracing.dump_df(DUMP, interaction_utilities, trace_label, 'interaction_utilities')
+
+    # reshape utilities (one utility column and one row per row in interaction_utilities)
+    # to a dataframe with one row per chooser and one column per alternative
+    utilities = pd.DataFrame(
+        interaction_utilities.values.reshape(len(choosers), alternative_count),
+        index=choosers.index)
+
+    del interaction_utilities
+    chunk.log_df(trace_label, 'interaction_utilities', None)
+
+    return utilities
 
 
 def _interaction_sample(
@@ -201,63 +449,22 @@ def _interaction_sample(
     if skims is not None:
         alternatives[alternatives.index.name] = alternatives.index
 
-    # - cross join choosers and alternatives (cartesian product)
-    # for every chooser, there will be a row for each alternative
-    # index values (non-unique) are from alternatives df
     alternative_count = alternatives.shape[0]
-    interaction_df = \
-        logit.interaction_dataset(choosers, alternatives, sample_size=alternative_count)
 
-    chunk.log_df(trace_label, 'interaction_df', interaction_df)
-
-    assert alternative_count == len(interaction_df.index) / len(choosers.index)
+    # - evaluate spec terms in their natural shape rather than on choosers x alternatives cross join
+    term_specs = None
+    if config.setting('decompose_interaction_sample', False) and not have_trace_targets:
+        term_specs = decompose_interaction_spec(spec, choosers, alternatives, locals_d)
+        if term_specs is None:
+            logger.info("%s spec can't be decomposed, using full interaction dataset" % (trace_label, ))
 
-    if skims is not None:
-        set_skim_wrapper_targets(interaction_df, skims)
-
-    # evaluate expressions from the spec multiply by coefficients and sum
-    # spec is df with one row per spec expression and one col with utility coefficient
-    # column names of interaction_df match spec index values
-    # utilities has utility value for element in the cross product of choosers and alternatives
-    # interaction_utilities is a df with one utility column and one row per row in interaction_df
-    if have_trace_targets:
-        trace_rows, trace_ids \
-            = tracing.interaction_trace_rows(interaction_df, choosers, alternative_count)
-
-        tracing.trace_df(interaction_df[trace_rows],
-                         tracing.extend_trace_label(trace_label, 'interaction_df'),
-                         slicer='NONE', transpose=False)
+    if term_specs is not None:
+        utilities = eval_decomposed_utilities(term_specs, choosers, alternatives, skims, locals_d, trace_label)
     else:
-        trace_rows = trace_ids = None
-
-    # interaction_utilities is a df with one utility column and one row per interaction_df row
-    interaction_utilities, trace_eval_results \
-        = eval_interaction_utilities(spec, interaction_df, locals_d, trace_label, trace_rows)
-    chunk.log_df(trace_label, 'interaction_utilities', interaction_utilities)
-
-    del interaction_df
-    chunk.log_df(trace_label, 'interaction_df', None)
-
-    if have_trace_targets:
-        tracing.trace_interaction_eval_results(trace_eval_results, trace_ids,
-                                               tracing.extend_trace_label(trace_label, 'eval'))
-
-        tracing.trace_df(interaction_utilities[trace_rows],
-                         tracing.extend_trace_label(trace_label, 'interaction_utilities'),
-                         slicer='NONE', transpose=False)
-
-    tracing.dump_df(DUMP, interaction_utilities, trace_label, 'interaction_utilities')
-
-    # reshape utilities (one utility column and one row per row in interaction_utilities)
-    # to a dataframe with one row per chooser and one column per alternative
-    utilities = pd.DataFrame(
-        interaction_utilities.values.reshape(len(choosers), alternative_count),
-        index=choosers.index)
+        utilities = _interaction_sample_utilities(
+            choosers, alternatives, spec, skims, locals_d, have_trace_targets, trace_label)
     chunk.log_df(trace_label, 'utilities', utilities)
 
-    del interaction_utilities
-    chunk.log_df(trace_label, 'interaction_utilities', None)
-
     if have_trace_targets:
         tracing.trace_df(utilities, tracing.extend_trace_label(trace_label, 'utilities'),
                          column_labels=['alternative', 'utility'])
@@ -453,7 +660,7 @@ def interaction_sample(
         calc_rows_per_chunk(chunk_size, choosers, alternatives, trace_label)
 
     result_list = []
-    for i, num_chunks, chooser_chunk in chunk.chunked_choosers(choosers, rows_per_chunk):
+    for i, num_chunks, chooser_chunk in chunk.chunked_choosers(choosers, rows_per_chunk, trace_label):
 
         logger.info("Running chunk %s of %s size %d" % (i, num_chunks, len(chooser_chunk)))
 
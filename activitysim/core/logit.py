@@ -69,6 +69,37 @@ def report_bad_choices(bad_row_map, df, trace_label, msg, trace_choosers=None, r
         raise RuntimeError(msg_with_count)
 
 
+def exp_utils_array(utils, exponentiated=False):
+    """
+    Return a new array of (exponentiated) utilities with values at or below EXP_UTIL_MIN set to zero.
+
+    All operations other than the exponentiation (or copy) are done in place,
+    so the values of `utils` are not modified.
+
+    Parameters
+    ----------
+    utils : pandas.DataFrame
+        Rows should be choosers and columns should be alternatives.
+
+    exponentiated : bool
+        True if utilities have already been exponentiated
+
+    Returns
+    -------
+    utils_arr : numpy.ndarray
+    """
+
+    if exponentiated:
+        utils_arr = utils.values.astype(np.float64)
+    else:
+        utils_arr = np.exp(utils.values)
+
+    # equivalent to clipping to [EXP_UTIL_MIN, EXP_UTIL_MAX] and then zeroing EXP_UTIL_MIN values
+    np.putmask(utils_arr, utils_arr <= EXP_UTIL_MIN, 0.0)
+
+    return utils_arr
+
+
 def utils_to_logsums(utils, exponentiated=False):
     """
     Convert a table of utilities to logsum series.
@@ -88,15 +119,7 @@ def utils_to_logsums(utils, exponentiated=False):
 
     """
 
-    # fixme - conversion to float not needed in either case?
-    # utils_arr = utils.values.astype('float')
-    utils_arr = utils.values
-    if not exponentiated:
-        utils_arr = np.exp(utils_arr)
-
-    np.clip(utils_arr, EXP_UTIL_MIN, EXP_UTIL_MAX, out=utils_arr)
-
-    utils_arr = np.where(utils_arr == EXP_UTIL_MIN, 0.0, utils_arr)
+    utils_arr = exp_utils_array(utils, exponentiated)
 
     logsums = np.log(utils_arr.sum(axis=1))
     logsums = pd.Series(logsums, index=utils.index)
@@ -138,16 +161,7 @@ def utils_to_probs(utils, trace_label=None, exponentiated=False, allow_zero_prob
     """
     trace_label = tracing.extend_trace_label(trace_label, 'utils_to_probs')
 
-    # fixme - conversion to float not needed in either case?
-    # utils_arr = utils.values.astype('float')
-    utils_arr = utils.values
-    if not exponentiated:
-        utils_arr = np.exp(utils_arr)
-
-    np.clip(utils_arr, EXP_UTIL_MIN, EXP_UTIL_MAX, out=utils_arr)
-
-    # FIXME
-    utils_arr = np.where(utils_arr == EXP_UTIL_MIN, 0.0, utils_arr)
+    utils_arr = exp_utils_array(utils, exponentiated)
 
     arr_sum = utils_arr.sum(axis=1)
 
@@ -172,15 +186,70 @@ def utils_to_probs(utils, trace_label=None, exponentiated=False, allow_zero_prob
         np.divide(utils_arr, arr_sum.reshape(len(utils_arr), 1), out=utils_arr)
 
     # if allow_zero_probs, this will cause EXP_UTIL_MIN util rows to have all zero probabilities
-    utils_arr[np.isnan(utils_arr)] = PROB_MIN
+    # (nan utilities also result in nan row sums, so rows with finite nonzero sums can be skipped)
+    if zero_probs.any() or np.isnan(arr_sum).any():
+        utils_arr[np.isnan(utils_arr)] = PROB_MIN
 
-    np.clip(utils_arr, PROB_MIN, PROB_MAX, out=utils_arr)
+    # no need to clip to [PROB_MIN, PROB_MAX] since 0 <= exp_util <= arr_sum for every element
 
     probs = pd.DataFrame(utils_arr, columns=utils.columns, index=utils.index)
 
     return probs
 
 
+def choose_from_probs(probs_arr, rands):
+    """
+    For each row, choose the position of the first alternative whose cumulative probability exceeds rand.
+
+    The cumulative probabilities are accumulated in a single scratch array and compared to rands
+    in place, so the only other allocation is a boolean mask. Rows in which no cumulative probability
+    exceeds rand (e.g. rand equals a rounded down probability total) choose the first alternative.
+
+    Parameters
+    ----------
+    probs_arr : 2-D numpy.ndarray
+        probabilities with rows for choosers and columns for alternatives
+    rands : numpy.ndarray
+        one random number per row, with shape (len(probs_arr), 1) or (len(probs_arr),)
+
+    Returns
+    -------
+    choices : 1-D numpy.ndarray of int
+        column positions of the chosen alternatives
+    """
+
+    cum_probs = np.cumsum(probs_arr, axis=1)
+    if cum_probs.dtype != np.float64:
+        cum_probs = cum_probs.astype(np.float64)
+    cum_probs -= np.asanyarray(rands).reshape(len(cum_probs), 1)
+
+    return np.argmax(cum_probs > 0.0, axis=1)
+
+
+def check_probs(probs, trace_label, trace_choosers=None):
+    """
+    report_bad_choices (and raise an error) if probs don't sum to 1 across each row
+
+    Parameters
+    ----------
+    probs : pandas.DataFrame
+        Rows for choosers and columns for the alternatives from which they are choosing.
+    trace_label : str
+    trace_choosers : pandas.dataframe
+        the choosers df (for interaction_simulate) to facilitate the reporting of hh_id
+    """
+
+    BAD_PROB_THRESHOLD = 0.001
+    bad_probs = np.abs(probs.values.sum(axis=1) - 1.0) > BAD_PROB_THRESHOLD
+
+    if bad_probs.any():
+
+        report_bad_choices(bad_probs, probs,
+                           trace_label=tracing.extend_trace_label(trace_label, 'bad_probs'),
+                           msg="probabilities do not add up to 1",
+                           trace_choosers=trace_choosers)
+
+
 def make_choices(probs, trace_label=None, trace_choosers=None):
     """
     Make choices for each chooser from among a set of alternatives.
@@ -209,27 +278,12 @@ def make_choices(probs, trace_label=None, trace_choosers=None):
     """
     trace_label = tracing.extend_trace_label(trace_label, 'make_choices')
 
-    # probs should sum to 1 across each row
-
-    BAD_PROB_THRESHOLD = 0.001
-    bad_probs = \
-        probs.sum(axis=1).sub(np.ones(len(probs.index))).abs() \
-        > BAD_PROB_THRESHOLD * np.ones(len(probs.index))
-
-    if bad_probs.any():
-
-        report_bad_choices(bad_probs, probs,
-                           trace_label=tracing.extend_trace_label(trace_label, 'bad_probs'),
-                           msg="probabilities do not add up to 1",
-                           trace_choosers=trace_choosers)
+    check_probs(probs, trace_label, trace_choosers)
+    probs_arr = probs.values
 
     rands = pipeline.get_rn_generator().random_for_df(probs)
 
-    probs_arr = probs.values.cumsum(axis=1) - rands
-
-    # rows, cols = np.where(probs_arr > 0)
-    # choices = [s.iat[0] for _, s in pd.Series(cols).groupby(rows)]
-    choices = np.argmax(probs_arr > 0.0, axis=1)
+    choices = choose_from_probs(probs_arr, rands)
 
     choices = pd.Series(choices, index=probs.index)
 
@@ -0,0 +1,268 @@
+# ActivitySim
+# See full license in LICENSE.txt.
+import hashlib
+import logging
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from activitysim.core import config
+
+logger = logging.getLogger(__name__)
+
+"""
+Cache of simple_simulate_logsums results.
+
+Logsum choosers (e.g. person x sampled destination alternatives) typically collapse to a much
+smaller number of distinct combinations of the chooser attributes the logsum spec actually reads,
+the origin and destination zones, and the skim time periods. Rather than evaluating the logsum spec
+for every chooser row, we evaluate it once per distinct key and broadcast the results back to the
+choosers.
+
+Keys are 64 bit hashes of the relevant chooser columns, qualified by a fingerprint of the spec,
+nest spec, locals (e.g. coefficients and constants), key column names and the keys by which skim
+wrappers look up skims, so that a single cache can be shared by all models. Results are retained
+across calls in a process-wide cache bounded to logsum_cache_size entries with least-recently-used
+eviction, and hit rates are tallied per model.
+
+The cache is enabled by setting logsum_cache_size to a positive number in settings.yaml.
+"""
+
+# process-wide cache of (spec fingerprint, row hash) => logsum
+_CACHE = OrderedDict()
+
+# model_name => {'rows': n, 'distinct': n, 'hits': n}
+_STATS = OrderedDict()
+
+
+def cache_size():
+    return config.setting('logsum_cache_size', 0) or 0
+
+
+def clear():
+    _CACHE.clear()
+    _STATS.clear()
+
+
+def skim_key_columns(skims):
+    """
+    names of the chooser columns used by skim wrappers to look up skim values
+
+    Parameters
+    ----------
+    skims : SkimDictWrapper or SkimStackWrapper object, or a list or dict of skims
+
+    Returns
+    -------
+    list of str
+    """
+
+    if skims is None:
+        return []
+    if isinstance(skims, dict):
+        skims = list(skims.values())
+    elif not isinstance(skims, list):
+        skims = [skims]
+
+    columns = []
+    for skim in skims:
+        for attr in ['left_key', 'right_key', 'skim_key']:
+            key = getattr(skim, attr, None)
+            if isinstance(key, str) and key not in columns:
+                columns.append(key)
+    return columns
+
+
+def spec_key_columns(choosers, spec, skims=None):
+    """
+    names of chooser columns whose values determine the logsum of a chooser row.
+
+    These are the chooser columns referenced by spec expressions and the skim lookup keys.
+
+    Returns None if the columns referenced by any spec expression can't be determined
+    (see simulate.expression_references) in which case results can't be cached.
+    """
+
+    # avoid circular import
+    from activitysim.core.simulate import expression_references
+
+    columns = []
+    for expr in spec.index:
+        references = expression_references(expr)
+        if references is None:
+            return None
+        expr_columns, _ = references
+        columns.extend(expr_columns)
+
+    columns.extend(skim_key_columns(skims))
+
+    # names in simple expressions that aren't chooser columns are locals or temps
+    return [c for c in choosers.columns if c in set(columns)]
+
+
+def skim_fingerprint(skim):
+    """
+    description of the role of a skim wrapper: its class and the chooser columns it looks up skims by
+    """
+
+    return "%s(%s)" % (type(skim).__name__,
+                       ', '.join('%s=%s' % (attr, getattr(skim, attr, None))
+                                 for attr in ['left_key', 'right_key', 'skim_key']))
+
+
+def value_fingerprint(value):
+    """
+    str fingerprint of a local (or skims) value
+
+    Scalars are represented by their repr, numpy and pandas data by a digest of their values,
+    skim wrappers by the keys they look up skims by, and containers by the fingerprints of their items.
+    Modules, classes and functions are represented by their (qualified) name and other objects by identity.
+    """
+
+    if value is None or isinstance(value, (int, float, str, bool, np.number)):
+        return repr(value)
+
+    if isinstance(value, (pd.Series, pd.DataFrame, pd.Index)):
+        h = hashlib.sha1(pd.util.hash_pandas_object(value, index=not isinstance(value, pd.Index)).values.tobytes())
+        if isinstance(value, pd.DataFrame):
+            h.update(repr(list(value.columns)).encode('utf8'))
+        return "%s:%s" % (type(value).__name__, h.hexdigest())
+
+    if isinstance(value, np.ndarray):
+        h = hashlib.sha1(np.ascontiguousarray(value).tobytes())
+        return "ndarray:%s:%s:%s" % (value.dtype, value.shape, h.hexdigest())
+
+    if hasattr(value, 'left_key'):
+        return skim_fingerprint(value)
+
+    if isinstance(value, dict):
+        return '{%s}' % ', '.join('%r: %s' % (k, value_fingerprint(v)) for k, v in sorted(value.items(), key=str))
+
+    if isinstance(value, (list, tuple)):
+        return '[%s]' % ', '.join(value_fingerprint(v) for v in value)
+
+    name = getattr(value, '__qualname__', None) or getattr(value, '__name__', None)
+    if name is not None:
+        # module, class or function
+        return "%s.%s" % (getattr(value, '__module__', None), name)
+
+    # other objects (e.g. skim_dict) by identity, so distinct objects are never confused
+    return "%s@%x" % (type(value).__name__, id(value))
+
+
+def spec_fingerprint(spec, nest_spec, locals_d, key_columns=None, skims=None):
+    """
+    fingerprint of everything other than chooser column values that the logsums depend on
+
+    This includes the names of the key columns (whose values are hashed per chooser) and the keys by
+    which each skim wrapper looks up skims (e.g. so odt_skims wrapping orig, dest and dest, orig are
+    not confused) as well as the spec, nest spec and (scalar and non-scalar) locals.
+    """
+
+    h = hashlib.sha1()
+    h.update(spec.to_csv().encode('utf8'))
+    h.update(repr(nest_spec).encode('utf8'))
+    h.update(repr(key_columns).encode('utf8'))
+    h.update(value_fingerprint(skims).encode('utf8'))
+    h.update(value_fingerprint(locals_d or {}).encode('utf8'))
+    return h.hexdigest()
+
+
+def model_name_for_trace_label(trace_label):
+    return trace_label.split('.')[0] if trace_label else 'unknown'
+
+
+def cached_logsums(choosers, spec, nest_spec, skims, locals_d, evaluate, trace_label):
+    """
+    evaluate logsums once per distinct key and broadcast results back to choosers
+
+    Parameters
+    ----------
+    choosers : pandas.DataFrame
+    spec : pandas.DataFrame
+        logsum spec (with coefficients)
+    nest_spec : dict or None
+    skims : SkimDictWrapper or SkimStackWrapper object, or a list or dict of skims
+    locals_d : dict
+    evaluate : function
+        evaluate(choosers) returns logsums series for choosers
+    trace_label : str
+
+    Returns
+    -------
+    logsums : pandas.Series
+        Index will be that of `choosers`
+    """
+
+    key_columns = spec_key_columns(choosers, spec, skims)
+
+    if key_columns is None:
+        logger.debug("%s logsum_cache can't determine spec columns, not caching" % trace_label)
+        return evaluate(choosers)
+
+    namespace = spec_fingerprint(spec, nest_spec, locals_d, key_columns, skims)
+
+    if key_columns:
+        row_hashes = pd.util.hash_pandas_object(choosers[key_columns], index=False).values
+    else:
+        # spec only references constants and locals, so all choosers have the same logsum
+        row_hashes = np.zeros(len(choosers), dtype=np.uint64)
+    unique_hashes, first_row, inverse = np.unique(row_hashes, return_index=True, return_inverse=True)
+
+    unique_logsums = np.empty(len(unique_hashes), dtype=np.float64)
+    missing = np.zeros(len(unique_hashes), dtype=bool)
+    for i, h in enumerate(unique_hashes):
+        key = (namespace, h)
+        logsum = _CACHE.get(key)
+        if logsum is None:
+            missing[i] = True
+        else:
+            _CACHE.move_to_end(key)
+            unique_logsums[i] = logsum
+
+    num_hits = len(unique_hashes) - missing.sum()
+
+    if missing.any():
+        miss_choosers = choosers.iloc[first_row[missing]]
+        logsums = np.asanyarray(evaluate(miss_choosers), dtype=np.float64)
+        unique_logsums[missing] = logsums
+
+        for h, logsum in zip(unique_hashes[missing], logsums):
+            _CACHE[(namespace, h)] = logsum
+
+    # evict least recently used
+    max_size = cache_size()
+    while len(_CACHE) > max_size:
+        _CACHE.popitem(last=False)
+
+    model_name = model_name_for_trace_label(trace_label)
+    model_stats = _STATS.setdefault(model_name, {'rows': 0, 'distinct': 0, 'hits': 0})
+    model_stats['rows'] += len(choosers)
+    model_stats['distinct'] += len(unique_hashes)
+    model_stats['hits'] += num_hits
+
+    logger.info("%s logsum_cache %s rows %s distinct %s hits" %
+                (trace_label, len(choosers), len(unique_hashes), num_hits))
+    logger.info("logsum_cache %s cumulative rows %s distinct %s hits %s (%0.1f%% evaluated)" %
+                (model_name, model_stats['rows'], model_stats['distinct'], model_stats['hits'],
+                 100.0 * (model_stats['distinct'] - model_stats['hits']) / max(model_stats['rows'], 1)))
+
+    return pd.Series(unique_logsums[inverse], index=choosers.index)
+
+
+def stats():
+    """
+    logsum cache hit rates by model
+
+    Returns
+    -------
+    pandas.DataFrame
+        indexed by model_name with columns rows, distinct, hits, hit_rate
+        where hit_rate is the fraction of chooser rows whose logsums were not evaluated
+    """
+
+    df = pd.DataFrame.from_dict(_STATS, orient='index', columns=['rows', 'distinct', 'hits'])
+    df.index.name = 'model_name'
+    df['hit_rate'] = 1 - (df.distinct - df.hits) / df.rows.clip(lower=1)
+    return df
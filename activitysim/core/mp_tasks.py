@@ -8,6 +8,7 @@ import multiprocessing
 import traceback
 
 from collections import OrderedDict
+from queue import Empty
 
 import yaml
 import numpy as np
@@ -200,8 +201,10 @@ incorporates a multiprocessing.Lock object to mediate access of the underlying d
 think that the existence of such a lock would make shared access pretty straightforward, but
 this is not the case as the level of locking is very low, reportedly not very performant, and
 essentially useless in any event since we want to use numpy.frombuffer to wrap and handle them
-as numpy arrays. The Lock is a convenient bundled locking primative, but shadow_pricing rolls
-its own semaphore system using the Lock.
+as numpy arrays. The Lock is a convenient bundled locking primative, which shadow_pricing uses
+together with a multiprocessing.Barrier (created for each step by run_sub_simulations, with one
+party per sub-process) to synchronize the sub-processes. If a sub-process fails, the barrier is
+aborted so that its peers fail promptly instead of waiting forever.
 
 FIXME - The code below knows that it need to allocate skim and shadow price buffers by calling
 the appropriate methods in abm.tables.skims and abm.tables.shadow_pricing to allocate shared
@@ -266,13 +269,14 @@ def exception(msg, write_to_log_file=True):
 """
 
 
-def pipeline_table_keys(pipeline_store):
+def pipeline_table_checkpoints(pipeline_store):
     """
     return dict of current (as of last checkpoint) pipeline tables
-    and their checkpoint-specific hdf5_keys
+    and the checkpoint at which each was last written
 
     This facilitates reading pipeline tables directly from a 'raw' open pandas.HDFStore without
-    opening it as a pipeline (e.g. when apportioning and coalescing pipelines)
+    opening it as a pipeline (e.g. when apportioning and coalescing pipelines) using
+    pipeline.read_df(table_name, table_checkpoint_name, store=pipeline_store)
 
     We currently only ever need to do this from the last checkpoint, so the ability to specify
     checkpoint_name is not required, and thus omitted.
@@ -284,7 +288,7 @@ def pipeline_table_keys(pipeline_store):
     Returns
     -------
     checkpoint_name : name of the checkpoint
-    checkpoint_tables : dict {<table_name>: <table_key>}
+    checkpoint_tables : dict {<table_name>: <table_checkpoint_name>}
 
     """
 
@@ -307,12 +311,107 @@ def pipeline_table_keys(pipeline_store):
     # omit dropped tables with empty checkpoint name
     checkpoint_tables = checkpoint_tables[checkpoint_tables != '']
 
-    # hdf5 key is <table_name>/<checkpoint_name>
-    checkpoint_tables = {table_name: pipeline.pipeline_table_key(table_name, checkpoint_name)
-                         for table_name, checkpoint_name in checkpoint_tables.items()}
+    # checkpoint name and dict mapping table name to checkpoint table was last written
+    return checkpoint_name, checkpoint_tables.to_dict()
 
-    # checkpoint name and series mapping table name to hdf5 key for tables in that checkpoint
-    return checkpoint_name, checkpoint_tables
+
+def use_column_store_transport():
+    """
+    Return True if pipeline tables should be handed off between the parent and sub-processes
+    of multiprocess steps through column stores (see pipeline.write_column_store) rather than
+    through sliced hdf5 pipeline files.
+
+    mp_pipeline_transport setting is either 'hdf5' (default) or 'npy'
+    """
+
+    transport = setting('mp_pipeline_transport', 'hdf5')
+    if transport not in ['hdf5', 'npy']:
+        raise RuntimeError("unrecognized mp_pipeline_transport setting '%s'" % transport)
+
+    return transport == 'npy'
+
+
+def step_sub_proc_names(step_info):
+    """
+    Names of the sub-process pipelines among which a step's households are apportioned
+
+    There is one per sub-process unless the step has a work_units setting, in which case
+    households are apportioned among work_units (more than num_processes) smaller pipelines,
+    which the step's sub-processes run one after the other, each taking the next as they become idle.
+
+    Parameters
+    ----------
+    step_info : dict
+        step_info from run_list
+
+    Returns
+    -------
+    sub_proc_names : list of str
+        e.g. ['mp_households_0', 'mp_households_1'] or just ['mp_initialize'] for unsliced step
+    """
+
+    step_name = step_info['name']
+    num_units = step_info.get('work_units', None) or step_info['num_processes']
+
+    if num_units == 1:
+        return [step_name]
+    return ["%s_%s" % (step_name, i) for i in range(num_units)]
+
+
+def load_pipeline_tables(process_name=None):
+    """
+    Load all current (as of last checkpoint) tables of a (sub_proc) pipeline
+
+    If using column store transport and the pipeline has a column store written at its last
+    checkpoint (holding the current version of every table), tables are read from the column store,
+    otherwise from the hdf5 pipeline file.
+
+    Parameters
+    ----------
+    process_name : str or None
+        name of sub_proc whose pipeline to load, or None for parent pipeline
+
+    Returns
+    -------
+    checkpoint_name : str
+        name of last checkpoint
+    tables : dict {<table_name>: <pandas.DataFrame>}
+    checkpoints_df : pandas.DataFrame
+        checkpoints table from pipeline
+    """
+
+    pipeline_file_name = inject.get_injectable('pipeline_file_name')
+    pipeline_path = config.build_output_file_path(pipeline_file_name, use_prefix=process_name)
+    column_store_path = config.build_output_file_path(pipeline.COLUMN_STORE_NAME, use_prefix=process_name)
+
+    tables = {}
+    with pd.HDFStore(pipeline_path, mode='r') as pipeline_store:
+
+        checkpoints_df = pipeline_store[pipeline.CHECKPOINT_TABLE_NAME]
+
+        # table_checkpoints is a dict mapping table_name to checkpoint table was last written
+        checkpoint_name, table_checkpoints = pipeline_table_checkpoints(pipeline_store)
+
+        # delta checkpoint column manifest (read once for all tables)
+        checkpoint_columns = pipeline.read_checkpoint_columns(pipeline_store)
+
+        column_store = use_column_store_transport() and \
+            pipeline.read_column_store_manifest(column_store_path, checkpoint_name) is not None
+
+        for table_name, table_checkpoint_name in table_checkpoints.items():
+
+            df = None
+            if column_store:
+                df = pipeline.read_column_store_table(column_store_path, table_name, checkpoint_name)
+
+            if df is None:
+                df = pipeline.read_df(table_name, table_checkpoint_name, store=pipeline_store,
+                                      checkpoint_columns=checkpoint_columns)
+
+            debug(f"loaded table {table_name} {table_checkpoint_name} {df.shape}")
+            tables[table_name] = df
+
+    return checkpoint_name, tables, checkpoints_df
 
 
 def build_slice_rules(slice_info, pipeline_tables):
@@ -457,6 +556,112 @@ def build_slice_rules(slice_info, pipeline_tables):
     return slice_rules
 
 
+def primary_slice_weights(slice_info, slice_rules, tables):
+    """
+    Estimate the relative processing cost of each row in the primary slicer table
+    based on the slice_info 'weight_by' list.
+
+    weight_by entries can name sliced (dependent) tables, in which case each primary row is
+    weighted by the number of rows in that table that (directly or indirectly) belong to it
+    (e.g. persons, tours, or trips per household), or numeric columns of the primary table
+    (e.g. a cost estimate recorded by a prior run).
+
+    weight_by tables that are not (yet) in the pipeline (e.g. trips, in a step before trips are created)
+    are skipped, so the same weight_by list can be used for all steps.
+
+    ::
+
+        slice:
+          tables:
+            - households
+            - persons
+          weight_by:
+            - persons
+            - tours
+
+    Parameters
+    ----------
+    slice_info : dict
+        'slice' info from run_list for this step
+    slice_rules : dict
+        slice_rules from build_slice_rules
+    tables : dict {<table_name>, <pandas.DataFrame>}
+
+    Returns
+    -------
+    weights : numpy.ndarray or None
+        one (positive) weight per row of primary table, or None if no weight_by in slice_info
+    """
+
+    weight_by = slice_info.get('weight_by', None)
+    if not weight_by:
+        return None
+
+    primary_slicer = slice_info['tables'][0]
+    primary_df = tables[primary_slicer]
+
+    # primary_ids maps table_name to array of primary slicer index values for each table row
+    primary_ids = {}
+    for table_name, rule in slice_rules.items():
+        if rule['slice_by'] == 'primary':
+            primary_ids[table_name] = pd.Series(primary_df.index.values, index=primary_df.index)
+        elif rule['slice_by'] == 'index':
+            source_ids = primary_ids[rule['source']]
+            primary_ids[table_name] = pd.Series(source_ids.reindex(tables[table_name].index).values,
+                                                index=tables[table_name].index)
+        elif rule['slice_by'] == 'column':
+            source_ids = primary_ids[rule['source']]
+            primary_ids[table_name] = pd.Series(source_ids.reindex(tables[table_name][rule['column']]).values,
+                                                index=tables[table_name].index)
+
+    # every primary row has a base cost of one
+    weights = np.ones(len(primary_df))
+    for name in weight_by:
+        if name in primary_ids and name != primary_slicer:
+            counts = primary_ids[name].value_counts()
+            weights += counts.reindex(primary_df.index).fillna(0).values
+        elif name in primary_df.columns:
+            weights += primary_df[name].fillna(0).clip(lower=0).values
+        elif name not in tables:
+            debug(f"primary_slice_weights skipping weight_by table {name} not in pipeline")
+        else:
+            raise RuntimeError("slice weight_by '%s' is neither a sliced table nor a column of %s" %
+                               (name, primary_slicer))
+
+    debug(f"primary_slice_weights {primary_slicer} weight_by {weight_by} total weight {weights.sum()}")
+
+    return weights
+
+
+def primary_slice_bins(weights, num_sub_procs):
+    """
+    Assign weighted primary slicer table rows to sub_procs
+
+    Rows are assigned in descending order of weight, snaking back and forth across the
+    sub_procs (0, 1, ... n-1, n-1, ... 1, 0, 0, 1, ...) so each gets a similar total weight
+    and a similar mix of light and heavy rows.
+
+    Parameters
+    ----------
+    weights : numpy.ndarray
+        one weight per primary table row
+    num_sub_procs : int
+
+    Returns
+    -------
+    bins : numpy.ndarray of int
+        sub_proc index for each primary table row
+    """
+
+    rank = np.empty(len(weights), dtype=np.int64)
+    rank[np.argsort(-weights, kind='stable')] = np.arange(len(weights))
+
+    stride, offset = np.divmod(rank, num_sub_procs)
+    bins = np.where(stride % 2 == 0, offset, num_sub_procs - 1 - offset)
+
+    return bins
+
+
 def apportion_pipeline(sub_proc_names, slice_info):
     """
     apportion pipeline for multiprocessing step
@@ -480,33 +685,15 @@ def apportion_pipeline(sub_proc_names, slice_info):
 
     pipeline_file_name = inject.get_injectable('pipeline_file_name')
 
-    # get last checkpoint from first job pipeline
-    pipeline_path = config.build_output_file_path(pipeline_file_name)
-
-    debug(f"apportion_pipeline pipeline_path: {pipeline_path}")
+    debug(f"apportion_pipeline pipeline_file_name: {pipeline_file_name}")
 
     # - load all tables from pipeline
-    tables = {}
-    with pd.HDFStore(pipeline_path, mode='r') as pipeline_store:
-
-        checkpoints_df = pipeline_store[pipeline.CHECKPOINT_TABLE_NAME]
+    checkpoint_name, tables, checkpoints_df = load_pipeline_tables()
 
-        # hdf5_keys is a dict mapping table_name to pipeline hdf5_key
-        checkpoint_name, hdf5_keys = pipeline_table_keys(pipeline_store)
-
-        # ensure presence of slicer tables in pipeline
-        for table_name in slice_info['tables']:
-            if table_name not in hdf5_keys:
-                raise RuntimeError("slicer table %s not found in pipeline" % table_name)
-
-        # load all tables from pipeline
-        for table_name, hdf5_key in hdf5_keys.items():
-            # new checkpoint for all tables the same
-            checkpoints_df[table_name] = checkpoint_name
-            # load the dataframe
-            tables[table_name] = pipeline_store[hdf5_key]
-
-            debug(f"loaded table {table_name} {tables[table_name].shape}")
+    # ensure presence of slicer tables in pipeline
+    for table_name in slice_info['tables']:
+        if table_name not in tables:
+            raise RuntimeError("slicer table %s not found in pipeline" % table_name)
 
     # keep only the last row of checkpoints and patch the last checkpoint name
     checkpoints_df = checkpoints_df.tail(1).copy()
@@ -515,8 +702,24 @@ def apportion_pipeline(sub_proc_names, slice_info):
     # - build slice rules for loaded tables
     slice_rules = build_slice_rules(slice_info, tables)
 
-    # - allocate sliced tables for each sub_proc
+    # - assign primary table rows to sub_procs
     num_sub_procs = len(sub_proc_names)
+    primary_df = tables[slice_info['tables'][0]]
+    weights = primary_slice_weights(slice_info, slice_rules, tables)
+    if weights is None:
+        # slice primary apportion table by num_sub_procs strides
+        # this hopefully yields a more random distribution
+        # (e.g.) households are ordered by size in input store
+        primary_bins = np.arange(len(primary_df)) % num_sub_procs
+    else:
+        # balance estimated cost of primary table rows across sub_procs
+        primary_bins = primary_slice_bins(weights, num_sub_procs)
+        for i in range(num_sub_procs):
+            debug(f"apportion_pipeline {sub_proc_names[i]} weight {weights[primary_bins == i].sum()}")
+
+    column_store_transport = use_column_store_transport()
+
+    # - allocate sliced tables for each sub_proc
     for i in range(num_sub_procs):
 
         # use well-known pipeline file name
@@ -540,11 +743,8 @@ def apportion_pipeline(sub_proc_names, slice_info):
                 df = tables[table_name]
 
                 if rule['slice_by'] == 'primary':
-                    # slice primary apportion table by num_sub_procs strides
-                    # this hopefully yields a more random distribution
-                    # (e.g.) households are ordered by size in input store
-                    primary_df = df[np.asanyarray(list(range(df.shape[0]))) % num_sub_procs == i]
-                    sliced_tables[table_name] = primary_df
+                    # slice primary apportion table by primary_bins
+                    sliced_tables[table_name] = df[primary_bins == i]
                 elif rule['slice_by'] == 'index':
                     # slice a table with same index name as a known slicer
                     source_df = sliced_tables[rule['source']]
@@ -561,13 +761,20 @@ def apportion_pipeline(sub_proc_names, slice_info):
                                        (rule['slice_by'], table_name))
 
                 # - write table to pipeline
-                hdf5_key = pipeline.pipeline_table_key(table_name, checkpoint_name)
-                pipeline_store[hdf5_key] = sliced_tables[table_name]
+                if not column_store_transport:
+                    hdf5_key = pipeline.pipeline_table_key(table_name, checkpoint_name)
+                    pipeline_store[hdf5_key] = sliced_tables[table_name]
 
             debug(f"writing checkpoints ({checkpoints_df.shape}) "
                   f"to {pipeline.CHECKPOINT_TABLE_NAME} in {pipeline_path}")
             pipeline_store[pipeline.CHECKPOINT_TABLE_NAME] = checkpoints_df
 
+        # - hand off tables in column store (which sub_proc pipeline reads in lieu of hdf5 tables)
+        if column_store_transport:
+            column_store_path = config.build_output_file_path(pipeline.COLUMN_STORE_NAME, use_prefix=process_name)
+            pipeline.remove_column_store(column_store_path)
+            pipeline.write_column_store(sliced_tables, checkpoint_name, column_store_path)
+
 
 def coalesce_pipelines(sub_proc_names, slice_info):
     """
@@ -594,38 +801,28 @@ def coalesce_pipelines(sub_proc_names, slice_info):
     debug(f"coalesce_pipelines to: {pipeline_file_name}")
 
     # - read all tables from first process pipeline
-    tables = {}
-    pipeline_path = config.build_output_file_path(pipeline_file_name, use_prefix=sub_proc_names[0])
-
-    with pd.HDFStore(pipeline_path, mode='r') as pipeline_store:
-
-        # hdf5_keys is a dict mapping table_name to pipeline hdf5_key
-        checkpoint_name, hdf5_keys = pipeline_table_keys(pipeline_store)
-
-        for table_name, hdf5_key in hdf5_keys.items():
-            debug(f"loading table {table_name} {hdf5_key}")
-            tables[table_name] = pipeline_store[hdf5_key]
+    checkpoint_name, tables, _ = load_pipeline_tables(sub_proc_names[0])
 
     # - use slice rules followed by apportion_pipeline to identify mirrored tables
     # (tables that are identical in every pipeline and so don't need to be concatenated)
     slice_rules = build_slice_rules(slice_info, tables)
     mirrored_table_names = [t for t, rule in slice_rules.items() if rule['slice_by'] is None]
     mirrored_tables = {t: tables[t] for t in mirrored_table_names}
-    omnibus_keys = {t: k for t, k in hdf5_keys.items() if t not in mirrored_table_names}
+    omnibus_table_names = [t for t in tables if t not in mirrored_table_names]
 
     debug(f"coalesce_pipelines to: {pipeline_file_name}")
     debug(f"mirrored_table_names: {mirrored_table_names}")
-    debug(f"omnibus_keys: {omnibus_keys}")
+    debug(f"omnibus_table_names: {omnibus_table_names}")
 
     # assemble lists of omnibus tables from all sub_processes
-    omnibus_tables = {table_name: [] for table_name in omnibus_keys}
-    for process_name in sub_proc_names:
-        pipeline_path = config.build_output_file_path(pipeline_file_name, use_prefix=process_name)
-        logger.info(f"coalesce pipeline {pipeline_path}")
+    omnibus_tables = {table_name: [tables[table_name]] for table_name in omnibus_table_names}
+    for process_name in sub_proc_names[1:]:
+        logger.info(f"coalesce pipeline {process_name}")
 
-        with pd.HDFStore(pipeline_path, mode='r') as pipeline_store:
-            for table_name, hdf5_key in omnibus_keys.items():
-                omnibus_tables[table_name].append(pipeline_store[hdf5_key])
+        _, sub_proc_tables, _ = load_pipeline_tables(process_name)
+        for table_name in omnibus_table_names:
+            omnibus_tables[table_name].append(sub_proc_tables[table_name])
+        del sub_proc_tables
 
     pipeline.open_pipeline()
 
@@ -643,6 +840,15 @@ def coalesce_pipelines(sub_proc_names, slice_info):
 
     pipeline.add_checkpoint(checkpoint_name)
 
+    # - hand off coalesced tables to apportion_pipeline of next step
+    # (replacing handoffs from prior steps, whose tables are all in the hdf5 pipeline)
+    if use_column_store_transport():
+        column_store_path = config.pipeline_file_path(pipeline.COLUMN_STORE_NAME)
+        pipeline.remove_column_store(column_store_path)
+        pipeline.write_column_store(
+            {table_name: pipeline.get_table(table_name) for table_name in pipeline.checkpointed_tables()},
+            checkpoint_name, column_store_path)
+
     pipeline.close_pipeline()
 
 
@@ -689,7 +895,7 @@ def setup_injectables_and_logging(injectables, locutor=True):
         raise e
 
 
-def run_simulation(queue, step_info, resume_after, shared_data_buffer):
+def run_simulation(queue, step_info, resume_after, shared_data_buffer, shadow_pricing_barrier=None):
     """
     run step models as subtask
 
@@ -706,6 +912,8 @@ def run_simulation(queue, step_info, resume_after, shared_data_buffer):
     resume_after : str or None
     shared_data_buffer : dict
         dict of shared data (e.g. skims and shadow_pricing)
+    shadow_pricing_barrier : multiprocessing.Barrier or None
+        barrier to synchronize shadow pricing across the step's sub-processes
     """
 
     models = step_info['models']
@@ -714,8 +922,10 @@ def run_simulation(queue, step_info, resume_after, shared_data_buffer):
     num_processes = step_info['num_processes']
 
     inject.add_injectable('data_buffers', shared_data_buffer)
+    inject.add_injectable('shadow_pricing_barrier', shadow_pricing_barrier)
     inject.add_injectable("chunk_size", chunk_size)
     inject.add_injectable("num_processes", num_processes)
+    inject.add_injectable("work_units", step_info.get('work_units', None))
 
     if resume_after:
         info(f"resume_after {resume_after}")
@@ -748,10 +958,19 @@ def run_simulation(queue, step_info, resume_after, shared_data_buffer):
             warning(f"{type(e).__name__} exception running {model} model: {str(e)}")
             raise e
 
-        queue.put({'model': model, 'time': time.time()-t1})
+        queue.put({'model': model, 'time': time.time()-t1, 'process_name': multiprocessing.current_process().name})
 
     tracing.print_elapsed_time("run (%s models)" % len(models), t0)
 
+    # - hand off tables to coalesce_pipelines
+    # (the column store written by apportion_pipeline is kept, since unchanged tables are only stored there)
+    if len(step_sub_proc_names(step_info)) > 1 and use_column_store_transport():
+        column_store_path = config.pipeline_file_path(pipeline.COLUMN_STORE_NAME)
+        if pipeline.read_column_store_manifest(column_store_path, pipeline.last_checkpoint()) is None:
+            pipeline.write_column_store(
+                {table_name: pipeline.get_table(table_name) for table_name in pipeline.checkpointed_tables()},
+                pipeline.last_checkpoint(), column_store_path)
+
     pipeline.close_pipeline()
 
 
@@ -760,7 +979,7 @@ def run_simulation(queue, step_info, resume_after, shared_data_buffer):
 """
 
 
-def mp_run_simulation(locutor, queue, injectables, step_info, resume_after, **kwargs):
+def mp_run_simulation(locutor, queue, injectables, step_info, resume_after, shadow_pricing_barrier, **kwargs):
     """
     mp entry point for run_simulation
 
@@ -771,6 +990,7 @@ def mp_run_simulation(locutor, queue, injectables, step_info, resume_after, **kw
     injectables
     step_info
     resume_after : bool
+    shadow_pricing_barrier : multiprocessing.Barrier
     kwargs : dict
         shared_data_buffers passed as kwargs to avoid picking dict
     """
@@ -787,13 +1007,13 @@ def mp_run_simulation(locutor, queue, injectables, step_info, resume_after, **kw
     try:
         mem.init_trace(setting('mem_tick'))
 
-        if step_info['num_processes'] > 1:
+        if len(step_sub_proc_names(step_info)) > 1:
             pipeline_prefix = multiprocessing.current_process().name
             logger.debug(f"injecting pipeline_file_prefix '{pipeline_prefix}'")
             inject.add_injectable("pipeline_file_prefix", pipeline_prefix)
 
         shared_data_buffer = kwargs
-        run_simulation(queue, step_info, resume_after, shared_data_buffer)
+        run_simulation(queue, step_info, resume_after, shared_data_buffer, shadow_pricing_barrier)
 
         chunk.log_write_hwm()
         mem.log_hwm()
@@ -849,7 +1069,9 @@ def mp_setup_skims(injectables, **kwargs):
         tags_to_load = setting('skim_time_periods')['labels']
 
         skim_info = skims.get_skim_info(omx_file_path, tags_to_load)
-        if TEST_SPAWN:
+        if skims.use_mmap_skim_cache():
+            info("mp_setup_skims mmap_skim_cache - nothing to load")
+        elif TEST_SPAWN:
             warning("mp_setup_skims TEST_SPAWN {TEST_SPAWN} skipping skims.load_skims")
         else:
             skims.load_skims(omx_file_path, skim_info, shared_data_buffer)
@@ -882,6 +1104,77 @@ def mp_coalesce_pipelines(injectables, sub_proc_names, slice_info):
         raise e
 
 
+# cached injectables that pool workers keep between tasks (skim_dict and skim_stack wrap the shared skim buffers)
+POOL_WORKER_WARM_INJECTABLES = ['skim_dict', 'skim_stack']
+
+
+def mp_pool_worker(task_queue, result_queue, injectables, shadow_pricing_barriers, **kwargs):
+    """
+    mp entry point for persistent worker pool sub process
+
+    Runs the tasks (mp entry points with args) it is sent on task_queue until it receives None.
+
+    Each task is run under its own process name (e.g. mp_households_0) so log and pipeline file names are
+    the same as if the task had been run in its own sub process. Tables and injectables are reset before each
+    task, but imported modules, cached config files and compiled expressions, and the skim_dict are kept warm.
+
+    Parameters
+    ----------
+    task_queue : multiprocessing.Queue
+        task dicts with process_name, entry_point, and args (not including injectables or shared data)
+    result_queue : multiprocessing.Queue
+        queue for model progress and task completed (or failed) messages to parent
+    injectables : dict
+        injectables from parent
+    shadow_pricing_barriers : dict {<num_parties>: multiprocessing.Barrier}
+        barriers can only be shared with sub processes when they are started, so workers are passed
+        a barrier for every possible number of sub processes in a step
+    kwargs : dict
+        shared_data_buffers passed as kwargs to avoid picking dict
+    """
+
+    worker_name = multiprocessing.current_process().name
+    shared_data_buffers = kwargs
+
+    # injectables as they are in a new sub process
+    injectables_snapshot = inject.get_injectables_snapshot()
+
+    while True:
+
+        task = task_queue.get()
+        if task is None:
+            break
+
+        process_name = task['process_name']
+        entry_point = task['entry_point']
+        args = task['args']
+
+        multiprocessing.current_process().name = process_name
+
+        try:
+            inject.restore_injectables_snapshot(injectables_snapshot, keep_cached=POOL_WORKER_WARM_INJECTABLES)
+            mem.HWM.clear()
+            chunk.HWM[:] = [{}]
+
+            if entry_point is mp_run_simulation:
+                locutor, step_info, resume_after, num_parties = args
+                mp_run_simulation(locutor, result_queue, injectables, step_info, resume_after,
+                                  shadow_pricing_barriers.get(num_parties), **shared_data_buffers)
+            elif entry_point is mp_setup_skims:
+                mp_setup_skims(injectables, **shared_data_buffers)
+            else:
+                entry_point(injectables, *args)
+
+        except Exception as e:
+            # exception was logged by entry point, worker terminates as a task sub process would have
+            result_queue.put({'process_name': process_name, 'failed': f"{type(e).__name__}: {str(e)}"})
+            sys.exit(1)
+
+        result_queue.put({'process_name': process_name, 'completed': True})
+
+        multiprocessing.current_process().name = worker_name
+
+
 """
 ### main (parent) process methods
 """
@@ -899,6 +1192,11 @@ def allocate_shared_skim_buffers():
 
     info("allocate_shared_skim_buffer")
 
+    if skims.use_mmap_skim_cache():
+        # sub-processes will map the skim cache files directly
+        info("allocate_shared_skim_buffer skipping allocation for mmap_skim_cache")
+        return {}
+
     omx_file_path = config.data_file_path(setting('skims_file'))
     tags_to_load = setting('skim_time_periods')['labels']
 
@@ -931,7 +1229,7 @@ def run_sub_simulations(
         injectables,
         shared_data_buffers,
         step_info, process_names,
-        resume_after, previously_completed, fail_fast):
+        resume_after, previously_completed, fail_fast, pool=None):
     """
     Launch sub processes to run models in step according to specification in step_info.
 
@@ -960,6 +1258,9 @@ def run_sub_simulations(
         names of processes that successfully completed in previous run
     fail_fast : bool
         whether to raise error if a sub process terminates with nonzero exitcode
+    pool : WorkerPool or None
+        if specified, run simulations as tasks of pool workers rather than in new sub processes
+        (required for steps with work_units, whose simulations are run num_processes at a time)
 
     Returns
     -------
@@ -993,6 +1294,8 @@ def run_sub_simulations(
                     warning(f"process {p.name} failed with exitcode {p.exitcode}")
                     failed.add(p.name)
                     mem.trace_memory_info("%s.failed" % p.name)
+                    # break barrier so surviving processes don't wait forever for failed process
+                    shadow_pricing_barrier.abort()
                     if fail_fast:
                         warning(f"fail_fast terminating remaining running processes")
                         for op in procs:
@@ -1049,6 +1352,57 @@ def run_sub_simulations(
     failed = set([])  # so we can log process failure first time it happens
     drop_breadcrumb(step_name, 'completed', list(completed))
 
+    if pool is not None:
+
+        if step_info.get('work_units', None):
+            # work units are not all run at once, so they can't synchronize shadow pricing
+            num_parties = None
+            shadow_pricing_barrier = None
+        else:
+            # pool workers were passed a barrier for each possible number of parties when they started
+            num_parties = max(num_simulations, 1)
+            shadow_pricing_barrier = pool.shadow_pricing_barriers[num_parties]
+
+        # idle workers take the next pending simulation (all at once, unless there are more work units)
+        pending = list(process_names)
+        while pending or pool.running:
+
+            idle_workers = pool.idle_workers()
+            while pending and idle_workers and len(pool.running) < step_info['num_processes']:
+                process_name = pending.pop(0)
+                spokesman = (process_name == process_names[0])
+                pool.submit(idle_workers.pop(0), process_name, mp_run_simulation,
+                            args=(spokesman, step_info, resume_after, num_parties))
+
+            if not pool.running:
+                warning(f"no live pool workers to run {len(pending)} remaining simulations of step {step_name}")
+                break
+
+            for process_name, ok in pool.poll():
+                if ok:
+                    info(f"process {process_name} completed")
+                    completed.add(process_name)
+                    drop_breadcrumb(step_name, 'completed', list(completed))
+                    mem.trace_memory_info("%s.completed" % process_name)
+                else:
+                    failed.add(process_name)
+                    mem.trace_memory_info("%s.failed" % process_name)
+                    # break barrier so surviving processes don't wait forever for failed process
+                    if shadow_pricing_barrier is not None:
+                        shadow_pricing_barrier.abort()
+                    if fail_fast:
+                        warning("fail_fast terminating pool workers")
+                        pool.terminate()
+                        raise RuntimeError("Process %s failed" % (process_name,))
+
+        t0 = tracing.print_elapsed_time('run_sub_simulations step %s' % step_name, t0)
+
+        return list(completed)
+
+    # barrier for sub-processes to synchronize shadow pricing (one party per sub-process we launch)
+    # (shadow pricing refuses to synchronize across fewer parties than num_processes when resuming)
+    shadow_pricing_barrier = multiprocessing.Barrier(max(num_simulations, 1))
+
     for i, process_name in enumerate(process_names):
         q = multiprocessing.Queue()
         spokesman = (i == 0)
@@ -1066,7 +1420,8 @@ def run_sub_simulations(
             debug(f"create_process {process_name} shared_data_buffers {k}={shared_data_buffers[k]}")
 
         p = multiprocessing.Process(target=mp_run_simulation, name=process_name,
-                                    args=(spokesman, q, injectables, step_info, resume_after,),
+                                    args=(spokesman, q, injectables, step_info, resume_after,
+                                          shadow_pricing_barrier,),
                                     kwargs=shared_data_buffers)
 
         procs.append(p)
@@ -1152,6 +1507,182 @@ def run_sub_task(p):
         raise RuntimeError("Process %s returned exitcode %s" % (p.name, p.exitcode))
 
 
+class WorkerPool(object):
+    """
+    Long-lived sub processes (see mp_pool_worker) that run the skim setup, apportion, simulate, and coalesce
+    tasks of all multiprocess steps, rather than starting a new sub process (which must re-import activitysim,
+    setup injectables and logging, and re-read settings, specs, and skim info) for each task.
+
+    Parameters
+    ----------
+    num_workers : int
+        number of workers (max num_processes of any multiprocess step)
+    injectables : dict
+        values to inject in workers
+    shared_data_buffers : dict
+        dict of shared_data for workers (e.g. skim and shadow pricing data)
+    """
+
+    def __init__(self, num_workers, injectables, shared_data_buffers):
+
+        self.result_queue = multiprocessing.Queue()
+
+        # one barrier for each possible number of sub processes in a step
+        self.shadow_pricing_barriers = {n: multiprocessing.Barrier(n) for n in range(1, num_workers + 1)}
+
+        # worker index => process_name of task it is running
+        self.running = {}
+
+        self.workers = []
+        self.task_queues = []
+        for i in range(num_workers):
+            task_queue = multiprocessing.Queue()
+            p = multiprocessing.Process(target=mp_pool_worker, name='mp_worker_%s' % i,
+                                        args=(task_queue, self.result_queue, injectables,
+                                              self.shadow_pricing_barriers),
+                                        kwargs=shared_data_buffers)
+            self.workers.append(p)
+            self.task_queues.append(task_queue)
+
+        for p in self.workers:
+            info(f"start pool worker {p.name}")
+            p.start()
+
+            # windows mmap of shared_data_buffers fails for simultaneous process starts (see run_sub_simulations)
+            if sys.platform == 'win32':
+                time.sleep(1)
+
+            mem.trace_memory_info("%s.start" % p.name)
+
+    def idle_workers(self):
+        """
+        list of indexes of live workers that are not running a task
+        """
+        return [i for i, p in enumerate(self.workers) if i not in self.running and p.exitcode is None]
+
+    def submit(self, worker_num, process_name, entry_point, args=()):
+        """
+        send task to (idle) worker
+
+        Parameters
+        ----------
+        worker_num : int
+        process_name : str
+            name under which the task will run (e.g. mp_households_0)
+        entry_point : function
+            mp entry point (mp_run_simulation, mp_setup_skims, mp_apportion_pipeline, or mp_coalesce_pipelines)
+        args : tuple
+            entry point args (not including injectables and shared data)
+        """
+
+        assert worker_num not in self.running
+
+        worker = self.workers[worker_num]
+        if worker.exitcode is not None:
+            raise RuntimeError("pool worker %s terminated with exitcode %s" % (worker.name, worker.exitcode))
+
+        info(f"pool worker {worker.name} running {process_name}")
+        mem.trace_memory_info("%s.start" % process_name)
+
+        self.running[worker_num] = process_name
+        self.task_queues[worker_num].put({'process_name': process_name, 'entry_point': entry_point, 'args': args})
+
+    def poll(self, seconds=1):
+        """
+        wait up to seconds for messages from workers (or until a task finishes), logging model progress messages
+
+        Returns
+        -------
+        finished : list of (process_name, completed) tuples
+            tasks that completed (completed True) or failed (completed False)
+        """
+
+        finished = []
+
+        def finish(worker_num, completed):
+            finished.append((self.running.pop(worker_num), completed))
+
+        deadline = time.time() + seconds
+        while True:
+            # stop waiting (but log any queued messages) once a task has finished
+            timeout = 0 if finished else max(deadline - time.time(), 0)
+            try:
+                msg = self.result_queue.get(timeout=timeout)
+            except Empty:
+                break
+
+            process_name = msg['process_name']
+            if 'model' in msg:
+                info(f"{process_name} {msg['model']} : {tracing.format_elapsed_time(msg['time'])}")
+                mem.trace_memory_info("%s.%s.completed" % (process_name, msg['model']))
+                continue
+
+            worker_num = [k for k, v in self.running.items() if v == process_name]
+            if worker_num:
+                if 'failed' in msg:
+                    warning(f"process {process_name} failed: {msg['failed']}")
+                finish(worker_num[0], 'completed' in msg)
+
+        # workers that terminated without reporting (e.g. killed by os)
+        for worker_num in list(self.running.keys()):
+            worker = self.workers[worker_num]
+            if worker.exitcode is not None:
+                warning(f"pool worker {worker.name} running {self.running[worker_num]} "
+                        f"terminated with exitcode {worker.exitcode}")
+                finish(worker_num, False)
+
+        mem.trace_memory_info()
+
+        return finished
+
+    def run_task(self, process_name, entry_point, args=()):
+        """
+        run task on first worker and return when it completes, or raise error if it fails (c.f. run_sub_task)
+        """
+
+        t0 = tracing.print_elapsed_time()
+
+        self.submit(0, process_name, entry_point, args)
+
+        finished = []
+        while not finished:
+            finished = self.poll()
+
+        t0 = tracing.print_elapsed_time('sub_process %s' % process_name, t0)
+
+        (process_name, completed), = finished
+        mem.trace_memory_info("%s.completed" % process_name)
+
+        if not completed:
+            error(f"Process {process_name} failed")
+            raise RuntimeError("Process %s failed" % (process_name,))
+
+    def terminate(self):
+        for p in self.workers:
+            if p.exitcode is None:
+                try:
+                    info(f"terminating pool worker {p.name}")
+                    p.terminate()
+                except Exception as e:
+                    info(f"error terminating pool worker {p.name}: {e}")
+
+    def close(self):
+        """
+        tell idle workers to exit and wait for them to terminate
+        """
+
+        for worker_num, p in enumerate(self.workers):
+            if p.exitcode is None:
+                if worker_num in self.running:
+                    p.terminate()
+                else:
+                    self.task_queues[worker_num].put(None)
+
+        for p in self.workers:
+            p.join()
+            info(f"pool worker {p.name} terminated with exitcode {p.exitcode}")
+
+
 def drop_breadcrumb(step_name, crumb, value=True):
     """
     Add (crumb: value) to specified step in breadcrumbs and flush breadcrumbs to file
@@ -1191,6 +1722,7 @@ def run_multiprocess(run_list, injectables):
     (parent process command line arguments are not available to sub-processes in Windows)
 
     * allocate shared data buffers for skims and shadow_pricing
+    * start pool of persistent workers to run sub process tasks (if persistent_worker_pool setting)
     * load shared skim data from OMX files
     * run each (single or multiprocess) step in turn
 
@@ -1240,61 +1772,81 @@ def run_multiprocess(run_list, injectables):
     t0 = tracing.print_elapsed_time('allocate shared shadow_pricing buffer', t0)
     mem.trace_memory_info("allocate_shared_shadow_pricing_buffers.completed")
 
-    # - mp_setup_skims
-    run_sub_task(
-        multiprocessing.Process(
-            target=mp_setup_skims, name='mp_setup_skims', args=(injectables,),
-            kwargs=shared_data_buffers)
-    )
-    t0 = tracing.print_elapsed_time('setup skims', t0)
-
-    # - for each step in run list
-    for step_info in run_list['multiprocess_steps']:
-
-        step_name = step_info['name']
-
-        num_processes = step_info['num_processes']
-        slice_info = step_info.get('slice', None)
-
-        if num_processes == 1:
-            sub_proc_names = [step_name]
+    def run_task(target, name, args=(), with_shared_data=False):
+        # run single sub process task in a pool worker or in a new sub process
+        if pool is not None:
+            pool.run_task(name, target, args)
         else:
-            sub_proc_names = ["%s_%s" % (step_name, i) for i in range(num_processes)]
-
-        # - mp_apportion_pipeline
-        if not skip_phase('apportion') and num_processes > 1:
             run_sub_task(
                 multiprocessing.Process(
-                    target=mp_apportion_pipeline, name='%s_apportion' % step_name,
-                    args=(injectables, sub_proc_names, slice_info))
+                    target=target, name=name, args=(injectables,) + args,
+                    kwargs=shared_data_buffers if with_shared_data else {})
             )
-        drop_breadcrumb(step_name, 'apportion')
-
-        # - run_sub_simulations
-        if not skip_phase('simulate'):
-            resume_after = step_info.get('resume_after', None)
 
-            previously_completed = find_breadcrumb('completed', default=[])
+    # - start persistent worker pool to run the tasks of all steps
+    pool = None
+    if setting('persistent_worker_pool', False):
+        num_workers = max([step_info['num_processes'] for step_info in run_list['multiprocess_steps']])
+        pool = WorkerPool(num_workers, injectables, shared_data_buffers)
+        t0 = tracing.print_elapsed_time('start %s pool workers' % num_workers, t0)
 
-            completed = run_sub_simulations(injectables,
-                                            shared_data_buffers,
-                                            step_info,
-                                            sub_proc_names,
-                                            resume_after, previously_completed, fail_fast)
-
-            if len(completed) != num_processes:
-                raise RuntimeError("%s processes failed in step %s" %
-                                   (num_processes - len(completed), step_name))
-        drop_breadcrumb(step_name, 'simulate')
-
-        # - mp_coalesce_pipelines
-        if not skip_phase('coalesce') and num_processes > 1:
-            run_sub_task(
-                multiprocessing.Process(
-                    target=mp_coalesce_pipelines, name='%s_coalesce' % step_name,
-                    args=(injectables, sub_proc_names, slice_info))
-            )
-        drop_breadcrumb(step_name, 'coalesce')
+    try:
+        # - mp_setup_skims
+        if skims.use_mmap_skim_cache():
+            info("run_multiprocess skipping mp_setup_skims for mmap_skim_cache")
+        else:
+            run_task(mp_setup_skims, 'mp_setup_skims', with_shared_data=True)
+            t0 = tracing.print_elapsed_time('setup skims', t0)
+
+        # - for each step in run list
+        for step_info in run_list['multiprocess_steps']:
+
+            step_name = step_info['name']
+
+            num_processes = step_info['num_processes']
+            slice_info = step_info.get('slice', None)
+
+            sub_proc_names = step_sub_proc_names(step_info)
+
+            # - mp_apportion_pipeline
+            if not skip_phase('apportion') and len(sub_proc_names) > 1:
+                run_task(mp_apportion_pipeline, '%s_apportion' % step_name, args=(sub_proc_names, slice_info))
+            drop_breadcrumb(step_name, 'apportion')
+
+            # - run_sub_simulations
+            if not skip_phase('simulate'):
+                resume_after = step_info.get('resume_after', None)
+
+                previously_completed = find_breadcrumb('completed', default=[])
+
+                # work units are run by a pool of num_processes workers (if not using persistent pool)
+                step_pool = pool
+                if step_info.get('work_units', None) and pool is None:
+                    step_pool = WorkerPool(num_processes, injectables, shared_data_buffers)
+
+                try:
+                    completed = run_sub_simulations(injectables,
+                                                    shared_data_buffers,
+                                                    step_info,
+                                                    sub_proc_names,
+                                                    resume_after, previously_completed, fail_fast,
+                                                    pool=step_pool)
+                finally:
+                    if step_pool is not pool:
+                        step_pool.close()
+
+                if len(completed) != len(sub_proc_names):
+                    raise RuntimeError("%s processes failed in step %s" %
+                                       (len(sub_proc_names) - len(completed), step_name))
+            drop_breadcrumb(step_name, 'simulate')
+
+            # - mp_coalesce_pipelines
+            if not skip_phase('coalesce') and len(sub_proc_names) > 1:
+                run_task(mp_coalesce_pipelines, '%s_coalesce' % step_name, args=(sub_proc_names, slice_info))
+            drop_breadcrumb(step_name, 'coalesce')
+    finally:
+        if pool is not None:
+            pool.close()
 
     mem.log_hwm()
 
@@ -1495,6 +2047,16 @@ def get_run_list():
 
             multiprocess_steps[istep]['num_processes'] = num_processes
 
+            # - validate work_units
+            work_units = step.get('work_units', None)
+            if work_units is not None:
+                if 'slice' not in step:
+                    raise RuntimeError("work_units but no slice info for step %s"
+                                       " in multiprocess_steps" % name)
+                if not isinstance(work_units, int) or work_units < num_processes:
+                    raise RuntimeError("bad value (%s) for work_units for step %s in multiprocess_steps"
+                                       " (should be at least num_processes %s)" % (work_units, name, num_processes))
+
             # - validate chunk_size and assign default
             chunk_size = step.get('chunk_size', None)
             if chunk_size is None:
@@ -1519,6 +2081,9 @@ def get_run_list():
                 if 'tables' not in slice:
                     raise RuntimeError("missing tables list for step %s"
                                        " in multiprocess_steps" % istep)
+                if not isinstance(slice.get('weight_by', []), list):
+                    raise RuntimeError("slice weight_by for step %s in multiprocess_steps"
+                                       " should be a list" % istep)
 
             start = step.get(start_tag, None)
             if not name:
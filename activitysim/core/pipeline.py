@@ -5,9 +5,13 @@ from builtins import map
 from builtins import object
 
 import os
+import shutil
 import logging
+import hashlib
 import datetime as dt
 
+import yaml
+import numpy as np
 import pandas as pd
 
 from . import orca
@@ -16,6 +20,7 @@ from . import config
 from . import random
 from . import tracing
 from . import mem
+from . import chunk
 
 from . import util
 from .tracing import print_elapsed_time
@@ -32,6 +37,18 @@ NON_TABLE_COLUMNS = [CHECKPOINT_NAME, TIMESTAMP]
 # name used for storing the checkpoints dataframe to the pipeline store
 CHECKPOINT_TABLE_NAME = 'checkpoints'
 
+# name used for storing the delta checkpoint column manifest dataframe to the pipeline store
+CHECKPOINT_COLUMNS_TABLE_NAME = 'checkpoint_columns'
+
+# name of the (optional) column store directory holding pipeline tables as memory-mappable column files
+COLUMN_STORE_NAME = 'pipeline_tables'
+
+# name of the column store manifest file
+COLUMN_STORE_MANIFEST = 'manifest.yaml'
+
+# column_name of the manifest entry recording the checkpoint whose stored frame supplies the table index
+DELTA_INDEX_COLUMN = ''
+
 # name of the first step/checkpoint created when teh pipeline is started
 INITIAL_CHECKPOINT_NAME = 'init'
 
@@ -56,6 +73,10 @@ class Pipeline(object):
 
         self.replaced_tables = {}
 
+        # delta checkpoint column manifests
+        # dict mapping (table_name, checkpoint_name) to list of (column_name, column_checkpoint, fingerprint)
+        self.checkpoint_columns = {}
+
         self._rng = random.Random()
 
         self.open_files = {}
@@ -122,6 +143,9 @@ def open_pipeline_store(overwrite=False):
             print(e)
             logger.warning("Error removing %s: %s" % (pipeline_file_path, e))
 
+        # remove any column store left by a previous run so it can't be mistaken for this one's
+        remove_column_store(config.pipeline_file_path(COLUMN_STORE_NAME))
+
     _PIPELINE.pipeline_store = pd.HDFStore(pipeline_file_path, mode='a')
 
     logger.debug("opened pipeline_store")
@@ -145,7 +169,7 @@ def get_rn_generator():
     return _PIPELINE.rng()
 
 
-def read_df(table_name, checkpoint_name=None):
+def read_df(table_name, checkpoint_name=None, store=None, checkpoint_columns=None):
     """
     Read a pandas dataframe from the pipeline store.
 
@@ -154,12 +178,24 @@ def read_df(table_name, checkpoint_name=None):
 
     The only exception is the checkpoints dataframe, which just has a table_name
 
+    If the table version was written as a delta checkpoint (see write_delta_df) it is reconstructed
+    by stitching together its columns from the checkpoints in which they were last written.
+
+    If the table is not in the (open) pipeline store but is in the pipeline's column store at the
+    requested checkpoint (see write_column_store) it is read from there.
+
     An error will be raised by HDFStore if the table is not found
 
     Parameters
     ----------
     table_name : str
     checkpoint_name : str
+    store : pandas.HDFStore or None
+        raw pipeline store to read from (e.g. when apportioning and coalescing pipelines)
+        if None, read from the open pipeline store
+    checkpoint_columns : dict or None
+        delta checkpoint column manifest of store (see read_checkpoint_columns), to avoid re-reading it
+        for every table read from the same raw store. if None, it is read from store
 
     Returns
     -------
@@ -168,12 +204,71 @@ def read_df(table_name, checkpoint_name=None):
 
     """
 
-    store = get_pipeline_store()
-    df = store[pipeline_table_key(table_name, checkpoint_name)]
+    if store is None:
+        store = get_pipeline_store()
+        checkpoint_columns = _PIPELINE.checkpoint_columns
+        column_store_path = config.pipeline_file_path(COLUMN_STORE_NAME)
+    else:
+        if checkpoint_columns is None:
+            checkpoint_columns = read_checkpoint_columns(store)
+        column_store_path = None
+
+    columns = checkpoint_columns.get((table_name, checkpoint_name)) if checkpoint_name else None
+
+    if columns is None:
+        key = pipeline_table_key(table_name, checkpoint_name)
+        if key not in store and column_store_path is not None:
+            # table may have been handed off in a column store (e.g. by mp_tasks.apportion_pipeline)
+            df = read_column_store_table(column_store_path, table_name, checkpoint_name)
+            if df is not None:
+                return df
+        return store[key]
+
+    # - stitch table together from columns stored in this and earlier checkpoints
+    stored_frames = {}
+    for column_checkpoint in set(column_checkpoint for _, column_checkpoint, _ in columns):
+        stored_frames[column_checkpoint] = store[pipeline_table_key(table_name, column_checkpoint)]
+
+    # first manifest entry is for index
+    index_column, index_checkpoint, _ = columns[0]
+    assert index_column == DELTA_INDEX_COLUMN
+
+    df = pd.DataFrame(
+        {column_name: stored_frames[column_checkpoint][column_name].values
+         for column_name, column_checkpoint, _ in columns[1:]},
+        index=stored_frames[index_checkpoint].index)
 
     return df
 
 
+def read_checkpoint_columns(store):
+    """
+    Read the delta checkpoint column manifest from a pipeline store
+
+    Parameters
+    ----------
+    store : pandas.HDFStore
+
+    Returns
+    -------
+    checkpoint_columns : dict
+        dict mapping (table_name, checkpoint_name) to list of (column_name, column_checkpoint, fingerprint)
+        empty if pipeline has no delta checkpoints
+    """
+
+    if ('/%s' % CHECKPOINT_COLUMNS_TABLE_NAME) not in store.keys():
+        return {}
+
+    manifest = store[CHECKPOINT_COLUMNS_TABLE_NAME]
+
+    checkpoint_columns = {}
+    for row in manifest.itertuples(index=False):
+        checkpoint_columns.setdefault((row.table_name, row.checkpoint_name), []).append(
+            (row.column_name, row.column_checkpoint, row.fingerprint))
+
+    return checkpoint_columns
+
+
 def write_df(df, table_name, checkpoint_name=None):
     """
     Write a pandas dataframe to the pipeline store.
@@ -203,6 +298,247 @@ def write_df(df, table_name, checkpoint_name=None):
     store.flush()
 
 
+def write_column_store(tables, checkpoint_name, dir_path):
+    """
+    Write tables to a column store directory as one .npy file per column (and index)
+
+    This is an alternative to the HDF5 pipeline store for handing off tables between processes
+    (e.g. when apportioning and coalescing multiprocess pipelines). Numeric columns are stored
+    as raw buffers that read_column_store_table can memory-map without PyTables serialization.
+
+    Each checkpoint's tables are written to their own subdirectory of dir_path, replacing any existing
+    column store for that checkpoint but not those of other checkpoints, so that the pipeline tables
+    (at any checkpoint) that were only written to the column store remain readable.
+
+    Parameters
+    ----------
+    tables : dict {<table_name>: <pandas.DataFrame>}
+    checkpoint_name : str
+        name of the checkpoint the tables belong to
+    dir_path : str
+        path of column store directory
+    """
+
+    dir_path = os.path.join(dir_path, checkpoint_name)
+
+    if os.path.exists(dir_path):
+        shutil.rmtree(dir_path)
+    os.makedirs(dir_path)
+
+    def save(file_name, values):
+        np.save(os.path.join(dir_path, file_name), values, allow_pickle=(values.dtype == object))
+
+    manifest = {'checkpoint_name': checkpoint_name, 'tables': {}}
+    for table_name, df in tables.items():
+
+        if isinstance(df.index, pd.MultiIndex):
+            raise RuntimeError("write_column_store: table '%s' has MultiIndex" % table_name)
+
+        os.makedirs(os.path.join(dir_path, table_name))
+
+        save(os.path.join(table_name, 'index.npy'), df.index.values)
+
+        columns = []
+        for i, column_name in enumerate(df.columns):
+            c = df[column_name]
+            file_name = os.path.join(table_name, '%s.npy' % i)
+            if isinstance(c.dtype, pd.CategoricalDtype):
+                storage = 'categorical'
+                save(file_name, c.cat.codes.values)
+                save(os.path.join(table_name, '%s.categories.npy' % i), c.cat.categories.values)
+            elif isinstance(c.dtype, np.dtype):
+                storage = 'object' if c.dtype == object else 'numpy'
+                save(file_name, c.values)
+            else:
+                # other extension dtypes are stored as objects and restored with pd.array
+                storage = 'object'
+                save(file_name, np.asarray(c, dtype=object))
+
+            columns.append({'name': str(column_name),
+                            'dtype': str(c.dtype),
+                            'storage': storage,
+                            'ordered': bool(getattr(c.dtype, 'ordered', False))})
+
+        manifest['tables'][table_name] = {
+            'index_name': df.index.name,
+            'index_dtype': str(df.index.dtype),
+            'columns': columns
+        }
+
+    with open(os.path.join(dir_path, COLUMN_STORE_MANIFEST), 'w') as f:
+        yaml.dump(manifest, f)
+
+    logger.debug("write_column_store %s tables at checkpoint '%s' to %s" %
+                 (len(tables), checkpoint_name, dir_path))
+
+
+def remove_column_store(dir_path):
+    """
+    Remove column store at dir_path (for all checkpoints), if there is one
+    """
+
+    if os.path.isdir(dir_path):
+        logger.debug("removing pipeline column store: %s" % dir_path)
+        shutil.rmtree(dir_path, ignore_errors=True)
+
+
+def read_column_store_manifest(dir_path, checkpoint_name):
+    """
+    Return the column store manifest dict or None if there is no column store for checkpoint_name at dir_path
+    """
+
+    manifest_path = os.path.join(dir_path, checkpoint_name, COLUMN_STORE_MANIFEST)
+    if not os.path.isfile(manifest_path):
+        return None
+
+    with open(manifest_path) as f:
+        return yaml.safe_load(f)
+
+
+def read_column_store_table(dir_path, table_name, checkpoint_name):
+    """
+    Read a table from a column store written by write_column_store
+
+    Numeric column files are memory-mapped (copy-on-write, so the table can be modified in place without
+    changing the files) and the dataframe is built on the memory-mapped arrays without copying them.
+
+    Parameters
+    ----------
+    dir_path : str
+        path of column store directory
+    table_name : str
+    checkpoint_name : str
+        checkpoint at which table was written
+
+    Returns
+    -------
+    df : pandas.DataFrame or None
+        None if column store does not exist or doesn't have table at checkpoint_name
+    """
+
+    if checkpoint_name is None:
+        return None
+
+    manifest = read_column_store_manifest(dir_path, checkpoint_name)
+
+    if manifest is None or table_name not in manifest['tables']:
+        return None
+
+    table_info = manifest['tables'][table_name]
+
+    def load(file_name, storage):
+        return np.load(os.path.join(dir_path, checkpoint_name, table_name, file_name),
+                       mmap_mode='c' if storage == 'numpy' else None,
+                       allow_pickle=(storage == 'object'))
+
+    index_storage = 'object' if table_info['index_dtype'] == 'object' else 'numpy'
+    index = pd.Index(load('index.npy', index_storage), name=table_info['index_name'])
+
+    data = {}
+    for i, column in enumerate(table_info['columns']):
+        if column['storage'] == 'categorical':
+            categories = load('%s.categories.npy' % i, 'object')
+            values = pd.Categorical.from_codes(load('%s.npy' % i, 'numpy'), categories, ordered=column['ordered'])
+        else:
+            values = load('%s.npy' % i, column['storage'])
+            if column['storage'] == 'object' and column['dtype'] != 'object':
+                values = pd.array(values, dtype=column['dtype'])
+        data[column['name']] = values
+
+    # copy=False so columns are not consolidated into (copied) blocks
+    df = pd.DataFrame(data, index=index, columns=[c['name'] for c in table_info['columns']], copy=False)
+
+    logger.debug("read_column_store_table %s %s from %s" % (table_name, df.shape, dir_path))
+
+    return df
+
+
+def fingerprint(values):
+    """
+    Return a str fingerprint of series or index values (and dtype) to detect changed columns
+    """
+
+    try:
+        hashes = pd.util.hash_pandas_object(values, index=False).values
+    except TypeError:
+        # e.g. object column with unhashable values
+        hashes = pd.util.hash_pandas_object(values.astype(str), index=False).values
+    return "%s:%s" % (values.dtype, hashlib.md5(hashes.tobytes()).hexdigest())
+
+
+def write_delta_df(df, table_name, checkpoint_name):
+    """
+    Write only the new or changed columns of a pandas dataframe to the pipeline store.
+
+    Columns that are unchanged since the table was last checkpointed are not rewritten, but are
+    recorded in the checkpoint column manifest as belonging to the earlier checkpoint in which
+    they were written, so read_df can reconstruct the table by stitching columns together.
+
+    If the table index has changed (or the table was not previously written as a delta)
+    the entire table is written.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        dataframe to store
+    table_name : str
+    checkpoint_name : str
+        the checkpoint at which the table was created/modified
+
+    Returns
+    -------
+    changed : bool
+        False if the table is identical to its last checkpointed version (and so nothing was written)
+    """
+
+    # coerce column names to str as unicode names will cause PyTables to pickle them
+    df.columns = df.columns.astype(str)
+
+    index_fingerprint = "%s:%s" % (df.index.name, fingerprint(df.index))
+    column_fingerprints = [(c, fingerprint(df[c])) for c in df.columns]
+
+    prior_columns = \
+        _PIPELINE.checkpoint_columns.get((table_name, _PIPELINE.last_checkpoint.get(table_name)))
+
+    if prior_columns is None or prior_columns[0][2] != index_fingerprint:
+        # new table, new index, or not previously written as delta
+        columns = [(DELTA_INDEX_COLUMN, checkpoint_name, index_fingerprint)] + \
+            [(c, checkpoint_name, f) for c, f in column_fingerprints]
+        changed_columns = list(df.columns)
+    else:
+        prior = {column_name: (column_checkpoint, f) for column_name, column_checkpoint, f in prior_columns[1:]}
+        changed_columns = [c for c, f in column_fingerprints if prior.get(c, (None, None))[1] != f]
+        columns = [prior_columns[0]] + \
+            [(c, checkpoint_name if c in changed_columns else prior[c][0], f) for c, f in column_fingerprints]
+
+        if columns == prior_columns:
+            return False
+
+    if changed_columns or columns[0][1] == checkpoint_name:
+        logger.debug("write_delta_df '%s' table '%s' writing %s of %s columns" %
+                     (checkpoint_name, table_name, len(changed_columns), len(df.columns)))
+        write_df(df[changed_columns], table_name, checkpoint_name)
+
+    _PIPELINE.checkpoint_columns[(table_name, checkpoint_name)] = columns
+
+    return True
+
+
+def write_checkpoint_columns():
+    """
+    Write the delta checkpoint column manifest to the pipeline store
+    """
+
+    manifest = pd.DataFrame(
+        [(table_name, checkpoint_name) + column
+         for (table_name, checkpoint_name), columns in _PIPELINE.checkpoint_columns.items()
+         for column in columns],
+        columns=['table_name', 'checkpoint_name', 'column_name', 'column_checkpoint', 'fingerprint'])
+
+    # write it to the store, overwriting any previous version (no way to simply extend)
+    write_df(manifest, CHECKPOINT_COLUMNS_TABLE_NAME)
+
+
 def rewrap(table_name, df=None):
     """
     Add or replace an orca registered table as a unitary DataFrame-backed DataFrameWrapper table
@@ -272,6 +608,8 @@ def add_checkpoint(checkpoint_name):
 
     logger.debug("add_checkpoint %s timestamp %s" % (checkpoint_name, timestamp))
 
+    delta_checkpoints = config.setting('delta_checkpoints', False)
+
     for table_name in orca_dataframe_tables():
 
         # if we have not already checkpointed it or it has changed
@@ -286,7 +624,13 @@ def add_checkpoint(checkpoint_name):
 
         logger.debug("add_checkpoint '%s' table '%s' %s" %
                      (checkpoint_name, table_name, util.df_size(df)))
-        write_df(df, table_name, checkpoint_name)
+
+        if delta_checkpoints:
+            if not write_delta_df(df, table_name, checkpoint_name):
+                logger.debug("add_checkpoint '%s' table '%s' unchanged" % (checkpoint_name, table_name))
+                continue
+        else:
+            write_df(df, table_name, checkpoint_name)
 
         # remember which checkpoint it was last written
         _PIPELINE.last_checkpoint[table_name] = checkpoint_name
@@ -310,6 +654,9 @@ def add_checkpoint(checkpoint_name):
     # write it to the store, overwriting any previous version (no way to simply extend)
     write_df(checkpoints, CHECKPOINT_TABLE_NAME)
 
+    if delta_checkpoints:
+        write_checkpoint_columns()
+
 
 def orca_dataframe_tables():
     """
@@ -343,6 +690,9 @@ def load_checkpoint(checkpoint_name):
 
     checkpoints = read_df(CHECKPOINT_TABLE_NAME)
 
+    # column manifest of any tables written as delta checkpoints
+    _PIPELINE.checkpoint_columns = read_checkpoint_columns(get_pipeline_store())
+
     if checkpoint_name == LAST_CHECKPOINT:
         checkpoint_name = checkpoints[CHECKPOINT_NAME].iloc[-1]
         logger.info("loading checkpoint '%s'" % checkpoint_name)
@@ -497,6 +847,7 @@ def open_pipeline(resume_after=None):
     _PIPELINE.is_open = True
 
     get_rn_generator().set_base_seed(inject.get_injectable('rng_base_seed', 0))
+    get_rn_generator().set_channel_type(inject.get_injectable('rng_channel_type', None))
 
     if resume_after:
         # open existing pipeline
@@ -590,6 +941,13 @@ def run(models, resume_after=None):
 
     t0 = print_elapsed_time("run_model (%s models)" % len(models), t0)
 
+    file_cache_stats = config.file_cache_stats()
+    logger.info("config file cache: %s files read, %s reads saved" %
+                (file_cache_stats['reads'], file_cache_stats['hits']))
+
+    if chunk.chunk_memory_budget():
+        chunk.write_chunk_cache()
+
     # don't close the pipeline, as the user may want to read intermediate results from the store
 
 
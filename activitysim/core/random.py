@@ -362,6 +362,237 @@ class SimpleChannel(object):
         return sample
 
 
+# Philox4x32 round multipliers and key schedule (Weyl sequence) constants (Salmon et al. 2011)
+_PHILOX_M0 = np.uint64(0xD2511F53)
+_PHILOX_M1 = np.uint64(0xCD9E8D57)
+_PHILOX_W0 = np.uint64(0x9E3779B9)
+_PHILOX_W1 = np.uint64(0xBB67AE85)
+_PHILOX_ROUNDS = 10
+_UINT32_MASK = np.uint64(_SEED_MASK)
+_SHIFT_32 = np.uint64(32)
+
+
+def philox4x32(counter, key, rounds=_PHILOX_ROUNDS):
+    """
+    Vectorized Philox4x32 counter-based bijection
+
+    Every element of the (broadcastable) counter words is encrypted independently, so we can
+    generate random numbers for an arbitrary collection of (row, offset) positions in a single
+    pass without any sequential generator state.
+
+    Parameters
+    ----------
+    counter : tuple of 4 array-like of uint32 values (held in uint64 arrays)
+    key : tuple of 2 int or uint32 values
+    rounds : int
+
+    Returns
+    -------
+    tuple of 4 ndarray of uint64 holding the uint32 output words
+    """
+
+    c0, c1, c2, c3 = [np.asanyarray(c, dtype=np.uint64) & _UINT32_MASK for c in counter]
+    k0, k1 = [np.uint64(int(k) & _SEED_MASK) for k in key]
+
+    for r in range(rounds):
+        if r > 0:
+            k0 = (k0 + _PHILOX_W0) & _UINT32_MASK
+            k1 = (k1 + _PHILOX_W1) & _UINT32_MASK
+        p0 = _PHILOX_M0 * c0
+        p1 = _PHILOX_M1 * c2
+        c0, c1, c2, c3 = \
+            ((p1 >> _SHIFT_32) ^ c1 ^ k0), (p1 & _UINT32_MASK), \
+            ((p0 >> _SHIFT_32) ^ c3 ^ k1), (p0 & _UINT32_MASK)
+
+    return c0, c1, c2, c3
+
+
+def _uniform_from_words(a, b):
+    """
+    Combine two uint32 words into a float64 in range [0, 1) with 53 bits of precision
+    (same construction as numpy's Mersenne Twister random_sample)
+    """
+    a = a >> np.uint64(5)
+    b = b >> np.uint64(6)
+    return (a * np.uint64(67108864) + b) * (1.0 / 9007199254740992.0)
+
+
+class PhiloxChannel(SimpleChannel):
+    """
+
+    Alternative to SimpleChannel built on the Philox4x32 counter-based generator.
+
+    Rather than reseeding a single RandomState for every row and fast-forwarding it by burning
+    offset rands, each random number is a pure function of its position in the stream:
+
+        key = (channel_seed, step_seed)
+        counter = (offset, row_id low word, row_id high word, base_seed)
+
+    so rands for every row in a df (and for n successive rands per row) can be generated in one
+    vectorized call. Since the stream position is determined solely by row id and offset,
+    results are identical regardless of how rows are sliced across multiprocess sub-processes.
+
+    Each rand (or normal, or choice draw) consumes one counter value, so the offset row state
+    has the same meaning as in SimpleChannel (number of counter values consumed this step.)
+    The actual rands are (intentionally) different from those produced by SimpleChannel.
+    """
+
+    def init_row_states_for_step(self, row_states):
+        """
+        initialize row states (in place) for new step
+
+        the row seed is implicit in the row id, so we only need to reset the offset
+
+        Parameters
+        ----------
+        row_states
+        """
+
+        assert self.step_name
+
+        if self.step_name and not row_states.empty:
+
+            # number of counter values consumed this step
+            row_states['offset'] = 0
+
+        return row_states
+
+    def _words_for_df(self, df, n):
+        """
+        Return the four Philox output words for the next n counter values of each row in df
+
+        Returns
+        -------
+        tuple of 4 ndarray of uint64 with shape (len(df), n)
+        """
+
+        # assert no dupes
+        assert len(df.index.unique()) == len(df.index)
+
+        offsets = self.row_states.loc[df.index, 'offset'].values.astype(np.uint64)
+
+        row_ids = np.asanyarray(df.index.values, dtype=np.int64).view(np.uint64)
+
+        counter = (offsets[:, np.newaxis] + np.arange(n, dtype=np.uint64),
+                   (row_ids & _UINT32_MASK)[:, np.newaxis],
+                   (row_ids >> _SHIFT_32)[:, np.newaxis],
+                   np.uint64(self.base_seed))
+
+        return philox4x32(counter, key=(self.channel_seed, self.step_seed))
+
+    def _uniforms_for_df(self, df, n):
+        """
+        Return (len(df), n) array of rands in range [0, 1) and advance offsets by n
+        """
+
+        w0, w1, _, _ = self._words_for_df(df, n)
+        self.row_states.loc[df.index, 'offset'] += n
+
+        return _uniform_from_words(w0, w1)
+
+    def random_for_df(self, df, step_name, n=1):
+        """
+        Return n floating point random numbers in range [0, 1) for each row in df
+        using the appropriate random channel for each row.
+
+        Parameters and return value as for SimpleChannel.random_for_df
+        """
+
+        assert self.step_name
+        assert self.step_name == step_name
+
+        return self._uniforms_for_df(df, n)
+
+    def normal_for_df(self, df, step_name, mu, sigma, lognormal=False):
+        """
+        Return a floating point random number in normal (or lognormal) distribution
+        for each row in df using the appropriate random channel for each row.
+
+        Normals are generated with the Box-Muller transform from the two independent
+        uniforms in a single Philox block, so each normal consumes a single counter value.
+
+        Parameters and return value as for SimpleChannel.normal_for_df
+        """
+
+        assert self.step_name
+        assert self.step_name == step_name
+
+        w0, w1, w2, w3 = self._words_for_df(df, 1)
+        self.row_states.loc[df.index, 'offset'] += 1
+
+        u1 = _uniform_from_words(w0, w1).ravel()
+        u2 = _uniform_from_words(w2, w3).ravel()
+
+        # 1 - u1 is in range (0, 1] so log is always defined
+        rands = np.sqrt(-2.0 * np.log(1.0 - u1)) * np.cos(2.0 * np.pi * u2)
+
+        if isinstance(mu, pd.Series):
+            mu = mu.values
+        if isinstance(sigma, pd.Series):
+            sigma = sigma.values
+
+        rands = rands * sigma + mu
+
+        if lognormal:
+            rands = np.exp(rands)
+
+        return rands
+
+    def choice_for_df(self, df, step_name, a, size, replace):
+        """
+        Apply numpy.random.choice once for each row in df
+        using the appropriate random channel for each row.
+
+        Sampling with replacement consumes size counter values per row.
+        Sampling without replacement ranks one rand per element of a, and so consumes len(a)
+        counter values per row, taking the size elements with the smallest rands.
+
+        Parameters and return value as for SimpleChannel.choice_for_df
+        """
+
+        assert self.step_name
+        assert self.step_name == step_name
+
+        if np.isscalar(a):
+            a = np.arange(a)
+        a = np.asanyarray(a)
+        num_elements = len(a)
+
+        if replace:
+            w0, w1, _, _ = self._words_for_df(df, size)
+            rands_consumed = size
+            positions = (_uniform_from_words(w0, w1) * num_elements).astype(np.int64)
+        else:
+            if size > num_elements:
+                raise ValueError("Cannot take a larger sample than population when 'replace=False'")
+            w0, w1, _, _ = self._words_for_df(df, num_elements)
+            rands_consumed = num_elements
+            rands = _uniform_from_words(w0, w1)
+            if size < num_elements:
+                positions = np.argpartition(rands, size - 1, axis=1)[:, :size]
+                order = np.argsort(np.take_along_axis(rands, positions, axis=1), axis=1)
+                positions = np.take_along_axis(positions, order, axis=1)
+            else:
+                positions = np.argsort(rands, axis=1)
+
+        sample = a[positions.ravel()]
+
+        if not self.multi_choice_offset:
+            # update offset for rows we handled
+            self.row_states.loc[df.index, 'offset'] += rands_consumed
+
+        return sample
+
+
+# channel implementations selectable with the rng_channel_type setting
+CHANNEL_TYPES = {
+    'simple': SimpleChannel,
+    'philox': PhiloxChannel,
+}
+
+DEFAULT_CHANNEL_TYPE = 'simple'
+
+
 class Random(object):
 
     def __init__(self):
@@ -375,6 +606,7 @@ class Random(object):
         self.step_seed = None
         self.base_seed = 0
         self.global_rng = np.random.RandomState()
+        self.channel_type = DEFAULT_CHANNEL_TYPE
 
     def get_channel_for_df(self, df):
         """
@@ -471,7 +703,8 @@ class Random(object):
         else:
             logger.debug("Adding channel '%s' %s ids" % (channel_name, len(domain_df.index)))
 
-            channel = SimpleChannel(channel_name,
+            channel_class = CHANNEL_TYPES[self.channel_type]
+            channel = channel_class(channel_name,
                                     self.base_seed,
                                     domain_df,
                                     self.step_name
@@ -527,6 +760,37 @@ class Random(object):
             logger.info("Set random seed base to %s" % seed)
             self.base_seed = seed
 
+    def set_channel_type(self, channel_type=None):
+        """
+        Select the channel implementation used to generate random streams for channel domains.
+
+        'simple' (the default) reseeds a numpy RandomState row by row (see SimpleChannel)
+        'philox' uses the vectorized counter-based Philox generator (see PhiloxChannel)
+
+        The two channel types produce different (but equally repeatable) random streams.
+
+        Must be called before first step (before any channels are added or rands are consumed)
+
+        Parameters
+        ----------
+        channel_type : str or None
+            one of the keys of CHANNEL_TYPES (None means DEFAULT_CHANNEL_TYPE)
+        """
+
+        channel_type = channel_type or DEFAULT_CHANNEL_TYPE
+
+        if channel_type not in CHANNEL_TYPES:
+            raise RuntimeError("Unknown rng_channel_type '%s' (expected one of %s)" %
+                               (channel_type, list(CHANNEL_TYPES.keys())))
+
+        if self.step_name is not None or self.channels:
+            raise RuntimeError("Can only call set_channel_type before the first step.")
+
+        if channel_type != self.channel_type:
+            logger.info("Set random channel type to %s" % channel_type)
+
+        self.channel_type = channel_type
+
     def get_global_rng(self):
         """
         Return a numpy random number generator for use within current step.
@@ -4,6 +4,7 @@
 from builtins import range
 
 import os
+import ast
 import logging
 from collections import OrderedDict
 
@@ -18,6 +19,8 @@ from . import config
 from . import util
 from . import assign
 from . import chunk
+from . import logsum_cache
+from . import expression_compiler
 
 logger = logging.getLogger(__name__)
 
@@ -105,6 +108,11 @@ def read_model_spec(file_name, spec_dir=None):
     else:
         file_path = config.config_file_path(file_name)
 
+    return config.cached_file_read(file_path, _read_model_spec)
+
+
+def _read_model_spec(file_path):
+
     spec = pd.read_csv(file_path, comment='#')
 
     spec = spec.dropna(subset=[SPEC_EXPRESSION_NAME])
@@ -140,11 +148,16 @@ def read_model_coefficients(model_settings=None, file_name=None):
         file_name = model_settings['COEFFICIENTS']
 
     file_path = config.config_file_path(file_name)
-    coefficients = pd.read_csv(file_path, comment='#', index_col='coefficient_name')
+    coefficients = config.cached_file_read(file_path, _read_model_coefficients)
 
     return coefficients
 
 
+def _read_model_coefficients(file_path):
+
+    return pd.read_csv(file_path, comment='#', index_col='coefficient_name')
+
+
 def spec_for_segment(model_settings, spec_id, segment_name, estimator):
     """
     Select spec for specified segment from omnibus spec containing columns for each segment
@@ -188,7 +201,7 @@ def read_model_coefficient_template(model_settings):
     coeffs_file_name = model_settings['COEFFICIENT_TEMPLATE']
 
     file_path = config.config_file_path(coeffs_file_name)
-    template = pd.read_csv(file_path, comment='#', index_col='coefficient_name')
+    template = config.cached_file_read(file_path, _read_model_coefficients)
 
     # by convention, an empty cell in the template indicates that
     # the coefficient name should be propogated to across all segments
@@ -315,6 +328,9 @@ def eval_utilities(spec, choosers, locals_d=None, trace_label=None,
     Returns
     -------
 
+    Expressions are compiled once per process (see expression_compiler). Unless tracing or
+    estimating (which need the expression_values), coefficient-weighted expression values are
+    accumulated into the utilities as each expression is evaluated.
     """
 
     # fixme - restore tracing and _check_for_variability
@@ -352,17 +368,47 @@ def eval_utilities(spec, choosers, locals_d=None, trace_label=None,
     else:
         exprs = spec.index
 
-    expression_values = np.empty((spec.shape[0], choosers.shape[0]))
-    for i, expr in enumerate(exprs):
+    def eval_expression(expr):
         try:
             if expr.startswith('@'):
-                expression_values[i] = eval(expr[1:], globals_dict, locals_dict)
+                return eval(expression_compiler.compile_python_expression(expr[1:]), globals_dict, locals_dict)
             else:
-                expression_values[i] = choosers.eval(expr)
+                return expression_compiler.eval_simple_expression(expr, choosers)
         except Exception as err:
             logger.exception("Variable evaluation failed for: %s" % str(expr))
             raise err
 
+    if not (estimator or have_trace_targets):
+
+        # - fused evaluation: accumulate coefficient-weighted expression values into utilities
+        # as we go, rather than materializing the (num_exprs x num_choosers) expression_values array
+        # (utilities are stored column-major so that the per-alternative accumulation is contiguous)
+        coefficients = spec.astype(np.float64).values
+        utilities = np.zeros((choosers.shape[0], spec.shape[1]), order='F')
+        for i, expr in enumerate(exprs):
+            values = eval_expression(expr)
+            if isinstance(values, pd.Series):
+                values = values.values
+            values = np.asarray(values, dtype=np.float64)
+            # alternatives with zero coefficients can be skipped unless values are nan or inf
+            # (whose product with zero is nan, as in the expression_values dot product below)
+            if np.isfinite(values).all():
+                alternatives = np.flatnonzero(coefficients[i])
+            else:
+                alternatives = range(spec.shape[1])
+            for j in alternatives:
+                utilities[:, j] += coefficients[i, j] * values
+
+        utilities = pd.DataFrame(data=utilities, index=choosers.index, columns=spec.columns)
+
+        t0 = tracing.print_elapsed_time(" eval_utilities", t0)
+
+        return utilities
+
+    expression_values = np.empty((spec.shape[0], choosers.shape[0]))
+    for i, expr in enumerate(exprs):
+        expression_values[i] = eval_expression(expr)
+
     if estimator:
         df = pd.DataFrame(
             data=expression_values.transpose(),
@@ -482,9 +528,10 @@ def eval_variables(exprs, df, locals_d=None):
     for expr in exprs:
         try:
             if expr.startswith('@'):
-                expr_values = to_array(eval(expr[1:], globals_dict, locals_dict))
+                expr_values = \
+                    to_array(eval(expression_compiler.compile_python_expression(expr[1:]), globals_dict, locals_dict))
             else:
-                expr_values = to_array(df.eval(expr))
+                expr_values = to_array(expression_compiler.eval_simple_expression(expr, df))
             # read model spec should ensure uniqueness, otherwise we should uniquify
             assert expr not in values
             values[expr] = expr_values
@@ -498,6 +545,85 @@ def eval_variables(exprs, df, locals_d=None):
     return values
 
 
+# DataFrame attributes that are not column references when accessed as df.<attr> in an expression
+DF_NON_COLUMN_ATTRIBUTES = set(dir(pd.DataFrame))
+
+
+def expression_references(expr):
+    """
+    Determine which df columns and which other names a spec expression refers to.
+
+    Handles the three kinds of spec expressions:
+      simple expressions (evaluated with DataFrame.eval) - bare names are df columns
+      python expressions ('@' prefix) - df columns referenced as df['col'], df["col"], or df.col
+      temps ('_TARGET@' prefix) - as for python expressions
+
+    Returns None if the references can't be determined statically - e.g. if the expression
+    can't be parsed, or if df is referenced other than to access a column (e.g. len(df) or df.index)
+
+    Parameters
+    ----------
+    expr : str
+        spec expression
+
+    Returns
+    -------
+    columns : set of str
+        names of df columns referenced by expression
+    names : set of str
+        other (free) names referenced by expression (e.g. skims, temps, constants, modules)
+    """
+
+    if expr.startswith('_') and '@' in expr:
+        code, is_simple = expr[expr.index('@') + 1:], False
+    elif expr.startswith('@'):
+        code, is_simple = expr[1:], False
+    else:
+        code, is_simple = expr, True
+
+    try:
+        tree = ast.parse(code.strip(), mode='eval')
+    except SyntaxError:
+        return None
+
+    columns = set()
+    names = set()
+    df_column_nodes = set()
+
+    for node in ast.walk(tree):
+
+        if is_simple:
+            continue
+
+        if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and node.value.id == 'df':
+            key = node.slice
+            if not isinstance(key, ast.Constant) and isinstance(getattr(key, 'value', None), ast.AST):
+                # python < 3.9 wraps subscript in ast.Index
+                key = key.value
+            if not (isinstance(key, ast.Constant) and isinstance(key.value, str)):
+                return None
+            columns.add(key.value)
+            df_column_nodes.add(node.value)
+
+        elif isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == 'df':
+            if node.attr in DF_NON_COLUMN_ATTRIBUTES:
+                return None
+            columns.add(node.attr)
+            df_column_nodes.add(node.value)
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node not in df_column_nodes:
+            if is_simple:
+                columns.add(node.id)
+            elif node.id == 'df':
+                # df used other than to access a column
+                return None
+            else:
+                names.add(node.id)
+
+    return columns, names
+
+
 def compute_utilities(expression_values, spec):
 
     # matrix product of spec expression_values with utility coefficients of alternatives
@@ -615,16 +741,20 @@ def compute_nested_exp_utilities(raw_utilities, nest_spec):
     nested_utilities : pandas.DataFrame
         Will have the index of `raw_utilities` and columns for exponentiated leaf and node utilities
     """
-    nested_utilities = pd.DataFrame(index=raw_utilities.index)
+    nests = list(logit.each_nest(nest_spec, post_order=True))
+    names = [nest.name for nest in nests]
+    positions = {name: i for i, name in enumerate(names)}
 
-    for nest in logit.each_nest(nest_spec, post_order=True):
+    # column-major so each leaf and node utility is a contiguous column we can update in place
+    nested_utilities = np.empty((len(raw_utilities.index), len(nests)), dtype=np.float64, order='F')
 
-        name = nest.name
+    for i, nest in enumerate(nests):
+
+        utility = nested_utilities[:, i]
 
         if nest.is_leaf:
             # leaf_utility = raw_utility / nest.product_of_coefficients
-            nested_utilities[name] = \
-                raw_utilities[name].astype(float) / nest.product_of_coefficients
+            np.divide(raw_utilities[nest.name].values, nest.product_of_coefficients, out=utility)
 
         else:
             # nest node
@@ -632,14 +762,16 @@ def compute_nested_exp_utilities(raw_utilities, nest_spec):
             # this will RuntimeWarning: divide by zero encountered in log
             # if all nest alternative utilities are zero
             # but the resulting inf will become 0 when exp is applied below
+            alternatives = [positions[name] for name in nest.alternatives]
+            np.nansum(nested_utilities[:, alternatives], axis=1, out=utility)
             with np.errstate(divide='ignore'):
-                nested_utilities[name] = \
-                    nest.coefficient * np.log(nested_utilities[nest.alternatives].sum(axis=1))
+                np.log(utility, out=utility)
+            utility *= nest.coefficient
 
         # exponentiate the utility
-        nested_utilities[name] = np.exp(nested_utilities[name])
+        np.exp(utility, out=utility)
 
-    return nested_utilities
+    return pd.DataFrame(nested_utilities, index=raw_utilities.index, columns=names)
 
 
 def compute_nested_probabilities(nested_exp_utilities, nest_spec, trace_label):
@@ -662,18 +794,16 @@ def compute_nested_probabilities(nested_exp_utilities, nest_spec, trace_label):
         Will have the index of `nested_exp_utilities` and columns for leaf and node probabilities
     """
 
-    nested_probabilities = pd.DataFrame(index=nested_exp_utilities.index)
-
-    for nest in logit.each_nest(nest_spec, type='node', post_order=False):
+    nested_probabilities = [
+        logit.utils_to_probs(nested_exp_utilities[nest.alternatives],
+                             trace_label=trace_label,
+                             exponentiated=True,
+                             allow_zero_probs=True)
+        for nest in logit.each_nest(nest_spec, type='node', post_order=False)
+    ]
 
-        probs = logit.utils_to_probs(nested_exp_utilities[nest.alternatives],
-                                     trace_label=trace_label,
-                                     exponentiated=True,
-                                     allow_zero_probs=True)
-
-        nested_probabilities = pd.concat([nested_probabilities, probs], axis=1)
-
-    return nested_probabilities
+    # concat once rather than growing the result one nest at a time
+    return pd.concat(nested_probabilities, axis=1)
 
 
 def compute_base_probabilities(nested_probabilities, nests, spec):
@@ -697,21 +827,28 @@ def compute_base_probabilities(nested_probabilities, nests, spec):
         Will have the index of `nested_probabilities` and columns for leaf base probabilities
     """
 
-    base_probabilities = pd.DataFrame(index=nested_probabilities.index)
+    leaves = {nest.name: nest for nest in logit.each_nest(nests, type='leaf', post_order=False)}
 
-    for nest in logit.each_nest(nests, type='leaf', post_order=False):
+    # reorder alternative columns to match spec
+    # since these are alternatives chosen by column index, order of columns matters
+    assert(set(leaves.keys()) == set(spec.columns))
 
-        # skip root: it has a prob of 1 but we didn't compute a nested probability column for it
-        ancestors = nest.ancestors[1:]
+    positions = {name: i for i, name in enumerate(nested_probabilities.columns)}
+    nested_arr = nested_probabilities.values
 
-        base_probabilities[nest.name] = nested_probabilities[ancestors].prod(axis=1)
+    base_probabilities = np.empty((len(nested_probabilities.index), len(spec.columns)), dtype=np.float64)
 
-    # reorder alternative columns to match spec
-    # since these are alternatives chosen by column index, order of columns matters
-    assert(set(base_probabilities.columns) == set(spec.columns))
-    base_probabilities = base_probabilities[spec.columns]
+    for i, name in enumerate(spec.columns):
+
+        # skip root: it has a prob of 1 but we didn't compute a nested probability column for it
+        ancestors = leaves[name].ancestors[1:]
+
+        probs = base_probabilities[:, i]
+        probs[:] = nested_arr[:, positions[ancestors[0]]]
+        for ancestor in ancestors[1:]:
+            probs *= nested_arr[:, positions[ancestor]]
 
-    return base_probabilities
+    return pd.DataFrame(base_probabilities, index=nested_probabilities.index, columns=spec.columns)
 
 
 def eval_mnl(choosers, spec, locals_d, custom_chooser, estimator,
@@ -1057,7 +1194,7 @@ def simple_simulate(choosers, spec, nest_spec, skims=None, locals_d=None,
 
     result_list = []
     # segment by person type and pick the right spec for each person type
-    for i, num_chunks, chooser_chunk in chunk.chunked_choosers(choosers, rows_per_chunk):
+    for i, num_chunks, chooser_chunk in chunk.chunked_choosers(choosers, rows_per_chunk, trace_label):
 
         logger.info("Running chunk %s of %s size %d" % (i, num_chunks, len(chooser_chunk)))
 
@@ -1247,6 +1384,9 @@ def simple_simulate_logsums(choosers, spec, nest_spec,
     """
     like simple_simulate except return logsums instead of making choices
 
+    If settings logsum_cache_size is positive, logsums are only evaluated once for each distinct
+    combination of the chooser columns used by the spec and skims (see logsum_cache)
+
     Returns
     -------
     logsums : pandas.Series
@@ -1257,12 +1397,27 @@ def simple_simulate_logsums(choosers, spec, nest_spec,
 
     assert len(choosers) > 0
 
+    if logsum_cache.cache_size() > 0 and not tracing.has_trace_targets(choosers):
+
+        def evaluate(distinct_choosers):
+            return _chunked_simple_simulate_logsums(
+                distinct_choosers, spec, nest_spec, skims, locals_d, chunk_size, trace_label, alt_col_name)
+
+        return logsum_cache.cached_logsums(choosers, spec, nest_spec, skims, locals_d, evaluate, trace_label)
+
+    return _chunked_simple_simulate_logsums(
+        choosers, spec, nest_spec, skims, locals_d, chunk_size, trace_label, alt_col_name)
+
+
+def _chunked_simple_simulate_logsums(choosers, spec, nest_spec,
+                                     skims, locals_d, chunk_size, trace_label, alt_col_name):
+
     rows_per_chunk, effective_chunk_size = \
         simple_simulate_logsums_rpc(chunk_size, choosers, spec, nest_spec, trace_label)
 
     result_list = []
     # segment by person type and pick the right spec for each person type
-    for i, num_chunks, chooser_chunk in chunk.chunked_choosers(choosers, rows_per_chunk):
+    for i, num_chunks, chooser_chunk in chunk.chunked_choosers(choosers, rows_per_chunk, trace_label):
 
         logger.info("Running chunk %s of %s size %d" % (i, num_chunks, len(chooser_chunk)))
 
@@ -11,11 +11,60 @@ from collections import OrderedDict
 import numpy as np
 import pandas as pd
 
-from activitysim.core.util import quick_loc_series
-
 
 logger = logging.getLogger(__name__)
 
+# skim block layouts (skim_info['skim_layout'])
+# od_major blocks have shape (orig, dest, skim) so a single skim is a strided 2-D view
+# skim_major blocks have shape (skim, orig, dest) so each skim is a contiguous 2-D plane
+OD_MAJOR = 'od_major'
+SKIM_MAJOR = 'skim_major'
+SKIM_LAYOUTS = [OD_MAJOR, SKIM_MAJOR]
+
+# offset of zone ids (or skim keys) that are not in the skim
+NOT_IN_SKIM = -1
+
+# max ratio of zone id range to number of zones for which OffsetMapper builds a dense id => offset array
+MAX_OFFSET_TABLE_SPARSITY = 10
+
+
+def gather(data, offsets):
+    """
+    Return data[offsets] for a tuple of index arrays, one per data dimension,
+    with nan for rows in which any offset is out of bounds (e.g. NOT_IN_SKIM).
+
+    This is the shared fast path for skim and DataFrameMatrix lookups. If all offsets are in bounds
+    (the usual case), values are gathered in a single fancy index operation with no intermediate copies.
+    Otherwise, result is float and rows with any out of bounds offset are nan.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+    offsets : tuple of 1-D int arrays (or scalars) of the same length, one for each dimension of data
+
+    Returns
+    -------
+    values : 1-D numpy.ndarray
+    """
+
+    assert len(offsets) == data.ndim
+
+    out_of_bounds = None
+    for offset, size in zip(offsets, data.shape):
+        # negative offsets become large unsigned values, so a single comparison checks both bounds
+        offset = np.asanyarray(offset)
+        oob = offset.astype(np.uint64, copy=False) >= size
+        out_of_bounds = oob if out_of_bounds is None else (out_of_bounds | oob)
+
+    if not out_of_bounds.any():
+        return data[offsets]
+
+    in_bounds_offsets = tuple(np.where(out_of_bounds, 0, offset) for offset in offsets)
+    result = data[in_bounds_offsets].astype(np.result_type(data.dtype, np.float32))
+    result[out_of_bounds] = np.nan
+
+    return result
+
 
 class OffsetMapper(object):
     """
@@ -29,6 +78,10 @@ class OffsetMapper(object):
         self.offset_series = None
         self.offset_int = offset_int
 
+        # dense zone id => offset array (with NOT_IN_SKIM for ids not in skim) for zone ids >= offset_table_base
+        self.offset_table = None
+        self.offset_table_base = 0
+
     def set_offset_list(self, offset_list):
         """
         Specify the zone ids corresponding to the offsets (ordinal positions)
@@ -54,6 +107,15 @@ class OffsetMapper(object):
 
         if self.offset_series is None:
             self.offset_series = pd.Series(data=list(range(len(offset_list))), index=offset_list)
+
+            # - precompute dense zone id => offset array unless zone ids are very sparse
+            zone_ids = np.asanyarray(offset_list)
+            if zone_ids.dtype.kind in 'iu':
+                min_id, max_id = zone_ids.min(), zone_ids.max()
+                if max_id - min_id + 1 <= MAX_OFFSET_TABLE_SPARSITY * len(zone_ids):
+                    self.offset_table = np.full(max_id - min_id + 1, NOT_IN_SKIM, dtype=np.int32)
+                    self.offset_table[zone_ids - min_id] = np.arange(len(zone_ids), dtype=np.int32)
+                    self.offset_table_base = min_id
         else:
             # make sure it offsets are the same
             assert (offset_list == self.offset_series.index).all()
@@ -81,6 +143,10 @@ class OffsetMapper(object):
         """
         map zone_ids to offsets
 
+        Zone ids that are not in the skim (or are nan) are mapped to NOT_IN_SKIM if the skim has an
+        explicit offset list. With a fixed offset_int, offsets of zone ids not in the skim will be out
+        of bounds of the skim data (see gather).
+
         Parameters
         ----------
         zone_ids
@@ -90,12 +156,30 @@ class OffsetMapper(object):
         offsets : numpy array of int
         """
 
-        NOT_IN_SKIM = -1
+        zone_ids = np.asanyarray(zone_ids)
+
+        # nan zone ids (e.g. from missing values) are not in skim
+        missing = None
+        if zone_ids.dtype.kind == 'f':
+            missing = np.isnan(zone_ids)
+            if missing.any():
+                zone_ids = np.where(missing, 0, zone_ids)
+            else:
+                missing = None
+            zone_ids = zone_ids.astype(np.int64)
 
         if self.offset_series is not None:
             assert(self.offset_int is None)
             assert isinstance(self.offset_series, pd.Series)
-            offsets = np.asanyarray(quick_loc_series(zone_ids, self.offset_series).fillna(NOT_IN_SKIM).astype(int))
+
+            if self.offset_table is not None:
+                ix = zone_ids - self.offset_table_base
+                in_table = ix.astype(np.uint64, copy=False) < len(self.offset_table)
+                offsets = self.offset_table.take(ix, mode='clip')
+                if not in_table.all():
+                    offsets[~in_table] = NOT_IN_SKIM
+            else:
+                offsets = self.offset_series.index.get_indexer(zone_ids)
 
         elif self.offset_int:
             assert (self.offset_series is None)
@@ -103,6 +187,9 @@ class OffsetMapper(object):
         else:
             offsets = zone_ids
 
+        if missing is not None:
+            offsets = np.where(missing, NOT_IN_SKIM, offsets)
+
         return offsets
 
 
@@ -137,28 +224,16 @@ class SkimWrapper(object):
         Returns
         -------
         values : 1D array
+            nan where orig or dest is not in skim
 
         """
 
-        # fixme - remove?
-        assert not (np.isnan(orig) | np.isnan(dest)).any()
-
         # only working with numpy in here
-        orig = np.asanyarray(orig).astype(int)
-        dest = np.asanyarray(dest).astype(int)
-
         mapped_orig = self.offset_mapper.map(orig)
         mapped_dest = self.offset_mapper.map(dest)
-        result = self.data[mapped_orig, mapped_dest]
-
-        # FIXME - should return nan if not in skim (negative indices wrap around)
-        # NOT_IN_SKIM = np.nan
-        # in_skim = \
-        #     (mapped_orig <0) & (mapped_orig < self.data.shape[0]) & \
-        #     (mapped_dest <0) & (mapped_dest < self.data.shape[0])
-        # result = np.where(in_skim, result, NOT_IN_SKIM)
 
-        return result
+        # nan for zones not in skim (rather than wrapping around with negative indices)
+        return gather(self.data, (mapped_orig, mapped_dest))
 
 
 class SkimDict(object):
@@ -174,14 +249,47 @@ class SkimDict(object):
 
         self.skim_info = skim_info
         self.skim_data = skim_data
+        self.skim_layout = skim_info.get('skim_layout', OD_MAJOR)
+        assert self.skim_layout in SKIM_LAYOUTS
 
         self.offset_mapper = OffsetMapper()
         self.usage = set()
 
+        # key1 names of skims in omx file that were not loaded (see skims.get_skim_info)
+        self.pruned_skims = set(skim_info.get('pruned_skims', []))
+        self.pruned_usage = set()
+
     def touch(self, key):
 
         self.usage.add(key)
 
+    def is_pruned(self, key):
+        """
+        True if key (str or (key1, key2) tuple) is a skim that was pruned rather than loaded
+        """
+
+        key1 = key[0] if isinstance(key, tuple) else key
+        return key1 in self.pruned_skims
+
+    def pruned_skim_data(self, key):
+        """
+        read-only all-nan skim data standing in for a pruned skim
+
+        only if skim_info strict_skim_usage is explicitly False, otherwise raises RuntimeError
+        """
+
+        if self.skim_info.get('strict_skim_usage', True):
+            raise RuntimeError("skim %s was not loaded (pruned by prune_skims or skim_usage_file setting) "
+                               "- set strict_skim_usage: False to return nan instead" % (key, ))
+
+        if key not in self.pruned_usage:
+            self.pruned_usage.add(key)
+            logger.warning("skim %s was not loaded (pruned by prune_skims or skim_usage_file setting) "
+                           "- lookups will return nan" % (key, ))
+
+        dtype = self.skim_info.get('dtype', np.float32)
+        return np.broadcast_to(np.array(np.nan, dtype=dtype), self.skim_info['omx_shape'])
+
     def get(self, key):
         """
         Get an available wrapped skim object (not the lookup)
@@ -197,12 +305,22 @@ class SkimDict(object):
              The skim object
         """
 
-        block, offset = self.skim_info['block_offsets'].get(key)
+        block_offset = self.skim_info['block_offsets'].get(key)
+
+        if block_offset is None and self.is_pruned(key):
+            data = self.pruned_skim_data(key)
+            self.touch(key)
+            return SkimWrapper(data, self.offset_mapper)
+
+        block, offset = block_offset
         block_data = self.skim_data[block]
 
         self.touch(key)
 
-        data = block_data[:, :, offset]
+        if self.skim_layout == SKIM_MAJOR:
+            data = block_data[offset]
+        else:
+            data = block_data[:, :, offset]
 
         return SkimWrapper(data, self.offset_mapper)
 
@@ -368,6 +486,12 @@ class SkimStack(object):
 
         self.skim_dim3 = skim_dim3
 
+        # - key1 => (index of key2 values, absolute offsets into block) for vectorized lookup of dim3 offsets
+        self.skim_dim3_offsets = {
+            key1: (pd.Index(list(key2_offsets.keys())), np.array(list(key2_offsets.values()), dtype=np.int32))
+            for key1, key2_offsets in skim_dim3.items()
+        }
+
         logger.info("SkimStack.__init__ loaded %s keys with %s total skims"
                     % (len(self.skim_dim3),
                        sum([len(d) for d in self.skim_dim3.values()])))
@@ -378,24 +502,37 @@ class SkimStack(object):
         self.usage.add(key)
 
     def lookup(self, orig, dest, dim3, key):
+        """
+        skim values for orig, dest zones and dim3 (key2, e.g. time period) skim keys
+
+        nan where orig or dest is not in skim or dim3 isn't a key2 of key
+        """
 
         orig = self.offset_mapper.map(orig)
         dest = self.offset_mapper.map(dest)
 
+        if key not in self.key1_blocks and self.skim_dict.is_pruned(key):
+            data = self.skim_dict.pruned_skim_data(key)
+            self.touch(key)
+            return gather(data, (orig, dest))
+
         assert key in self.key1_blocks, "SkimStack key %s missing" % key
         assert key in self.skim_dim3, "SkimStack key %s missing" % key
 
         block = self.key1_blocks[key]
         stacked_skim_data = self.skim_dict.skim_data[block]
-        skim_keys_to_indexes = self.skim_dim3[key]
 
         self.touch(key)
 
-        # skim_indexes = dim3.map(skim_keys_to_indexes).astype('int')
-        # this should be faster than map
-        skim_indexes = np.vectorize(skim_keys_to_indexes.get)(dim3)
+        # absolute offsets into block of dim3 skim keys, NOT_IN_SKIM if key2 not found
+        key2_index, key2_offsets = self.skim_dim3_offsets[key]
+        positions = key2_index.get_indexer(np.asanyarray(dim3))
+        skim_indexes = np.where(positions == -1, NOT_IN_SKIM, key2_offsets[positions])
+
+        if self.skim_dict.skim_layout == SKIM_MAJOR:
+            return gather(stacked_skim_data, (skim_indexes, orig, dest))
 
-        return stacked_skim_data[orig, dest, skim_indexes]
+        return gather(stacked_skim_data, (orig, dest, skim_indexes))
 
     def wrap(self, left_key, right_key, skim_key):
         """
@@ -487,9 +624,9 @@ class SkimStackWrapper(object):
         """
 
         assert self.df is not None, "Call set_df first"
-        orig = self.df[self.left_key].astype('int')
-        dest = self.df[self.right_key].astype('int')
-        dim3 = self.df[self.skim_key]
+        orig = self.df[self.left_key].values
+        dest = self.df[self.right_key].values
+        dim3 = self.df[self.skim_key].values
 
         skim_values = self.stack.lookup(orig, dest, dim3, key)
 
@@ -531,6 +668,7 @@ class DataFrameMatrix(object):
         self.offset_mapper.set_offset_list(list(df.index))
 
         self.cols_to_indexes = {k: v for v, k in enumerate(df.columns)}
+        self.columns = pd.Index(df.columns)
 
     def get(self, row_ids, col_ids):
         """
@@ -545,15 +683,16 @@ class DataFrameMatrix(object):
         -------
 
         series with one row per row_id, with the value from the column specified in col_ids
+        (nan if row_id is not in df index or col_id is not a df column)
 
         """
         # col_indexes = segments.map(self.cols_to_indexes).astype('int')
-        # this should be faster than map
-        col_indexes = np.vectorize(self.cols_to_indexes.get)(col_ids)
+        # this should be faster than map (get_indexer returns -1 for unknown columns)
+        col_indexes = self.columns.get_indexer(np.asanyarray(col_ids))
 
         row_indexes = self.offset_mapper.map(np.asanyarray(row_ids))
 
-        result = self.data[row_indexes, col_indexes]
+        result = gather(self.data, (row_indexes, col_indexes))
 
         # FIXME - if ids (or col_ids?) is a series, return series with same index?
         if isinstance(row_ids, pd.Series):
@@ -19,7 +19,7 @@ def track_skim_usage(output_dir):
     """
     write statistics on skim usage (diagnostic to detect loading of un-needed skims)
 
-    FIXME - have not yet implemented a facility to avoid loading of unused skims
+    The skim_usage.txt file can be used as skim_usage_file setting of subsequent runs to only load used skims
 
     Parameters
     ----------
@@ -0,0 +1,135 @@
+# ActivitySim
+# See full license in LICENSE.txt.
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from .. import chunk
+from .. import inject
+
+
+def setup_function():
+    output_dir = os.path.join(os.path.dirname(__file__), 'output')
+    inject.add_injectable("output_dir", output_dir)
+
+    chunk.BYTES_PER_ROW.clear()
+    chunk.MEASURED.clear()
+    chunk.CHUNK_CACHE_STATE['loaded'] = False
+
+
+def teardown_function(func):
+    cache_file_path = chunk.chunk_cache_file_path()
+    for file_path in [cache_file_path, '%s.lock' % cache_file_path]:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+    inject.clear_cache()
+    inject.reinject_decorated_tables()
+
+
+def run_chunks(choosers, rows_per_chunk, trace_label, bytes_per_row):
+
+    chunk_sizes = []
+    for i, num_chunks, chooser_chunk in chunk.chunked_choosers(choosers, rows_per_chunk, trace_label):
+        chunk_trace_label = '%s.chunk_%s' % (trace_label, i)
+        chunk.log_open(chunk_trace_label, 0, 0)
+        chunk.log_df(chunk_trace_label, 'utilities', np.zeros(len(chooser_chunk) * bytes_per_row, dtype=np.int8))
+        chunk.log_close(chunk_trace_label)
+        chunk_sizes.append(len(chooser_chunk))
+    return chunk_sizes
+
+
+def test_chunked_choosers_static():
+
+    inject.add_injectable('settings', {})
+
+    choosers = pd.DataFrame({'a': np.arange(10)})
+    chunks = list(chunk.chunked_choosers(choosers, 4, 'test'))
+
+    assert [(i, n, len(c)) for i, n, c in chunks] == [(1, 3, 4), (2, 3, 4), (3, 3, 2)]
+
+
+def test_adaptive_chunking():
+
+    # enough memory for 1000 rows of 10KB each
+    budget = 1000 * 10000
+    inject.add_injectable('settings', {'chunk_memory_budget': budget, 'chunk_probe_rows': 100})
+
+    choosers = pd.DataFrame({'a': np.arange(2500)})
+
+    # probe chunk then chunks resized to fit budget (memory growth may exceed logged bytes)
+    chunk_sizes = run_chunks(choosers, 2500, 'test', bytes_per_row=10000)
+    assert chunk_sizes[0] == 100
+    assert sum(chunk_sizes) == 2500
+    assert all(s <= 1000 for s in chunk_sizes)
+    assert chunk.BYTES_PER_ROW['test'] >= 10000
+
+    chunk.write_chunk_cache()
+
+    # next run starts well-sized from learned bytes per row
+    bytes_per_row = chunk.BYTES_PER_ROW['test']
+    chunk.BYTES_PER_ROW.clear()
+    chunk.CHUNK_CACHE_STATE['loaded'] = False
+
+    rows_per_chunk = chunk.adaptive_rows_per_chunk('test', 2500, len(choosers))
+    assert rows_per_chunk == int(budget / bytes_per_row)
+
+
+def test_adaptive_resize():
+
+    budget = 1000 * 10000
+    inject.add_injectable('settings', {'chunk_memory_budget': budget})
+
+    # probe chunk memory growth includes one-time costs, so only logged bytes are counted
+    chunk.LAST_CHUNK.update(bytes=100 * 10000, mem=500 * 1000000)
+    assert chunk.adaptive_resize('test', 100, 100, 5000) == 1000
+    assert chunk.BYTES_PER_ROW['test'] == 10000
+
+    # later chunks count memory growth too
+    chunk.LAST_CHUNK.update(bytes=1000 * 10000, mem=1000 * 20000)
+    assert chunk.adaptive_resize('test', 1000, 1000, 5000) == 500
+    assert chunk.BYTES_PER_ROW['test'] == 20000
+
+    # and the estimate can shrink again
+    chunk.LAST_CHUNK.update(bytes=500 * 5000, mem=0)
+    assert chunk.adaptive_resize('test', 500, 500, 5000) == 2000
+    assert chunk.BYTES_PER_ROW['test'] == 5000
+
+
+def test_chunk_cache_merged():
+
+    inject.add_injectable('settings', {'chunk_memory_budget': 1000000})
+
+    # e.g. multiprocess sub-processes measuring different chunkers
+    for trace_label, bytes_per_row in [('a', 100), ('b', 200)]:
+        chunk.read_chunk_cache()
+        chunk.BYTES_PER_ROW[trace_label] = bytes_per_row
+        chunk.MEASURED.add(trace_label)
+        chunk.write_chunk_cache()
+
+    chunk.read_chunk_cache()
+    assert chunk.BYTES_PER_ROW == {'a': 100, 'b': 200}
+
+    # remeasured entries are updated
+    chunk.BYTES_PER_ROW['a'] = 50
+    chunk.MEASURED.add('a')
+    chunk.write_chunk_cache()
+
+    chunk.read_chunk_cache()
+    assert chunk.BYTES_PER_ROW == {'a': 50, 'b': 200}
+
+
+def test_chunked_choosers_and_alts():
+
+    inject.add_injectable('settings', {})
+
+    choosers = pd.DataFrame({'a': np.arange(5)}, index=pd.Index(np.arange(5), name='person_id'))
+    alternatives = pd.DataFrame({'pick_count': 1},
+                                index=pd.Index([0, 0, 1, 2, 2, 2, 3, 4, 4], name='person_id'))
+
+    chunks = list(chunk.chunked_choosers_and_alts(choosers, alternatives, 2))
+
+    assert [len(c) for _, _, c, _ in chunks] == [2, 2, 1]
+    assert [list(a.index) for _, _, _, a in chunks] == [[0, 0, 1], [2, 2, 2, 3], [4, 4]]
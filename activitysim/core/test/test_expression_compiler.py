@@ -0,0 +1,94 @@
+# ActivitySim
+# See full license in LICENSE.txt.
+
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+from .. import expression_compiler
+from .. import simulate
+
+
+@pytest.fixture(scope='module')
+def df():
+    prng = np.random.RandomState(0)
+    num_rows = 100
+    df = pd.DataFrame({
+        'age': prng.randint(0, 90, num_rows),
+        'income': prng.rand(num_rows) * 1000,
+        'is_worker': prng.rand(num_rows) > 0.5,
+        'sex': prng.choice(['M', 'F'], num_rows),
+    })
+    df['sex_cat'] = df.sex.astype('category')
+    return df
+
+
+@pytest.mark.parametrize('expression,compiled', [
+    ('age > 20 & income < 500', True),
+    ('age == 1 | age > 60 & is_worker', True),
+    ('18 <= age < 65', True),
+    ('not is_worker', True),
+    ('~is_worker', True),
+    ('age * income / (age + 1) - 2', True),
+    ('age // 10 % 3', True),
+    ('-age', True),
+    ("sex == 'M'", True),
+    ("sex_cat != 'F'", True),
+    ('is_worker and age > 30 or income > 900', True),
+    ('age', True),
+    ('is_worker + is_worker', True),  # compiled but evaluated by DataFrame.eval for bool columns
+    ('age.clip(upper=50)', False),
+    ('age in [1, 2, 3]', False),
+])
+def test_eval_simple_expression(df, expression, compiled):
+
+    assert (expression_compiler.compile_simple_expression(expression) is not None) == compiled
+
+    result = expression_compiler.eval_simple_expression(expression, df)
+    np.testing.assert_array_equal(np.asanyarray(result), df.eval(expression).values)
+
+
+def test_unknown_names(df):
+
+    # names that aren't df columns (e.g. index name) are left to DataFrame.eval
+    df = df.rename_axis('person_id')
+    result = expression_compiler.eval_simple_expression('person_id > 10', df)
+    assert isinstance(result, pd.Series)
+    assert result.sum() == len(df) - 11
+
+
+def test_eval_utilities_fused(df):
+
+    spec = pd.DataFrame({
+        'alt0': [1.0, 0.0, 0.5, 0.0],
+        'alt1': [0.0, 2.0, 0.0, -1.0],
+        'alt2': [0.0, 0.0, 0.0, 0.0],
+    }, index=pd.Index(['age > 40', '@df.income / 100', 'is_worker', '@np.log1p(df.age)'], name='Expression'))
+
+    utilities = simulate.eval_utilities(spec, df)
+
+    expression_values = simulate.eval_variables(spec.index, df)
+    expected = simulate.compute_utilities(expression_values, spec)
+
+    pdt.assert_frame_equal(utilities, expected, check_names=False)
+
+
+def test_eval_utilities_fused_non_finite(df):
+
+    # zero coefficient times nan or inf is nan, as when utilities are computed from expression_values
+    df = df.assign(ratio=np.where(df.age > 40, np.inf, df.age))
+    df.loc[df.index[0], 'ratio'] = np.nan
+
+    spec = pd.DataFrame({
+        'alt0': [1.0, 0.5],
+        'alt1': [0.0, 0.0],
+    }, index=pd.Index(['ratio', 'is_worker'], name='Expression'))
+
+    utilities = simulate.eval_utilities(spec, df)
+
+    expression_values = simulate.eval_variables(spec.index, df)
+    expected = np.dot(expression_values.values, spec.values)
+
+    np.testing.assert_array_equal(utilities.values, expected)
+    assert utilities.alt1.isnull().sum() == (~np.isfinite(df.ratio)).sum()
@@ -197,3 +197,55 @@ def test_create_input_store(seed_households, data_dir):
 
     store_df = pd.read_hdf(output_store, 'seed_households')
     assert store_df.equals(seed_households)
+
+    # input store gets all rows, even if only some are read
+    df = input.read_input_table('households', filter_values=[2, 3])
+    assert list(df.index) == [2, 3]
+
+    store_df = pd.read_hdf(output_store, 'seed_households')
+    assert store_df.equals(seed_households)
+
+    csv_df = pd.read_csv(os.path.join(inject.get_injectable('output_dir'), 'input_data', 'households.csv'))
+    assert csv_df.equals(seed_households)
+
+
+@pytest.mark.parametrize('file_format', ['csv', 'fixed', 'table'])
+def test_filtered_reader(seed_households, data_dir, file_format):
+
+    settings_yaml = """
+        input_table_list:
+          - tablename: households
+            filename: households.%s
+            index_col: household_id
+            rename_columns:
+              HHID: household_id
+            keep_columns:
+              - TAZ
+    """ % ('csv' if file_format == 'csv' else 'h5')
+
+    settings = yaml.load(settings_yaml, Loader=yaml.SafeLoader)
+    inject.add_injectable('settings', settings)
+
+    households = seed_households.assign(income=seed_households.HHID * 1000)
+    if file_format == 'csv':
+        households.to_csv(os.path.join(data_dir, 'households.csv'), index=False)
+    else:
+        households.to_hdf(os.path.join(data_dir, 'households.h5'), key='households', mode='w', format=file_format)
+
+    # rows are returned in file order
+    df = input.read_input_table('households', filter_values=[9, 2, 11])
+    assert df.index.name == 'household_id'
+    assert list(df.index) == [2, 9]
+    assert list(df.columns) == ['TAZ']
+    assert list(df.TAZ) == [8, 16]
+
+    df = input.read_input_table('households', columns=[])
+    assert list(df.index) == list(seed_households.HHID)
+    assert len(df.columns) == 0
+
+    df = input.read_input_table('households', columns=['income'], filter_col='TAZ', filter_values=[12, 18])
+    assert list(df.index) == [5, 6, 10]
+    assert list(df.income) == [5000, 6000, 10000]
+
+    df = input.read_input_table('households', filter_values=[])
+    assert df.empty
@@ -0,0 +1,148 @@
+# ActivitySim
+# See full license in LICENSE.txt.
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+from .. import chunk
+from .. import inject
+from .. import interaction_sample
+from .. import skim
+
+
+@pytest.fixture(scope='module')
+def choosers():
+    prng = np.random.RandomState(0)
+    num_choosers = 50
+    return pd.DataFrame({
+        'home_taz': prng.randint(1, 6, num_choosers),
+        'income_segment': prng.randint(1, 4, num_choosers),
+        'age': prng.randint(18, 80, num_choosers),
+        'area': prng.rand(num_choosers),
+    }, index=pd.Index(np.arange(100, 100 + num_choosers), name='person_id'))
+
+
+@pytest.fixture(scope='module')
+def alternatives():
+    return pd.DataFrame({
+        'size_term': [10., 20., 0., 40., 50.],
+        'area': [1., 2., 3., 4., 5.],
+    }, index=pd.Index(np.arange(1, 6), name='dest_taz'))
+
+
+@pytest.fixture(scope='module')
+def skims():
+    skim_info = {
+        'omx_shape': (5, 5),
+        'num_skims': 1,
+        'dtype': np.float32,
+        'block_offsets': OrderedDict([('DIST', (0, 0))]),
+        'key1_block_offsets': OrderedDict([('DIST', (0, 0))]),
+    }
+    data = np.arange(25, dtype=np.float32).reshape((5, 5, 1))
+    skim_dict = skim.SkimDict([data], skim_info)
+    skim_dict.offset_mapper.set_offset_int(-1)
+    return skim_dict.wrap('home_taz', 'dest_taz')
+
+
+def spec_df(exprs):
+    spec = pd.DataFrame({'coefficient': np.linspace(-1., 1., len(exprs))},
+                        index=pd.Index(exprs, name='Expression'))
+    return spec
+
+
+def test_decomposed_utilities(choosers, alternatives, skims):
+
+    inject.add_injectable('settings', {'check_for_variability': False})
+
+    spec = spec_df([
+        '_dist@skims["DIST"]',
+        '@_dist * (df.income_segment == 1)',
+        '@np.log1p(df.size_term)',
+        'age > 40',
+        'area',
+        'area_chooser * area',
+        '@_dist.clip(upper=10)',
+    ])
+    locals_d = {'skims': skims}
+
+    alternatives = alternatives.copy()
+    alternatives[alternatives.index.name] = alternatives.index
+
+    term_specs = interaction_sample.decompose_interaction_spec(spec, choosers, alternatives, locals_d)
+    assert term_specs is not None
+
+    assert list(term_specs[interaction_sample.CHOOSER_TERMS].index) == ['age > 40']
+    assert list(term_specs[interaction_sample.ALTERNATIVE_TERMS].index) == ['@np.log1p(df.size_term)', 'area']
+    assert len(term_specs[interaction_sample.INTERACTION_TERMS]) == 4
+    assert term_specs['profile_columns'] == ['home_taz', 'income_segment', 'area']
+
+    chunk.log_open('test', chunk_size=0, effective_chunk_size=0)
+    try:
+        utilities = interaction_sample.eval_decomposed_utilities(
+            term_specs, choosers, alternatives, skims, locals_d, trace_label='test')
+
+        expected = interaction_sample._interaction_sample_utilities(
+            choosers, alternatives, spec, skims, locals_d, have_trace_targets=False, trace_label='test')
+    finally:
+        chunk.log_close('test')
+
+    pdt.assert_frame_equal(utilities, expected, check_exact=False)
+
+
+def test_decompose_not_decomposable(choosers, alternatives):
+
+    # expressions that depend on the shape of df can't be decomposed
+    spec = spec_df(['@len(df)', 'area'])
+    assert interaction_sample.decompose_interaction_spec(spec, choosers, alternatives, {}) is None
+
+    # unknown name
+    spec = spec_df(['@foo * df.area'])
+    assert interaction_sample.decompose_interaction_spec(spec, choosers, alternatives, {}) is None
+
+
+def test_make_sample_choices(monkeypatch):
+
+    prng = np.random.RandomState(0)
+    chooser_count, alternative_count, sample_size = 200, 30, 10
+
+    choosers = pd.DataFrame(index=pd.Index(np.arange(chooser_count), name='person_id'))
+    alternatives = pd.DataFrame(index=pd.Index(np.arange(alternative_count) + 1, name='dest_taz'))
+
+    probs = prng.rand(chooser_count, alternative_count)
+    probs[:, 5] = 0
+    probs = probs / probs.sum(axis=1).reshape(-1, 1)
+    probs = pd.DataFrame(probs, index=choosers.index)
+
+    rands = prng.rand(chooser_count, sample_size)
+    # rand greater than (rounded) cum prob total chooses first alternative
+    rands[0, 0] = 1.0
+
+    class RandomStub(object):
+        def random_for_df(self, df, n=1):
+            assert n == sample_size
+            return rands
+
+    monkeypatch.setattr(interaction_sample.pipeline, 'get_rn_generator', lambda: RandomStub())
+
+    choices_df = interaction_sample.make_sample_choices(
+        choosers, probs, alternatives,
+        sample_size, alternative_count, 'dest_taz',
+        allow_zero_probs=False, trace_label='test')
+
+    # position of first cum_prob greater than rand for each draw
+    cum_probs = probs.values.cumsum(axis=1)
+    positions = np.array([np.argmax(cum_probs > rands[:, [i]], axis=1) for i in range(sample_size)]).T
+
+    assert list(choices_df.columns) == ['dest_taz', 'rand', 'prob', 'person_id']
+    np.testing.assert_array_equal(choices_df.dest_taz.values, alternatives.index.values[positions.ravel()])
+    np.testing.assert_array_equal(choices_df.rand.values, rands.ravel())
+    np.testing.assert_array_equal(choices_df.prob.values,
+                                  np.take_along_axis(probs.values, positions, axis=1).ravel())
+    np.testing.assert_array_equal(choices_df.person_id.values, np.repeat(choosers.index.values, sample_size))
+    assert choices_df.dest_taz.values[0] == alternatives.index[0]
+    assert not (choices_df.dest_taz == 6).any()
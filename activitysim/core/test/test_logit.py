@@ -107,6 +107,37 @@ def test_make_choices_real_probs(utilities):
         pd.Series([1, 2], index=[0, 1]))
 
 
+def test_utils_to_probs_exponentiated():
+
+    exp_utils = pd.DataFrame([[1., 3., 0.], [1e-301, 2., 2.], [0., 0., 0.]], columns=['a', 'b', 'c'])
+    values = exp_utils.values.copy()
+
+    probs = logit.utils_to_probs(exp_utils, trace_label=None, exponentiated=True, allow_zero_probs=True)
+
+    np.testing.assert_array_equal(probs.values, [[0.25, 0.75, 0.], [0., 0.5, 0.5], [0., 0., 0.]])
+
+    # exponentiated utilities are not modified in place
+    np.testing.assert_array_equal(exp_utils.values, values)
+
+
+def test_choose_from_probs():
+
+    prng = np.random.RandomState(0)
+    probs = prng.rand(100, 7)
+    probs[:, 3] = 0
+    probs /= probs.sum(axis=1).reshape(-1, 1)
+
+    rands = prng.rand(100, 1)
+    # rand greater than (rounded) cum prob total chooses first alternative
+    rands[0] = 1.0
+
+    choices = logit.choose_from_probs(probs, rands)
+
+    np.testing.assert_array_equal(choices, np.argmax(probs.cumsum(axis=1) - rands > 0, axis=1))
+    assert choices[0] == 0
+    assert not (choices == 3).any()
+
+
 @pytest.fixture(scope='module')
 def interaction_choosers():
     return pd.DataFrame({
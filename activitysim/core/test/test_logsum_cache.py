@@ -0,0 +1,148 @@
+# ActivitySim
+# See full license in LICENSE.txt.
+
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+
+from .. import inject
+from .. import logsum_cache
+from .. import simulate
+from .. import skim
+
+
+def teardown_function(func):
+    logsum_cache.clear()
+    inject.clear_cache()
+    inject.reinject_decorated_tables()
+
+
+def test_logsum_cache():
+
+    spec = pd.DataFrame({'walk': [0.5, 0.0, 0.0],
+                         'drive': [0.0, -0.2, 1.0]},
+                        index=pd.Index(['@df.income / 100', '@df.dist * cost_factor', 'has_car'], name='Expression'))
+    nest_spec = {'name': 'root', 'coefficient': 1.0, 'alternatives': ['walk', 'drive']}
+
+    prng = np.random.RandomState(0)
+    num_choosers = 200
+    choosers = pd.DataFrame({
+        'income': prng.choice([100, 200, 300], num_choosers),
+        'dist': prng.choice([1.0, 2.0], num_choosers),
+        'has_car': prng.choice([True, False], num_choosers),
+        'age': np.arange(num_choosers),  # not used by spec
+    }, index=pd.Index(np.arange(num_choosers) + 1000, name='tour_id'))
+    locals_d = {'cost_factor': 2.0}
+
+    assert logsum_cache.spec_key_columns(choosers, spec) == ['income', 'dist', 'has_car']
+
+    inject.add_injectable('settings', {})
+    expected = simulate.simple_simulate_logsums(choosers, spec, nest_spec, locals_d=locals_d, trace_label='model_a')
+
+    inject.add_injectable('settings', {'logsum_cache_size': 1000})
+    logsums = simulate.simple_simulate_logsums(choosers, spec, nest_spec, locals_d=locals_d, trace_label='model_a')
+    pdt.assert_series_equal(logsums, expected, check_names=False)
+
+    stats = logsum_cache.stats()
+    assert stats.loc['model_a', 'rows'] == num_choosers
+    assert stats.loc['model_a', 'distinct'] == 12
+    assert stats.loc['model_a', 'hits'] == 0
+
+    # second call (e.g. by another model) finds all keys in cache
+    logsums = simulate.simple_simulate_logsums(choosers.iloc[:50], spec, nest_spec,
+                                               locals_d=locals_d, trace_label='model_b.logsums')
+    pdt.assert_series_equal(logsums, expected.iloc[:50], check_names=False)
+    assert logsum_cache.stats().loc['model_b', 'hit_rate'] == 1.0
+
+    # different locals aren't confused with cached results
+    logsums = simulate.simple_simulate_logsums(choosers, spec, nest_spec,
+                                               locals_d={'cost_factor': 3.0}, trace_label='model_b')
+    assert not np.allclose(logsums, expected)
+
+    # least recently used entries are evicted
+    inject.add_injectable('settings', {'logsum_cache_size': 5})
+    simulate.simple_simulate_logsums(choosers, spec, nest_spec, locals_d=locals_d, trace_label='model_a')
+    assert len(logsum_cache._CACHE) == 5
+
+
+def test_logsum_cache_undetermined_columns():
+
+    spec = pd.DataFrame({'walk': [1.0]}, index=pd.Index(['@len(df)'], name='Expression'))
+    choosers = pd.DataFrame({'income': [1, 2]})
+    assert logsum_cache.spec_key_columns(choosers, spec) is None
+
+
+def test_logsum_cache_no_key_columns():
+
+    # spec doesn't reference any chooser columns or skims
+    spec = pd.DataFrame({'walk': [0.5, 0.0], 'drive': [0.0, 1.0]},
+                        index=pd.Index(['@1', '@cost_factor'], name='Expression'))
+    nest_spec = {'name': 'root', 'coefficient': 1.0, 'alternatives': ['walk', 'drive']}
+    choosers = pd.DataFrame({'income': [100, 200, 300]}, index=pd.Index([5, 6, 7], name='tour_id'))
+    locals_d = {'cost_factor': 2.0}
+
+    assert logsum_cache.spec_key_columns(choosers, spec) == []
+
+    inject.add_injectable('settings', {})
+    expected = simulate.simple_simulate_logsums(choosers, spec, nest_spec, locals_d=locals_d, trace_label='model_a')
+
+    inject.add_injectable('settings', {'logsum_cache_size': 100})
+    logsums = simulate.simple_simulate_logsums(choosers, spec, nest_spec, locals_d=locals_d, trace_label='model_a')
+    pdt.assert_series_equal(logsums, expected, check_names=False)
+    assert logsum_cache.stats().loc['model_a', 'distinct'] == 1
+
+
+def test_logsum_cache_skim_keys():
+
+    zones = np.arange(1, 4)
+    skim_data = np.arange(9, dtype=np.float32).reshape(3, 3, 1)
+    skim_info = {'omx_shape': (3, 3), 'block_offsets': {'DIST': (0, 0)}}
+    skim_dict = skim.SkimDict([skim_data], skim_info)
+    skim_dict.offset_mapper.set_offset_list(list(zones))
+
+    spec = pd.DataFrame({'walk': [-0.5], 'drive': [0.0]},
+                        index=pd.Index(['@od_skims["DIST"]'], name='Expression'))
+    nest_spec = {'name': 'root', 'coefficient': 1.0, 'alternatives': ['walk', 'drive']}
+
+    choosers = pd.DataFrame({'orig': [1, 2, 3, 1], 'dest': [3, 1, 2, 2]},
+                            index=pd.Index(np.arange(4) + 1000, name='tour_id'))
+
+    def logsums(left_key, right_key):
+        od_skims = skim.SkimDictWrapper(skim_dict, left_key, right_key)
+        return simulate.simple_simulate_logsums(choosers, spec, nest_spec, skims=od_skims,
+                                                locals_d={'od_skims': od_skims}, trace_label='model_a')
+
+    inject.add_injectable('settings', {})
+    expected_od = logsums('orig', 'dest')
+    expected_do = logsums('dest', 'orig')
+    assert not np.allclose(expected_od, expected_do)
+
+    # swapping orig and dest keys must miss the cache
+    inject.add_injectable('settings', {'logsum_cache_size': 1000})
+    pdt.assert_series_equal(logsums('orig', 'dest'), expected_od, check_names=False)
+    pdt.assert_series_equal(logsums('dest', 'orig'), expected_do, check_names=False)
+    assert logsum_cache.stats().loc['model_a', 'hits'] == 0
+
+    # but the same keys (with new wrapper objects) hit
+    pdt.assert_series_equal(logsums('orig', 'dest'), expected_od, check_names=False)
+    assert logsum_cache.stats().loc['model_a', 'hits'] == 4
+
+
+def test_logsum_cache_non_scalar_locals():
+
+    spec = pd.DataFrame({'walk': [1.0], 'drive': [0.0]},
+                        index=pd.Index(['@df.income * factors[0]'], name='Expression'))
+    nest_spec = {'name': 'root', 'coefficient': 1.0, 'alternatives': ['walk', 'drive']}
+    choosers = pd.DataFrame({'income': [1.0, 2.0]})
+
+    fingerprint = logsum_cache.spec_fingerprint(spec, nest_spec, {'factors': np.array([1.0])}, ['income'])
+    assert fingerprint == logsum_cache.spec_fingerprint(spec, nest_spec, {'factors': np.array([1.0])}, ['income'])
+    assert fingerprint != logsum_cache.spec_fingerprint(spec, nest_spec, {'factors': np.array([2.0])}, ['income'])
+    assert fingerprint != logsum_cache.spec_fingerprint(spec, nest_spec, {'factors': np.array([1.0])}, ['age'])
+
+    inject.add_injectable('settings', {'logsum_cache_size': 1000})
+    a = simulate.simple_simulate_logsums(choosers, spec, nest_spec, locals_d={'factors': np.array([1.0])},
+                                         trace_label='model_a')
+    b = simulate.simple_simulate_logsums(choosers, spec, nest_spec, locals_d={'factors': np.array([2.0])},
+                                         trace_label='model_a')
+    assert not np.allclose(a, b)
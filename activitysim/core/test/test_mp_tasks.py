@@ -0,0 +1,206 @@
+# ActivitySim
+# See full license in LICENSE.txt.
+
+import multiprocessing
+import os
+
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+from activitysim.core import config
+from activitysim.core import inject
+from activitysim.core import mp_tasks
+from activitysim.core import pipeline
+
+
+def setup_function():
+    output_dir = os.path.join(os.path.dirname(__file__), 'output')
+    inject.add_injectable("output_dir", output_dir)
+
+
+def teardown_function(func):
+    inject.clear_cache()
+    inject.reinject_decorated_tables()
+
+
+@pytest.fixture(scope='module')
+def tables():
+
+    households = pd.DataFrame({'income': [10, 20, 30, 40, 50, 60]},
+                              index=pd.Index([1, 2, 3, 4, 5, 6], name='household_id'))
+
+    persons = pd.DataFrame({'household_id': [1, 1, 1, 1, 2, 3, 3, 4, 5, 6, 6, 6]},
+                           index=pd.Index(np.arange(12) + 100, name='person_id'))
+
+    tours = pd.DataFrame({'person_id': [100, 100, 101, 102, 103, 104, 106, 109, 109]},
+                         index=pd.Index(np.arange(9) + 1000, name='tour_id'))
+
+    land_use = pd.DataFrame({'area': [1, 2]}, index=pd.Index([1, 2], name='zone_id'))
+
+    return {'households': households, 'persons': persons, 'tours': tours, 'land_use': land_use}
+
+
+def test_primary_slice_weights(tables):
+
+    slice_info = {'tables': ['households', 'persons']}
+    slice_rules = mp_tasks.build_slice_rules(slice_info, tables)
+
+    assert mp_tasks.primary_slice_weights(slice_info, slice_rules, tables) is None
+
+    # trips are not in pipeline
+    slice_info = {'tables': ['households', 'persons'], 'weight_by': ['persons', 'tours', 'trips']}
+    weights = mp_tasks.primary_slice_weights(slice_info, slice_rules, tables)
+
+    # 1 + persons + tours per household
+    np.testing.assert_array_equal(weights, [1 + 4 + 5, 1 + 1 + 1, 1 + 2 + 1, 1 + 1 + 0, 1 + 1 + 0, 1 + 3 + 2])
+
+    slice_info = {'tables': ['households', 'persons'], 'weight_by': ['income']}
+    weights = mp_tasks.primary_slice_weights(slice_info, slice_rules, tables)
+    np.testing.assert_array_equal(weights, [11, 21, 31, 41, 51, 61])
+
+    with pytest.raises(RuntimeError) as excinfo:
+        slice_info = {'tables': ['households', 'persons'], 'weight_by': ['land_use']}
+        mp_tasks.primary_slice_weights(slice_info, slice_rules, tables)
+    assert "neither a sliced table nor a column" in str(excinfo.value)
+
+
+def test_primary_slice_bins():
+
+    weights = np.array([1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 100, 10, 10, 10, 10])
+
+    bins = mp_tasks.primary_slice_bins(weights, 3)
+
+    assert set(bins) == {0, 1, 2}
+
+    # heaviest row to first bin, next rows snake back and forth across bins
+    assert bins[11] == 0
+    assert list(bins[12:16]) == [1, 2, 2, 1]
+
+    totals = np.bincount(bins, weights=weights)
+    assert abs(totals[1] - totals[2]) <= 1
+
+    # even bins for uniform weights
+    np.testing.assert_array_equal(
+        sorted(np.bincount(mp_tasks.primary_slice_bins(np.ones(10), 3))), [3, 3, 4])
+
+
+def test_work_units_run_list():
+
+    models = ['initialize_households', 'school_location', 'trip_mode_choice']
+    multiprocess_steps = [
+        {'name': 'mp_initialize', 'begin': 'initialize_households'},
+        {'name': 'mp_households', 'begin': 'school_location', 'num_processes': 2,
+         'slice': {'tables': ['households', 'persons']}},
+        {'name': 'mp_trips', 'begin': 'trip_mode_choice', 'num_processes': 2, 'work_units': 5,
+         'slice': {'tables': ['households', 'persons']}},
+    ]
+    inject.add_injectable('settings', {'models': models, 'multiprocess': True,
+                                       'multiprocess_steps': multiprocess_steps})
+
+    run_list = mp_tasks.get_run_list()
+    steps = run_list['multiprocess_steps']
+
+    assert mp_tasks.step_sub_proc_names(steps[0]) == ['mp_initialize']
+    assert mp_tasks.step_sub_proc_names(steps[1]) == ['mp_households_0', 'mp_households_1']
+    assert mp_tasks.step_sub_proc_names(steps[2]) == ['mp_trips_%s' % i for i in range(5)]
+
+    # fewer work_units than processes
+    multiprocess_steps[2]['work_units'] = 1
+    with pytest.raises(RuntimeError) as excinfo:
+        mp_tasks.get_run_list()
+    assert "bad value (1) for work_units" in str(excinfo.value)
+
+
+@pytest.mark.parametrize('transport', ['hdf5', 'npy'])
+def test_apportion_coalesce(tables, transport):
+
+    inject.add_injectable('settings', {'mp_pipeline_transport': transport})
+
+    sub_proc_names = ['mp_test_0', 'mp_test_1']
+    slice_info = {'tables': ['households', 'persons']}
+
+    # - create parent pipeline
+    pipeline.open_pipeline()
+    for table_name, df in tables.items():
+        inject.add_table(table_name, df)
+    pipeline.add_checkpoint('step1')
+    pipeline.close_pipeline()
+
+    mp_tasks.apportion_pipeline(sub_proc_names, slice_info)
+
+    # tables are handed off in column store rather than sub_proc hdf5 pipeline
+    pipeline_path = config.build_output_file_path('pipeline.h5', use_prefix=sub_proc_names[0])
+    with pd.HDFStore(pipeline_path, mode='r') as store:
+        assert ('/persons/step1' in store.keys()) == (transport == 'hdf5')
+
+    # - run a 'step' in each sub_proc pipeline
+    for process_name in sub_proc_names:
+        inject.add_injectable('pipeline_file_prefix', process_name)
+
+        pipeline.open_pipeline(resume_after='step1')
+        persons = pipeline.get_table('persons')
+        assert 0 < len(persons) < len(tables['persons'])
+        persons['age'] = persons.index * 2
+        pipeline.replace_table('persons', persons)
+        pipeline.add_checkpoint('step2')
+
+        if transport == 'npy':
+            pipeline.write_column_store(
+                {t: pipeline.get_table(t) for t in pipeline.checkpointed_tables()},
+                pipeline.last_checkpoint(), config.pipeline_file_path(pipeline.COLUMN_STORE_NAME))
+        pipeline.close_pipeline()
+
+    # sub_proc pipeline can still be reopened at apportioned checkpoint (tables unchanged since are readable)
+    inject.add_injectable('pipeline_file_prefix', sub_proc_names[0])
+    pipeline.open_pipeline(resume_after='step1')
+    assert 'age' not in pipeline.get_table('persons')
+    assert len(pipeline.get_table('tours')) > 0
+    pipeline.close_pipeline()
+
+    inject.remove_injectable('pipeline_file_prefix')
+
+    mp_tasks.coalesce_pipelines(sub_proc_names, slice_info)
+
+    pipeline.open_pipeline(resume_after='step2')
+    persons = pipeline.get_table('persons').sort_index()
+    pdt.assert_frame_equal(persons[['household_id']], tables['persons'])
+    assert (persons.age == persons.index * 2).all()
+    pdt.assert_frame_equal(pipeline.get_table('tours').sort_index(), tables['tours'])
+    pdt.assert_frame_equal(pipeline.get_table('land_use'), tables['land_use'])
+    pipeline.close_pipeline()
+
+
+def pool_test_task(injectables, output_path, fail):
+    # worker pool task that records its process name and any injectable left behind by a prior task
+    process_name = multiprocessing.current_process().name
+    prior = inject.get_injectable('pool_test_task_name', None)
+    inject.add_injectable('pool_test_task_name', process_name)
+
+    with open(output_path, 'a') as f:
+        f.write(f"{process_name},{prior}\n")
+
+    if fail:
+        raise RuntimeError("pool_test_task failed")
+
+
+def test_worker_pool(tmpdir):
+
+    output_path = str(tmpdir.join('tasks.csv'))
+
+    pool = mp_tasks.WorkerPool(1, {}, {})
+    try:
+        pool.run_task('task_0', pool_test_task, args=(output_path, False))
+        pool.run_task('task_1', pool_test_task, args=(output_path, False))
+        with pytest.raises(RuntimeError):
+            pool.run_task('task_2', pool_test_task, args=(output_path, True))
+    finally:
+        pool.close()
+
+    # tasks run under their own names with injectables reset between tasks
+    with open(output_path) as f:
+        assert f.read().splitlines() == ['task_0,None', 'task_1,None', 'task_2,None']
+
+    # worker terminates when task fails
+    assert pool.workers[0].exitcode == 1
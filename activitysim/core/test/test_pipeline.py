@@ -4,6 +4,10 @@ import os
 import logging
 import pytest
 
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+
 import tables
 
 from activitysim.core import tracing
@@ -39,6 +43,7 @@ def setup_function():
 
 
 def teardown_function(func):
+    inject.remove_injectable('settings')
     inject.clear_cache()
     inject.reinject_decorated_tables()
 
@@ -137,6 +142,83 @@ def test_pipeline_checkpoint_drop():
     pipeline.close_pipeline()
     close_handlers()
 
+
+def test_pipeline_delta_checkpoints():
+
+    inject.add_injectable('settings', {'delta_checkpoints': True})
+
+    inject.add_step('step1', steps.step1)
+    inject.add_step('step2', steps.step2)
+    inject.add_step('step_add_col', steps.step_add_col)
+
+    add_col_step = 'step_add_col.table_name=table2;column_name=c2'
+    _MODELS = [
+        'step1',
+        'step2',
+        add_col_step,
+    ]
+    pipeline.run(models=_MODELS, resume_after=None)
+
+    # only the new column was written at step_add_col
+    store = pipeline.get_pipeline_store()
+    assert list(store[pipeline.pipeline_table_key('table2', add_col_step)].columns) == ['c2']
+
+    # table is stitched together from columns written at different checkpoints
+    table2 = pipeline.read_df('table2', add_col_step)
+    assert list(table2.columns) == ['c', 'c2']
+    assert list(table2.c) == [2, 4, 6]
+    assert list(table2.c2) == [1000, 1001, 1002]
+
+    assert list(pipeline.get_table('table2', checkpoint_name='step2').columns) == ['c']
+
+    # unchanged tables are not rewritten
+    assert pipeline.get_checkpoints().table1.tolist() == ['', 'step1', 'step1', 'step1']
+
+    pipeline.close_pipeline()
+
+    # resume from stitched checkpoint
+    pipeline.open_pipeline(resume_after=add_col_step)
+
+    table2 = pipeline.get_table('table2')
+    assert list(table2.columns) == ['c', 'c2']
+    assert list(table2.c2) == [1000, 1001, 1002]
+
+    pipeline.close_pipeline()
+    close_handlers()
+
+
+def test_column_store(tmpdir):
+
+    df = pd.DataFrame({
+        'i': np.arange(5),
+        'f': np.linspace(0, 1, 5).astype(np.float32),
+        'b': [True, False, True, False, True],
+        's': ['a', 'b', 'c', 'd', 'e'],
+        'cat': pd.Categorical(['x', 'y', 'x', 'x', 'y']),
+        'n': pd.array([1, None, 3, 4, 5], dtype='Int64'),
+    }, index=pd.Index(np.arange(5) + 10, name='person_id'))
+
+    dir_path = os.path.join(str(tmpdir), 'pipeline_tables')
+    pipeline.write_column_store({'persons': df}, 'step1', dir_path)
+
+    persons = pipeline.read_column_store_table(dir_path, 'persons', 'step1')
+    pdt.assert_frame_equal(persons, df)
+
+    assert pipeline.read_column_store_table(dir_path, 'persons', 'step2') is None
+    assert pipeline.read_column_store_table(dir_path, 'households', 'step1') is None
+    assert pipeline.read_column_store_table(os.path.join(str(tmpdir), 'bogus'), 'persons', 'step1') is None
+
+    # numeric columns are memory-mapped (not copied) and can be modified without changing the store
+    assert isinstance(persons._mgr.arrays[persons.columns.get_loc('i')], np.memmap)
+    persons.loc[10, 'i'] = 100
+    assert pipeline.read_column_store_table(dir_path, 'persons', 'step1').i[10] == 0
+
+    # writing another checkpoint keeps the first
+    pipeline.write_column_store({'persons': df.head(2)}, 'step2', dir_path)
+    pdt.assert_frame_equal(pipeline.read_column_store_table(dir_path, 'persons', 'step1'), df)
+    pdt.assert_frame_equal(pipeline.read_column_store_table(dir_path, 'persons', 'step2'), df.head(2))
+
+
 # if __name__ == "__main__":
 #
 #     print "\n\ntest_pipeline_run"
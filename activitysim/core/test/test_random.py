@@ -109,3 +109,64 @@ def test_channel():
     npt.assert_almost_equal(np.asanyarray(rands).flatten(), test1_expected_rands2)
 
     rng.end_step('test_step')
+
+
+def test_philox4x32_known_answers():
+
+    # Random123 known answer test vectors for philox4x32 with 10 rounds
+    words = random.philox4x32((0, 0, 0, 0), (0, 0))
+    assert [int(w) for w in words] == [0x6627e8d5, 0xe169c58d, 0xbc57ac4c, 0x9b00dbd8]
+
+    words = random.philox4x32((0xffffffff,) * 4, (0xffffffff, 0xffffffff))
+    assert [int(w) for w in words] == [0x408f276d, 0x41c83b0e, 0xa20bc7c6, 0x6d5451fd]
+
+    words = random.philox4x32((0x243f6a88, 0x85a308d3, 0x13198a2e, 0x03707344),
+                              (0xa4093822, 0x299f31d0))
+    assert [int(w) for w in words] == [0xd16cfe09, 0x94fdcceb, 0x5001e420, 0x24126ea1]
+
+
+def test_philox_channel():
+
+    rng = random.Random()
+    rng.set_channel_type('philox')
+
+    with pytest.raises(RuntimeError) as excinfo:
+        rng.set_channel_type('bogus')
+    assert "Unknown rng_channel_type" in str(excinfo.value)
+
+    households = pd.DataFrame({
+        "data": [1, 1, 2, 2, 2],
+    }, index=[1, 2, 3, 4, 5])
+    households.index.name = 'household_id'
+
+    rng.begin_step('test_step')
+    rng.add_channel('households', households)
+
+    rands = rng.random_for_df(households, n=3)
+    assert rands.shape == (5, 3)
+    assert ((rands >= 0) & (rands < 1)).all()
+
+    # rands for a row depend only on row id and offset, not on which other rows are in df
+    rands2 = rng.random_for_df(households)
+    subset = households.iloc[[4, 0]]
+    rng.end_step('test_step')
+
+    rng.begin_step('test_step')
+    rands_subset = rng.random_for_df(subset, n=4)
+    npt.assert_almost_equal(rands_subset[:, :3], rands[[4, 0]])
+    npt.assert_almost_equal(rands_subset[:, 3], rands2[[4, 0], 0])
+
+    # choice without replacement is a permutation prefix
+    choices = rng.choice_for_df(households, [1, 2, 3, 4], 2, replace=False)
+    assert len(choices) == 10
+    for row_choices in choices.reshape(5, 2):
+        assert len(set(row_choices)) == 2
+
+    normals = rng.normal_for_df(households, mu=10, sigma=0)
+    npt.assert_almost_equal(normals, [10] * 5)
+
+    rng.end_step('test_step')
+
+    with pytest.raises(RuntimeError) as excinfo:
+        rng.set_channel_type('simple')
+    assert "call set_channel_type before the first step" in str(excinfo.value)
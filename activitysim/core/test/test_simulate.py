@@ -9,6 +9,7 @@ import pandas as pd
 import pandas.testing as pdt
 import pytest
 
+from .. import config
 from .. import inject
 
 from .. import simulate
@@ -87,3 +88,33 @@ def test_simple_simulate_chunked(data, spec):
     choices = simulate.simple_simulate(choosers=data, spec=spec, nest_spec=None, chunk_size=2)
     expected = pd.Series([1, 1, 1], index=data.index)
     pdt.assert_series_equal(choices, expected)
+
+
+def test_read_model_spec_cached(tmpdir, data_dir, spec_name):
+
+    file_path = os.path.join(str(tmpdir), spec_name)
+    with open(os.path.join(data_dir, spec_name)) as f:
+        spec_csv = f.read()
+    with open(file_path, 'w') as f:
+        f.write(spec_csv)
+
+    stats = config.file_cache_stats()
+    spec = simulate.read_model_spec(file_name=spec_name, spec_dir=str(tmpdir))
+    spec['alt0'] = 0
+
+    # second read is a cache hit and is unaffected by changes to the first copy
+    spec = simulate.read_model_spec(file_name=spec_name, spec_dir=str(tmpdir))
+    assert config.file_cache_stats()['reads'] == stats['reads'] + 1
+    assert config.file_cache_stats()['hits'] == stats['hits'] + 1
+    npt.assert_array_equal(spec.alt0.values, [1.1, 2.2, 3.3, 4.4])
+
+    # modified file is reread
+    with open(file_path, 'w') as f:
+        f.write(spec_csv.replace('1.1', '9.9'))
+    os.utime(file_path, ns=(0, os.stat(file_path).st_mtime_ns + 10**9))
+    spec = simulate.read_model_spec(file_name=spec_name, spec_dir=str(tmpdir))
+    assert spec.alt0.values[0] == 9.9
+
+    config.clear_file_cache(file_path)
+    simulate.read_model_spec(file_name=spec_name, spec_dir=str(tmpdir))
+    assert config.file_cache_stats()['reads'] == stats['reads'] + 3
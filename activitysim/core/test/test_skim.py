@@ -58,16 +58,49 @@ def test_offset_list(data):
         [52, 99, 16])
 
 
-# fixme - nan support disabled in skim.py (not sure we need it?)
-# def test_skim_nans(data):
-#     sk = skim.SkimWrapper(data)
-#
-#     orig = [5, np.nan, 1, 2]
-#     dest = [np.nan, 9, 6, 4]
-#
-#     npt.assert_array_equal(
-#         sk.get(orig, dest),
-#         [np.nan, np.nan, 16, 24])
+def test_skim_nans(data):
+    sk = skim.SkimWrapper(data)
+
+    orig = [5, np.nan, 1, 2]
+    dest = [np.nan, 9, 6, 4]
+
+    npt.assert_array_equal(
+        sk.get(orig, dest),
+        [np.nan, np.nan, 16, 24])
+
+
+def test_not_in_skim(data):
+
+    # out of range zone ids don't wrap around
+    sk = skim.SkimWrapper(data, skim.OffsetMapper(-1))
+    npt.assert_array_equal(sk.get([6, 0, 11, 2], [3, 10, 7, 7]), [52, np.nan, np.nan, 16])
+
+    offset_mapper = skim.OffsetMapper()
+    offset_mapper.set_offset_list([10, 20, 30, 40, 50, 60, 70, 80, 90, 100])
+    assert offset_mapper.offset_table is not None
+
+    sk = skim.SkimWrapper(data, offset_mapper)
+    npt.assert_array_equal(sk.get([60, 65, 5, 1000, 20], [30, 30, 30, 30, 70]), [52, np.nan, np.nan, np.nan, 16])
+
+    # sparse zone ids are mapped without a dense offset table
+    offset_mapper = skim.OffsetMapper()
+    offset_mapper.set_offset_list([1, 1000, 2000, 3000, 4000, 5000, 6000, 7000, 8000, 9000])
+    assert offset_mapper.offset_table is None
+
+    sk = skim.SkimWrapper(data, offset_mapper)
+    npt.assert_array_equal(sk.get([5000, 9000, 1000, 5], [2000, 9000, 6000, 1]), [52, 99, 16, np.nan])
+
+
+def test_dataframe_matrix():
+
+    df = pd.DataFrame({'a': [1, 2, 3, 4, 5], 'b': [10, 20, 30, 40, 50]}, index=[100, 101, 102, 103, 104])
+    dfm = skim.DataFrameMatrix(df)
+
+    npt.assert_array_equal(dfm.get(row_ids=[100, 100, 103], col_ids=['a', 'b', 'a']), [1, 10, 4])
+
+    row_ids = pd.Series([100, 105, 103], index=[7, 8, 9])
+    pdt.assert_series_equal(dfm.get(row_ids=row_ids, col_ids=['a', 'b', 'c']),
+                            pd.Series([1, np.nan, np.nan], index=[7, 8, 9]))
 
 
 def test_skims(data):
@@ -144,3 +177,92 @@ def test_3dskims(data):
         ),
         check_dtype=False
     )
+
+
+def test_skim_major_layout(data):
+
+    skim_data = np.zeros((2,) + data.shape, dtype=int)
+    skim_data[0] = data
+    skim_data[1] = data*10
+
+    skim_info = {
+        'block_offsets': {('SOV', 'AM'): (0, 0), ('SOV', 'PM'): (0, 1)},
+        'key1_block_offsets': {'SOV': (0, 0)},
+        'skim_layout': skim.SKIM_MAJOR
+    }
+    skim_dict = skim.SkimDict([skim_data], skim_info)
+
+    # each skim is a contiguous plane in skim_major layout
+    assert skim_dict.get(('SOV', 'PM')).data.flags['C_CONTIGUOUS']
+
+    df = pd.DataFrame({
+        "taz_l": [1, 9, 4],
+        "taz_r": [2, 3, 7],
+        "period": ["AM", "PM", "AM"]
+    })
+
+    skims = skim_dict.wrap("taz_l", "taz_r")
+    skims.set_df(df)
+
+    npt.assert_array_equal(skims[('SOV', 'PM')], [120, 930, 470])
+
+    skims3d = skim.SkimStack(skim_dict).wrap(left_key="taz_l", right_key="taz_r", skim_key="period")
+    skims3d.set_df(df)
+
+    npt.assert_array_equal(skims3d["SOV"], [12, 930, 47])
+
+    # unknown zones and periods are nan
+    df = pd.DataFrame({
+        "taz_l": [1, 11, 4],
+        "taz_r": [2, 3, 7],
+        "period": ["AM", "PM", "EV"]
+    })
+    skims3d.set_df(df)
+
+    npt.assert_array_equal(skims3d["SOV"], [12, np.nan, np.nan])
+
+
+def test_pruned_skims(data):
+
+    skim_data = np.zeros(data.shape + (2,), dtype=np.float32)
+    skim_data[:, :, 0] = data
+    skim_data[:, :, 1] = data*10
+
+    skim_info = {
+        'omx_shape': data.shape,
+        'block_offsets': {('SOV', 'AM'): (0, 0), ('SOV', 'PM'): (0, 1)},
+        'key1_block_offsets': {'SOV': (0, 0)},
+        'pruned_skims': ['DIST', 'HOV'],
+        'strict_skim_usage': False,
+    }
+    skim_dict = skim.SkimDict([skim_data], skim_info)
+
+    df = pd.DataFrame({
+        "taz_l": [1, 9, 4],
+        "taz_r": [2, 3, 7],
+        "period": ["AM", "PM", "AM"]
+    })
+
+    skims = skim_dict.wrap("taz_l", "taz_r")
+    skims.set_df(df)
+
+    # if not strict, lookups of pruned skims are nan (and tracked as usage)
+    npt.assert_array_equal(skims[('SOV', 'PM')], [120, 930, 470])
+    npt.assert_array_equal(skims['DIST'], [np.nan] * 3)
+    assert 'DIST' in skim_dict.usage
+
+    skims3d = skim.SkimStack(skim_dict).wrap(left_key="taz_l", right_key="taz_r", skim_key="period")
+    skims3d.set_df(df)
+
+    npt.assert_array_equal(skims3d["SOV"], [12, 930, 47])
+    npt.assert_array_equal(skims3d["HOV"], [np.nan] * 3)
+
+    # strict mode (the default) raises on lookup of pruned skims
+    del skim_info['strict_skim_usage']
+
+    with pytest.raises(RuntimeError) as excinfo:
+        skims['DIST']
+    assert "DIST was not loaded" in str(excinfo.value)
+
+    with pytest.raises(RuntimeError):
+        skims3d['HOV']
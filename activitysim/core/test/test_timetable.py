@@ -184,3 +184,45 @@ def test_basic(persons, tdd_alts):
     ends = pd.Series([10, 10, 10, 9])
     periods_available = timetable.remaining_periods_available(person_ids, starts, ends)
     pdt.assert_series_equal(periods_available, pd.Series([6, 3, 4, 3]))
+
+
+def test_footprints_and_collisions(persons, tdd_alts):
+
+    periods = list(range(4, 12))
+    footprints = tt.tdd_alt_footprints(tdd_alts.start, tdd_alts.end, periods)
+    assert footprints.dtype == np.int8
+
+    # same as footprints built from runs of state chars
+    expected = [
+        tt.C_EMPTY * (row.start - 4) +
+        (tt.C_START + tt.C_MIDDLE * (row.duration - 1) if row.duration > 0 else '') +
+        (tt.C_END if row.duration > 0 else tt.C_START_END) +
+        tt.C_EMPTY * (11 - row.end)
+        for idx, row in tdd_alts.iterrows()]
+    np.testing.assert_array_equal(footprints, np.asanyarray([list(r) for r in expected]).astype(int))
+
+    # bitwise availability agrees with COLLISION_LIST for random windows
+    prng = np.random.RandomState(0)
+    num_persons = 100
+    person_windows = tt.create_timetable_windows(pd.DataFrame(index=range(num_persons)), tdd_alts)
+    states = [tt.I_EMPTY, tt.I_START, tt.I_END, tt.I_MIDDLE, tt.I_START_END]
+    person_windows[:] = prng.choice(states, size=person_windows.shape).astype(np.int8)
+    timetable = tt.TimeTable(person_windows, tdd_alts)
+
+    person_ids = pd.Series(np.repeat(np.arange(num_persons), len(tdd_alts)))
+    tdds = pd.Series(np.tile(np.arange(len(tdd_alts)), num_persons))
+
+    x = timetable.tdd_footprints[tdds.values] + (timetable.windows[person_ids.values] << tt.I_BIT_SHIFT)
+    expected = ~np.isin(x, tt.COLLISION_LIST).any(axis=1)
+
+    available = timetable.tour_available(person_ids, tdds)
+    np.testing.assert_array_equal(available.values, expected)
+    assert 0 < available.sum() < len(available)
+
+    # available pairs enumerated directly from windows, in batches, match tour_available
+    for batch_size in [None, 7]:
+        pairs = list(timetable.tour_available_pairs(pd.Series(np.arange(num_persons)), np.arange(len(tdd_alts)),
+                                                    batch_size=batch_size))
+        row_positions = np.concatenate([rows for rows, _ in pairs])
+        tdd_positions = np.concatenate([tdds for _, tdds in pairs])
+        np.testing.assert_array_equal(row_positions * len(tdd_alts) + tdd_positions, np.flatnonzero(expected))
@@ -40,6 +40,13 @@ COLLISIONS = [
 
 COLLISION_LIST = [a + (b << I_BIT_SHIFT) for a, b in COLLISIONS]
 
+# the COLLISIONS are exactly the pairs of (non-empty) states that share a bit, unless
+# together they only make up I_START_END (e.g. I_START with I_START_END is not a collision)
+# so collisions can be detected with bitwise ops: (a & b != 0) & (a | b != I_START_END)
+
+
+# approximate number of (window row, tdd) pairs to check per batch in tour_available_pairs
+TOUR_AVAILABLE_BATCH_PAIRS = 2 ** 22
 
 # str versions of time windows period states
 C_EMPTY = str(I_EMPTY)
@@ -49,6 +56,44 @@ C_MIDDLE = str(I_MIDDLE)
 C_START_END = str(I_START_END)
 
 
+def tdd_alt_footprints(starts, ends, periods):
+    """
+    Compute time window state footprints for tdd alts with numpy broadcasting
+
+    ::
+
+      start  end      periods 4  5  6  7  8
+      5      5    ==>         0  6  0  0  0
+      5      6    ==>         0  2  4  0  0
+      5      7    ==>         0  2  7  4  0
+
+    Parameters
+    ----------
+    starts : array-like int
+        start period of each tdd alt
+    ends : array-like int
+        end period of each tdd alt
+    periods : array-like int
+        time periods (window columns)
+
+    Returns
+    -------
+    numpy.ndarray of int8 with one row per tdd alt and one column per period
+    """
+
+    starts = np.asanyarray(starts).reshape(-1, 1)
+    ends = np.asanyarray(ends).reshape(-1, 1)
+    periods = np.asanyarray(periods).reshape(1, -1)
+
+    # I_START | I_END == I_START_END for tours that start and end in the same period
+    footprints = \
+        (((periods > starts) & (periods < ends)) * I_MIDDLE) | \
+        ((periods == starts) * I_START) | \
+        ((periods == ends) * I_END)
+
+    return footprints.astype(np.int8)
+
+
 def tour_map(persons, tours, tdd_alts, persons_id_col='person_id'):
 
     sigil = {
@@ -84,14 +129,8 @@ def tour_map(persons, tours, tdd_alts, persons_id_col='person_id'):
     scheduled = np.zeros_like(agenda, dtype=int)
     row_ix_map = pd.Series(list(range(n_persons)), index=persons.index)
 
-    # construct with strings so we can create runs of strings using char * int
-    w_strings = [
-        '0' * (row.start - min_period) +
-        '1' * (row.duration + 1) +
-        '0' * (max_period - row.end)
-        for idx, row in tdd_alts.iterrows()]
-
-    window_periods = np.asanyarray([list(r) for r in w_strings]).astype(int)
+    # ones for periods from start to end of each tdd_alt
+    window_periods = (tdd_alt_footprints(tdd_alts.start, tdd_alts.end, range(min_period, max_period + 1)) != 0) * 1
     window_periods_df = pd.DataFrame(data=window_periods, index=tdd_alts.index)
 
     for keys, nth_tours in tours.groupby(['tour_type', 'tour_type_num'], sort=True):
@@ -201,20 +240,14 @@ class TimeTable(object):
         int_time_periods = [int(c) for c in windows_df.columns.values]
         self.time_ix = pd.Series(list(range(len(windows_df.columns))), index=int_time_periods)
 
-        # - pre-compute window state footprints for every tdd_alt
-        min_period = min(int_time_periods)
-        max_period = max(int_time_periods)
-        # construct with strings so we can create runs of strings using char * int
-        w_strings = [
-            C_EMPTY * (row.start - min_period) +
-            (C_START + C_MIDDLE * (row.duration - 1) if row.duration > 0 else '') +
-            (C_END if row.duration > 0 else C_START_END) +
-            (C_EMPTY * (max_period - row.end))
-            for idx, row in tdd_alts_df.iterrows()]
-
+        # - pre-compute (int8) window state footprints for every tdd_alt
         # we want range index so we can use raw numpy
         assert (tdd_alts_df.index == list(range(tdd_alts_df.shape[0]))).all()
-        self.tdd_footprints = np.asanyarray([list(r) for r in w_strings]).astype(int)
+        self.tdd_footprints = tdd_alt_footprints(tdd_alts_df.start, tdd_alts_df.end, int_time_periods)
+
+        # windows column indexes of start and end periods of every tdd_alt
+        self.tdd_start_ix = tdd_alts_df.start.map(self.time_ix).values
+        self.tdd_end_ix = tdd_alts_df.end.map(self.time_ix).values
 
     def begin_transaction(self, transaction_loggers):
         """
@@ -318,13 +351,80 @@ class TimeTable(object):
 
         # t0 = tracing.print_elapsed_time("slice_windows_by_row_id", t0, debug=True)
 
-        x = tour_footprints + (windows << I_BIT_SHIFT)
+        # collisions are periods where footprint and window states share a bit (see COLLISIONS)
+        # unless they combine to I_START_END (reuse sliced int8 arrays to avoid temporaries)
+        overlap = np.bitwise_and(tour_footprints, windows) != 0
+        combined = np.bitwise_or(tour_footprints, windows, out=windows) != I_START_END
+        collisions = np.logical_and(overlap, combined, out=overlap)
 
-        available = ~np.isin(x, COLLISION_LIST).any(axis=1)
+        available = ~collisions.any(axis=1)
         available = pd.Series(available, index=window_row_ids.index)
 
         return available
 
+    def tour_available_pairs(self, window_row_ids, tdds, batch_size=None):
+        """
+        Enumerate the available pairs of the cross product of window_row_ids and tdds
+        (i.e. the pairs for which tour_available would be True) without building the cross product.
+
+        A tour's footprint only collides with a window at its start period (if the window is I_START
+        or I_MIDDLE), its end period (if I_END or I_MIDDLE), a same-period start and end (if I_MIDDLE)
+        or periods in between (if not I_EMPTY), so availability can be checked for all tdds at once
+        from a few per-period flags and a running count of occupied periods of each window.
+
+        Window rows are processed in batches of batch_size rows (by default enough rows to check
+        about TOUR_AVAILABLE_BATCH_PAIRS pairs) so that temporaries are bounded by batch size.
+
+        Parameters
+        ----------
+        window_row_ids : pandas Series
+            series of window_row_ids (e.g. indexed by tour_id)
+        tdds : array-like
+            tdd_alt ids
+        batch_size : int or None
+            number of window rows per batch
+
+        Yields
+        ------
+        row_positions : numpy.ndarray of int
+            positions in window_row_ids of available pairs
+        tdd_positions : numpy.ndarray of int
+            positions in tdds of available pairs
+        """
+
+        tdds = np.asanyarray(tdds).astype(int)
+        start_ix = self.tdd_start_ix[tdds]
+        end_ix = self.tdd_end_ix[tdds]
+        same_period = (start_ix == end_ix)
+
+        # last period before end (ignored for same_period tdds)
+        before_end_ix = np.maximum(end_ix - 1, 0)
+
+        row_ixs = window_row_ids.map(self.window_row_ix).values
+
+        if batch_size is None:
+            batch_size = max(1, TOUR_AVAILABLE_BATCH_PAIRS // max(len(tdds), 1))
+
+        for i in range(0, len(row_ixs), batch_size):
+
+            windows = self.windows[row_ixs[i:i + batch_size]]
+
+            not_middle = windows != I_MIDDLE
+            start_ok = not_middle & (windows != I_START)
+            end_ok = not_middle & (windows != I_END)
+
+            # number of occupied periods up to and including each period
+            occupied = np.cumsum(windows != I_EMPTY, axis=1)
+            between_empty = occupied[:, before_end_ix] == occupied[:, start_ix]
+
+            available = np.where(same_period,
+                                 not_middle[:, start_ix],
+                                 start_ok[:, start_ix] & end_ok[:, end_ix] & between_empty)
+
+            row_positions, tdd_positions = np.nonzero(available)
+
+            yield row_positions + i, tdd_positions
+
     def assign(self, window_row_ids, tdds):
         """
         Assign tours (represented by tdd alt ids) to persons
@@ -449,32 +549,29 @@ class TimeTable(object):
 
         time_col_ixs = periods.map(self.time_ix).values
 
-        # sliced windows with 1s where windows state is I_MIDDLE and 0s elsewhere
-        available = (self.slice_windows_by_row_id(window_row_ids) != I_MIDDLE) * 1
+        # sliced windows with True where windows state is I_MIDDLE and False elsewhere
+        unavailable = self.slice_windows_by_row_id(window_row_ids) == I_MIDDLE
 
         # padding periods not available
-        available[:, 0] = 0
-        available[:, -1] = 0
+        unavailable[:, 0] = True
+        unavailable[:, -1] = True
 
-        # column idxs of windows
-        num_rows, num_cols = available.shape
-        time_col_ix_map = np.tile(np.arange(0, num_cols), num_rows).reshape(num_rows, num_cols)
-        # 0 1 2 3 4 5...
-        # 0 1 2 3 4 5...
+        # column idxs of windows (broadcast across rows)
+        num_rows, num_cols = unavailable.shape
+        time_col_ix_map = np.arange(0, num_cols).reshape(1, num_cols)
         # 0 1 2 3 4 5...
 
         if before:
-            # ones after specified time, zeroes before
-            before_mask = (time_col_ix_map < time_col_ixs.reshape(num_rows, 1)) * 1
-            # index of first unavailable window after time
-            first_unavailable = np.where((1-available)*before_mask, time_col_ix_map, 0).max(axis=1)
+            # True before specified time, False after
+            unavailable &= (time_col_ix_map < time_col_ixs.reshape(num_rows, 1))
+            # index of last unavailable window before time
+            first_unavailable = np.where(unavailable, time_col_ix_map, 0).max(axis=1)
             available_run_length = time_col_ixs - first_unavailable - 1
         else:
-            # ones after specified time, zeroes before
-            after_mask = (time_col_ix_map > time_col_ixs.reshape(num_rows, 1)) * 1
+            # True after specified time, False before
+            unavailable &= (time_col_ix_map > time_col_ixs.reshape(num_rows, 1))
             # index of first unavailable window after time
-            first_unavailable = \
-                np.where((1 - available) * after_mask, time_col_ix_map, num_cols).min(axis=1)
+            first_unavailable = np.where(unavailable, time_col_ix_map, num_cols).min(axis=1)
             available_run_length = first_unavailable - time_col_ixs - 1
 
         return pd.Series(available_run_length, index=window_row_ids.index)
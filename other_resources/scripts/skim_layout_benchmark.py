@@ -0,0 +1,116 @@
+# ActivitySim
+# See full license in LICENSE.txt.
+
+"""
+Compare skim lookup throughput for the od_major and skim_major skim_layouts
+using a synthetic skim set.
+
+    python skim_layout_benchmark.py --zones 1500 --skims 40 --lookups 5000000
+"""
+
+import argparse
+import time
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from activitysim.core import skim
+
+TIME_PERIODS = ['EA', 'AM', 'MD', 'PM', 'EV']
+
+
+def synthetic_skim_dict(num_zones, num_skims, skim_layout):
+
+    # - num_skims skims, keyed (SKIM_<n>, <time_period>) in a single block
+    block_offsets = OrderedDict()
+    key1_block_offsets = OrderedDict()
+    for i in range(num_skims):
+        key1 = 'SKIM_%s' % (i // len(TIME_PERIODS))
+        block_offsets[(key1, TIME_PERIODS[i % len(TIME_PERIODS)])] = (0, i)
+        key1_block_offsets.setdefault(key1, (0, i))
+
+    if skim_layout == skim.SKIM_MAJOR:
+        shape = (num_skims, num_zones, num_zones)
+    else:
+        shape = (num_zones, num_zones, num_skims)
+
+    block_data = np.random.RandomState(0).rand(*shape).astype(np.float32)
+
+    skim_info = {
+        'omx_shape': (num_zones, num_zones),
+        'num_skims': num_skims,
+        'dtype': np.float32,
+        'block_offsets': block_offsets,
+        'key1_block_offsets': key1_block_offsets,
+        'skim_layout': skim_layout,
+    }
+
+    skim_dict = skim.SkimDict([block_data], skim_info)
+    skim_dict.offset_mapper.set_offset_int(-1)
+
+    return skim_dict
+
+
+def time_it(label, f, repeat):
+
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        f()
+    seconds = (time.perf_counter() - t0) / repeat
+    return label, seconds
+
+
+def benchmark(skim_layout, num_zones, num_skims, num_lookups, repeat):
+
+    skim_dict = synthetic_skim_dict(num_zones, num_skims, skim_layout)
+    skim_stack = skim.SkimStack(skim_dict)
+
+    prng = np.random.RandomState(1)
+    df = pd.DataFrame({
+        'orig': prng.randint(1, num_zones + 1, num_lookups),
+        'dest': prng.randint(1, num_zones + 1, num_lookups),
+        'period': prng.choice(TIME_PERIODS, num_lookups)
+    })
+
+    od_skims = skim_dict.wrap('orig', 'dest')
+    od_skims.set_df(df)
+
+    stack_skims = skim_stack.wrap(left_key='orig', right_key='dest', skim_key='period')
+    stack_skims.set_df(df)
+
+    skim_keys = list(skim_dict.skim_info['block_offsets'].keys())
+
+    results = [
+        time_it('SkimDictWrapper lookup', lambda: [od_skims[k] for k in skim_keys[:10]], repeat),
+        time_it('SkimStackWrapper lookup', lambda: stack_skims['SKIM_0'], repeat),
+        time_it('full skim ravel', lambda: [skim_dict.get(k).data.ravel() for k in skim_keys[:10]], repeat),
+    ]
+
+    return results
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--zones', type=int, default=1500, help='number of zones (default 1500)')
+    parser.add_argument('--skims', type=int, default=40, help='number of skims (default 40)')
+    parser.add_argument('--lookups', type=int, default=5000000, help='number of O-D lookups (default 5M)')
+    parser.add_argument('--repeat', type=int, default=3, help='timing repetitions (default 3)')
+    args = parser.parse_args()
+
+    print("%s zones, %s skims, %s lookups" % (args.zones, args.skims, args.lookups))
+
+    timings = {}
+    for skim_layout in skim.SKIM_LAYOUTS:
+        for label, seconds in benchmark(skim_layout, args.zones, args.skims, args.lookups, args.repeat):
+            timings.setdefault(label, {})[skim_layout] = seconds
+
+    df = pd.DataFrame(timings).T
+    df['speedup'] = df[skim.OD_MAJOR] / df[skim.SKIM_MAJOR]
+    print(df.to_string(float_format=lambda x: '%.4f' % x))
+
+
+if __name__ == '__main__':
+    main()